@@ -1,183 +1,549 @@
+import time
+_IMPORT_STARTED = time.perf_counter() # For the startup report
+
+import contextlib
+import functools
+import logging
 import os
-from flask import Flask, render_template, request, jsonify
+import threading
+from flask import Blueprint, Flask, Response, render_template, request, jsonify
 
 # --- Imports from your src ---
-# Ensure these files exist in the src folder with the correct classes
-from src.content import ContentManager
-from src.student import Student
-from src.tracers import TransformerKnowledgeTracer # Using placeholder for now
-from src.policies import SimpleDifficultyPolicy
-from src.tutor import Tutor
-
-# --- Create and configure the Flask App ---
-app = Flask(__name__)
-# The template folder is expected to be named "templates" by default
-print("Flask app created.")
+# Only the light modules are imported here. Content, tracer (torch, once the
+# real model is on), policies (NumPy), store (sqlite3) and the tutor itself
+# are imported by TutorServices when they are first needed.
+from src.sessions import EPOCH_HEADER, SessionManager
+from src.logs import configure_logging
+from src.metrics import REGISTRY, REQUEST_LATENCY, timed
+from src import wire
+
+# --- Logging ---
+# Records are queued and written by a background thread; set
+# TUTOR_LOG_LEVEL=DEBUG (or TUTOR_LOG_LEVELS=src.tutor=DEBUG,...) for per-turn detail.
+configure_logging()
+logger = logging.getLogger("app")
 
 # --- Define Data File Paths ---
 # Use os.path.join for cross-platform compatibility
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.environ.get('TUTOR_DATA_DIR', os.path.join(BASE_DIR, 'data'))
 MODEL_DIR = os.path.join(BASE_DIR, 'model')
 
 CONCEPTS_FILE = os.path.join(DATA_DIR, 'knowledge.json')
 QUESTIONS_FILE = os.path.join(DATA_DIR, 'question.json')
 LESSONS_FILE = os.path.join(DATA_DIR, 'lesson.json')
+# Compiled content (python -m src.content_store data/ data/content.bin); used instead of the JSON files if set
+CONTENT_FILE = os.environ.get('TUTOR_CONTENT_FILE') or None
+# Seconds between checks for changed content files; 0 turns hot reload off
+CONTENT_RELOAD_SECONDS = float(os.environ.get('TUTOR_CONTENT_RELOAD_SECONDS', 0))
 MODEL_FILE_PATH = os.path.join(MODEL_DIR, 'model.pt') # Placeholder path
+# --- Tracer selection ---
+# "placeholder": overall accuracy for every concept; "windowed": the trained
+# model from src/kt_training.py (python -m src.kt_training --store state/students.db)
+TRACER_NAME = os.environ.get('TUTOR_TRACER', 'placeholder')
+TRACER_MODEL_FILE = os.environ.get('TUTOR_TRACER_MODEL', os.path.join(MODEL_DIR, 'tracer.npz'))
+STORE_DIR = os.path.join(BASE_DIR, 'state')
+STORE_FILE = os.environ.get('TUTOR_STORE_PATH', os.path.join(STORE_DIR, 'students.db'))
+STORE_SNAPSHOT_EVERY = int(os.environ.get('TUTOR_STORE_SNAPSHOT_EVERY', 200)) # Answers between snapshots
+# --- State backend ---
+# "sqlite": StudentStore at TUTOR_STORE_PATH (shared by the processes of one machine);
+# "socket": a state server (python -m src.shared_store) at TUTOR_STATE_ADDRESS, shared by every worker;
+# "memory": this process only (tests, a single worker)
+STATE_BACKEND = os.environ.get('TUTOR_STATE_BACKEND', 'sqlite')
+STATE_ADDRESS = os.environ.get('TUTOR_STATE_ADDRESS', os.path.join(STORE_DIR, 'state.sock'))
 
 LATENT_DIM_D = 32 # Example dimension for student state
 
-# --- Global variable to hold the tutor instance ---
-# We use None initially and initialize in a try block
-tutor_instance = None
+# --- Policy selection ---
+# "difficulty": hardest unseen question first; "mastery": vectorized mastery-targeted selection
+POLICY_NAME = os.environ.get('TUTOR_POLICY', 'difficulty')
+
+# --- Concept scheduling ---
+# If set (e.g. 0.8), concepts the tracer already rates at or above this mastery are skipped
+MASTERY_THRESHOLD = float(os.environ['TUTOR_MASTERY_THRESHOLD']) if os.environ.get('TUTOR_MASTERY_THRESHOLD') else None
+
+# --- Session settings ---
+SESSION_COOKIE_NAME = 'tutor_session'
+MAX_SESSIONS = int(os.environ.get('TUTOR_MAX_SESSIONS', 50000)) # LRU bound per worker
+SESSION_TTL_SECONDS = int(os.environ.get('TUTOR_SESSION_TTL', 3600)) # Idle time before eviction
+
+# --- Tracer batching settings ---
+# A batch size of 1 turns micro-batching off (each answer runs its own step)
+TRACER_BATCH_SIZE = int(os.environ.get('TUTOR_TRACER_BATCH_SIZE', 1))
+TRACER_BATCH_WAIT_MS = float(os.environ.get('TUTOR_TRACER_BATCH_WAIT_MS', 2.0))
 
-# --- Initialize All Components ---
-try:
-    print("--- Initializing Tutor System ---")
-    
-    # Create necessary directories if they don't exist (useful locally)
+# --- Prefetch settings ---
+# Threads that precompute the next action for both answer outcomes while
+# the student is reading a question; 0 turns prefetch off
+PREFETCH_WORKERS = int(os.environ.get('TUTOR_PREFETCH_WORKERS', 0))
+
+# --- Startup ---
+# Build the read-only components (content, tracer weights, policy) at import
+# time, e.g. in a pre-fork parent (gunicorn --preload) so that workers share
+# them copy-on-write. Otherwise everything is built on the first request.
+PRELOAD = os.environ.get('TUTOR_PRELOAD', '').lower() in ('1', 'true', 'yes')
+
+def _create_data_files():
+    """Creates the data/model directories and dummy files if missing (useful locally)."""
     os.makedirs(DATA_DIR, exist_ok=True)
     os.makedirs(MODEL_DIR, exist_ok=True)
-    
+
     # Create dummy data files if they don't exist (for initial run)
     if not os.path.exists(CONCEPTS_FILE):
         with open(CONCEPTS_FILE, 'w') as f: f.write('{"concepts": [], "prerequisites": []}')
-        print(f"Created dummy {CONCEPTS_FILE}")
+        logger.info("Created dummy %s", CONCEPTS_FILE)
     if not os.path.exists(QUESTIONS_FILE):
          with open(QUESTIONS_FILE, 'w') as f: f.write('[]')
-         print(f"Created dummy {QUESTIONS_FILE}")
+         logger.info("Created dummy %s", QUESTIONS_FILE)
     if not os.path.exists(LESSONS_FILE):
          with open(LESSONS_FILE, 'w') as f: f.write('{}')
-         print(f"Created dummy {LESSONS_FILE}")
-         
+         logger.info("Created dummy %s", LESSONS_FILE)
+
     # Create dummy model file if it doesn't exist
     if not os.path.exists(MODEL_FILE_PATH):
         with open(MODEL_FILE_PATH, 'w') as f: f.write('dummy model data')
-        print(f"Created dummy {MODEL_FILE_PATH}")
+        logger.info("Created dummy %s", MODEL_FILE_PATH)
 
 
-    print("Initializing ContentManager...")
-    content_manager = ContentManager(
-        concepts_file=CONCEPTS_FILE,
-        questions_file=QUESTIONS_FILE,
-        lessons_file=LESSONS_FILE
-    )
-    print("ContentManager initialized.")
-
-    # Need actual content for policy to work, get from manager
-    # Handle potential empty files from dummy creation
-    questions_bank = content_manager.questions if isinstance(content_manager.questions, list) else []
-    examples_bank = content_manager.lessons if isinstance(content_manager.lessons, dict) else {}
-    all_concepts_data = content_manager.concepts if isinstance(content_manager.concepts, dict) else {}
-
-    print(f"Loaded {len(questions_bank)} questions, {len(examples_bank)} examples, and {len(all_concepts_data.get('concepts', []))} concepts.")
-
-    print("Initializing Student...")
-    # Using a fixed student ID for this simple web version
-    student = Student(student_id="web_user_01", latent_dim_d=LATENT_DIM_D)
-    print("Student initialized.")
-
-    print("Initializing Tracer...")
-    # Inject content_manager for the real tracer later
-    tracer = TransformerKnowledgeTracer(
-        model_path=MODEL_FILE_PATH,
-        content_manager=content_manager # Needed even for placeholder if it accesses content
-    )
-    print("Tracer initialized.")
+class TutorServices:
+    """
+    Builds the tutor's components on first use instead of at import time.
+
+    Shared part (content, tracer model, policy): read-only after loading,
+    so it may be built in a pre-fork parent (preload) and inherited by
+    every worker copy-on-write.
+    Process part (student store, session registry, tracer batching thread,
+    prefetch pool, content watcher): holds threads and SQLite connections,
+    which do not survive fork, so each process builds its own the first
+    time it serves a request.
+
+    Time spent in each phase is kept in `timings` and exported as
+    tutor_startup_seconds.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._shared_ready = False
+        self._process_pid = None # Process that built the process part
+        self.error = None        # Set if initialization failed
+        self.timings = {}
+        self.content_manager = None
+        self.base_tracer = None
+        self.tracer = None
+        self.policy = None
+        self.student_store = None
+        self.prefetch_executor = None
+        self.session_manager = None
+
+    def _timed(self, phase, build):
+        started = time.perf_counter()
+        result = build()
+        self.timings[phase] = time.perf_counter() - started
+        return result
+
+    def preload(self):
+        """Builds the shared part now. Returns False if initialization failed."""
+        with self._lock:
+            return self._ensure_shared()
+
+    def get_session_manager(self):
+        """The session registry, built on first use; None if initialization failed."""
+        if self.session_manager is not None and self._process_pid == os.getpid():
+            return self.session_manager
+        with self._lock:
+            if self._process_pid != os.getpid() and self._ensure_shared():
+                self._build_process_part()
+            return self.session_manager if self.error is None else None
+
+    def _ensure_shared(self):
+        if self._shared_ready:
+            return True
+        if self.error is not None:
+            return False
+        try:
+            logger.info("--- Initializing Tutor System ---")
+            self._timed("data_files", _create_data_files)
+            self._timed("content", self._build_content)
+            self._timed("tracer", self._build_tracer)
+            self._timed("policy", self._build_policy)
+            self._shared_ready = True
+            return True
+        except Exception as e:
+            self._fail(e)
+            return False
+
+    def _build_content(self):
+        from src.content import ContentManager
+
+        logger.info("Initializing ContentManager...")
+        self.content_manager = ContentManager(
+            concepts_file=CONCEPTS_FILE,
+            questions_file=QUESTIONS_FILE,
+            lessons_file=LESSONS_FILE,
+            compiled_file=CONTENT_FILE
+        )
+        index = self.content_manager.index
+        logger.info("Loaded %d questions, %d examples, and %d concepts.",
+                    index.num_questions, index.num_lessons, index.num_concepts)
+
+    def _build_tracer(self):
+        from src.tracers import TransformerKnowledgeTracer, WindowedKnowledgeTracer
+
+        logger.info("Initializing Tracer (%s)...", TRACER_NAME)
+        if TRACER_NAME == 'windowed':
+            self.base_tracer = WindowedKnowledgeTracer(
+                model_path=TRACER_MODEL_FILE,
+                content_manager=self.content_manager # Maps questions to concept tokens
+            )
+        else:
+            self.base_tracer = TransformerKnowledgeTracer(
+                model_path=MODEL_FILE_PATH,
+                content_manager=self.content_manager # Needed even for placeholder if it accesses content
+            )
+        self.base_tracer.load() # Model weights: loaded once, shared by forked workers
+        self.tracer = self.base_tracer
+        logger.info("Tracer initialized.")
+
+    def _build_policy(self):
+        from src.policies import MasteryTargetPolicy, SimpleDifficultyPolicy
+
+        logger.info("Initializing Policy...")
+        # Handle potential empty files from dummy creation (compiled banks are lazy sequences)
+        policy_class = MasteryTargetPolicy if POLICY_NAME == 'mastery' else SimpleDifficultyPolicy
+        self.policy = policy_class(
+            question_bank=self.content_manager.questions or [],
+            example_bank=self.content_manager.lessons or {},
+            content_manager=self.content_manager # Use the prebuilt content index
+        )
+        logger.info("Policy initialized.")
+
+    def _build_process_part(self):
+        try:
+            self._timed("process", self._build_process_components)
+            self.timings["first_request"] = time.perf_counter() - _IMPORT_STARTED
+            logger.info("--- Initialization Complete (pid %d): %s ---", os.getpid(),
+                        ", ".join(f"{k} {v * 1000:.1f}ms" for k, v in self.timings.items()))
+        except Exception as e:
+            self._fail(e)
+
+    def _build_process_components(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from src.batching import BatchingTracer
+        from src.shared_store import MemoryStudentStore, SocketStudentStore
+        from src.store import StudentStore
+        from src.student import Student
+        from src.tutor import Tutor
+
+        content_manager, policy = self.content_manager, self.policy
+        tracer = self.base_tracer
+        if TRACER_BATCH_SIZE > 1:
+            # Concurrent sessions share one batched tracer pass
+            tracer = BatchingTracer(
+                tracer,
+                max_batch_size=TRACER_BATCH_SIZE,
+                max_wait_ms=TRACER_BATCH_WAIT_MS
+            )
+        self.tracer = tracer
+
+        if CONTENT_RELOAD_SECONDS > 0:
+            # New content is swapped in without dropping live sessions
+            content_manager.watch(CONTENT_RELOAD_SECONDS)
+
+        logger.info("Initializing Student Store (%s)...", STATE_BACKEND)
+        # Snapshots record which tracer wrote them (see src.store.restore_student)
+        tracer_kind = self.base_tracer.state_kind
+        if STATE_BACKEND == 'socket':
+            student_store = SocketStudentStore(STATE_ADDRESS, snapshot_every=STORE_SNAPSHOT_EVERY,
+                                               tracer_kind=tracer_kind)
+        elif STATE_BACKEND == 'memory':
+            student_store = MemoryStudentStore(snapshot_every=STORE_SNAPSHOT_EVERY, tracer_kind=tracer_kind)
+        else:
+            student_store = StudentStore(STORE_FILE, snapshot_every=STORE_SNAPSHOT_EVERY, tracer_kind=tracer_kind)
+        self.student_store = student_store
+        logger.info("Student Store initialized.")
+
+        prefetch_executor = None
+        if PREFETCH_WORKERS > 0:
+            prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+            logger.info("Next-action prefetch on (%d workers).", PREFETCH_WORKERS)
+        self.prefetch_executor = prefetch_executor
+
+        logger.info("Initializing Session Manager...")
+        # Each learner gets their own Student and Tutor; content, policy
+        # and tracer are read-only and shared by every session.
+        def create_session(session_id):
+            student = Student(student_id=session_id, latent_dim_d=LATENT_DIM_D)
+            tutor = Tutor(student, policy, tracer, content_manager, store=student_store,
+                          mastery_threshold=MASTERY_THRESHOLD, prefetch_executor=prefetch_executor)
+            # Lazy load: a student's stored progress is only read on first access
+            student_store.restore(tutor)
+            return student, tutor
+
+        def evict_session(session):
+            # Compact the log so the next load is a single snapshot read.
+            # Pinned sessions are never evicted, so no request holds this lock.
+            with session.lock:
+                student_store.snapshot_if_dirty(session.student)
+
+        session_manager = SessionManager(
+            create_session,
+            max_sessions=MAX_SESSIONS,
+            ttl_seconds=SESSION_TTL_SECONDS,
+            on_evict=evict_session
+        )
 
-    print("Initializing Policy...")
-    policy = SimpleDifficultyPolicy(
-        question_bank=questions_bank,
-        example_bank=examples_bank
+        # Scrape-time gauges for /metrics
+        REGISTRY.gauge("tutor_active_sessions", "Sessions currently held in memory.",
+                       lambda: len(session_manager))
+        REGISTRY.gauge("tutor_sessions_created", "Sessions created since start.",
+                       lambda: session_manager.created_count)
+        REGISTRY.gauge("tutor_sessions_evicted", "Sessions evicted since start.",
+                       lambda: session_manager.evicted_count)
+        if isinstance(tracer, BatchingTracer):
+            REGISTRY.gauge("tutor_tracer_batch_stats", "Tracer micro-batching statistics.",
+                           lambda: {k: v for k, v in tracer.stats().items() if not isinstance(v, dict)},
+                           label_name="stat")
+
+        self.session_manager = session_manager
+        self._process_pid = os.getpid()
+        logger.info("All tutor components initialized successfully.")
+
+    def _fail(self, e):
+        logger.critical("--- FATAL ERROR DURING INITIALIZATION ---")
+        logger.exception("Failed to initialize components: %s", e)
+        # Routes answer 500 "Tutor failed to initialize" from now on
+        self.error = e
+
+
+SERVICES = TutorServices()
+REGISTRY.gauge("tutor_startup_seconds", "Time spent in each startup phase.",
+               lambda: dict(SERVICES.timings), label_name="phase")
+
+
+def preload():
+    """
+    Builds the shared components now (call in a pre-fork parent, or set
+    TUTOR_PRELOAD=1). Returns False if initialization failed.
+    """
+    return SERVICES.preload()
+
+# --- Session Helpers ---
+@contextlib.contextmanager
+def _locked_session(session_manager):
+    """
+    Finds (or creates) the caller's session from the session cookie and
+    holds its lock for the block. Yields (session, session_id).
+    """
+    session_id = request.cookies.get(SESSION_COOKIE_NAME)
+    if not SessionManager.is_valid_session_id(session_id):
+        session_id = SessionManager.new_session_id()
+    # Behind the serve.py router: the owner epoch, to reload a session served elsewhere
+    epoch = request.headers.get(EPOCH_HEADER)
+    # Pinned for the whole request, so it cannot be evicted (and restored a second time) mid-answer
+    session = session_manager.get(session_id, epoch=epoch, pin=True)
+    try:
+        with session.lock:
+            session_manager.refresh(session, epoch)
+            yield session, session_id
+    finally:
+        session_manager.release(session)
+
+def _session_response(payload, session_id):
+    """Builds a JSON response and (re)sets the session cookie."""
+    response = jsonify(payload)
+    response.set_cookie(
+        SESSION_COOKIE_NAME,
+        session_id,
+        max_age=SESSION_TTL_SECONDS,
+        httponly=True,
+        samesite='Lax'
     )
-    print("Policy initialized.")
-
-    print("Initializing Tutor...")
-    # Create the single tutor instance
-    tutor_instance = Tutor(student, policy, tracer, content_manager)
-    print("All tutor components initialized successfully.")
-    print("--- Initialization Complete ---")
-
-except Exception as e:
-    print(f"--- FATAL ERROR DURING INITIALIZATION ---")
-    print(f"Failed to initialize components: {e}")
-    # Set tutor_instance to None so web routes know initialization failed
-    tutor_instance = None
-    # Re-raise the exception to stop the app if needed, or handle differently
-    # raise e
+    return response
+
+def _timed_route(route):
+    """Decorator: records the handler's latency under the given route label."""
+    timer = REQUEST_LATENCY.labels(route)
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with timed(timer):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
 
 # --- Flask Web Routes ---
-@app.route('/')
+bp = Blueprint('tutor', __name__)
+
+@bp.route('/')
 def index():
     # Render the HTML template
     return render_template('index.html')
 
-@app.route('/start', methods=['POST'])
+@bp.route('/start', methods=['POST'])
+@_timed_route('/start')
 def start_session():
-    if tutor_instance is None:
+    session_manager = SERVICES.get_session_manager()
+    if session_manager is None:
         return jsonify({"error": "Tutor failed to initialize"}), 500
     try:
-        action_type, content, current_concept_id = tutor_instance.start_session()
-        # Send the first action and the full list of concepts
-        return jsonify({
-            "action": {"type": action_type, "content": content},
-            "concepts": tutor_instance.concepts_to_teach, # Send sorted list
-            "current_concept_id": current_concept_id
-        })
+        protocol = wire.parse_protocol(request.args.get('v'))
+        with _locked_session(session_manager) as (session, session_id):
+            tutor = session.tutor
+            action = tutor.start_session()
+            # Send the first action and the content version (protocol 1 also gets the concept list)
+            return _session_response(
+                wire.start_payload(action, tutor, tutor.content_manager.index, protocol, session), session_id
+            )
     except Exception as e:
-        print(f"Error in /start route: {e}")
+        logger.exception("Error in /start route: %s", e)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/answer', methods=['POST'])
+@bp.route('/answer', methods=['POST'])
+@_timed_route('/answer')
 def handle_answer():
-    if tutor_instance is None:
+    session_manager = SERVICES.get_session_manager()
+    if session_manager is None:
         return jsonify({"error": "Tutor failed to initialize"}), 500
     try:
-        data = request.json
-        question_id = data.get('question_id')
-        user_answer = data.get('user_answer')
-        response_time_ms = data.get('response_time_ms')
-
-        if question_id is None or user_answer is None or response_time_ms is None:
-             return jsonify({"error": "Missing 'question_id', 'user_answer', or 'response_time_ms'"}), 400
-
-        action_type, content, current_concept_id = tutor_instance.submit_answer(
-            question_id,
-            user_answer,
-            response_time_ms
-        )
-        # Send the next action and the current concept ID
-        return jsonify({
-            "action": {"type": action_type, "content": content},
-            "current_concept_id": current_concept_id
-        })
+        protocol = wire.parse_protocol(request.args.get('v'))
+        try:
+            question_id, user_answer, response_time_ms = wire.parse_answer(request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with _locked_session(session_manager) as (session, session_id):
+            tutor = session.tutor
+            action = tutor.submit_answer(
+                question_id,
+                user_answer,
+                response_time_ms
+            )
+            # Send the next action and the current concept ID
+            payload = wire.action_payload(action, tutor.content_manager.index, protocol, session)
+        return _session_response(payload, session_id)
     except Exception as e:
-        print(f"Error in /answer route: {e}")
+        logger.exception("Error in /answer route: %s", e)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/next_concept', methods=['POST'])
+@bp.route('/answers', methods=['POST'])
+@_timed_route('/answers')
+def handle_answers():
+    """
+    A batch of answers (e.g. to /lookahead questions answered offline),
+    graded in order. Returns the action after the last one.
+    """
+    session_manager = SERVICES.get_session_manager()
+    if session_manager is None:
+        return jsonify({"error": "Tutor failed to initialize"}), 500
+    try:
+        protocol = wire.parse_protocol(request.args.get('v'))
+        try:
+            answers = wire.parse_answers(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with _locked_session(session_manager) as (session, session_id):
+            tutor = session.tutor
+            for question_id, user_answer, response_time_ms in answers:
+                action = tutor.submit_answer(question_id, user_answer, response_time_ms)
+            payload = wire.action_payload(action, tutor.content_manager.index, protocol, session)
+        payload["accepted"] = len(answers)
+        return _session_response(payload, session_id)
+    except Exception as e:
+        logger.exception("Error in /answers route: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/next_concept', methods=['POST'])
+@_timed_route('/next_concept')
 def next_concept():
-    if tutor_instance is None:
+    session_manager = SERVICES.get_session_manager()
+    if session_manager is None:
         return jsonify({"error": "Tutor failed to initialize"}), 500
     try:
-        # Manually advance tutor's concept index
-        tutor_instance.current_concept_index += 1
-        print(f"[App] Frontend requested next concept. Moving to index {tutor_instance.current_concept_index}.")
-        
-        # Get the first action for the *new* concept
-        action_type, content, current_concept_id = tutor_instance._get_next_action()
-        
-        return jsonify({
-            "action": {"type": action_type, "content": content},
-            "current_concept_id": current_concept_id
-        })
+        protocol = wire.parse_protocol(request.args.get('v'))
+        with _locked_session(session_manager) as (session, session_id):
+            # Advance the tutor and get the first action for the *new* concept
+            logger.debug("Frontend requested next concept.")
+            tutor = session.tutor
+            action = tutor.advance_concept()
+            payload = wire.action_payload(action, tutor.content_manager.index, protocol, session)
+        return _session_response(payload, session_id)
     except Exception as e:
-        print(f"Error in /next_concept route: {e}")
+        logger.exception("Error in /next_concept route: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@bp.route('/lookahead', methods=['GET'])
+@_timed_route('/lookahead')
+def lookahead():
+    """The next few questions of the current concept (?n=5), for clients that answer offline."""
+    session_manager = SERVICES.get_session_manager()
+    if session_manager is None:
+        return jsonify({"error": "Tutor failed to initialize"}), 500
+    try:
+        protocol = wire.parse_protocol(request.args.get('v'))
+        count = wire.parse_count(request.args.get('n'))
+        with _locked_session(session_manager) as (session, session_id):
+            questions, concept_id = session.tutor.lookahead(count)
+        return _session_response(wire.lookahead_payload(questions, concept_id, protocol), session_id)
+    except Exception as e:
+        logger.exception("Error in /lookahead route: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/content', methods=['GET'])
+def content():
+    """Concepts and lessons for the client to cache, keyed by the content version."""
+    if SERVICES.get_session_manager() is None:
+        return jsonify({"error": "Tutor failed to initialize"}), 500
+    index = SERVICES.content_manager.index
+    headers = wire.ContentBundle.headers(index, request.args.get('version'))
+    if wire.ContentBundle.not_modified(index, request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    return Response(wire.CONTENT_BUNDLE.body(index), mimetype='application/json', headers=headers)
+
+@bp.route('/state', methods=['GET'])
+def get_state():
+    session_manager = SERVICES.get_session_manager()
+    if session_manager is None:
+        return jsonify({"error": "Tutor failed to initialize"}), 500
+    try:
+        with _locked_session(session_manager) as (session, session_id):
+            tutor = session.tutor
+            # The mastery array only becomes a dict here, at the JSON boundary
+            return _session_response({
+                "student_id": session.student.student_id,
+                "mastery": tutor.get_mastery_dict(),
+                "num_interactions": len(session.student.get_history())
+            }, session_id)
+    except Exception as e:
+        logger.exception("Error in /state route: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text exposition format
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Application Factory ---
+def create_app(preload=None):
+    """
+    Creates the Flask app. Tutor components are not built here: they are
+    built on the first request, or now for the shared part if preload is
+    True (default: $TUTOR_PRELOAD).
+    """
+    flask_app = Flask(__name__)
+    # The template folder is expected to be named "templates" by default
+    flask_app.register_blueprint(bp)
+    if PRELOAD if preload is None else preload:
+        SERVICES.preload()
+    SERVICES.timings["import"] = time.perf_counter() - _IMPORT_STARTED
+    logger.info("Flask app created (%.1fms since import).", SERVICES.timings["import"] * 1000)
+    return flask_app
+
+
+app = create_app()
+
 # --- Run the App ---
 if __name__ == "__main__":
-    print("Starting Flask server...")
+    logger.info("Starting Flask server...")
     # Use host='0.0.0.0' to make it accessible on your network
     # Use debug=True for development (auto-reloads on code changes)
     # Use use_reloader=True to enable the reloader
@@ -0,0 +1,398 @@
+"""
+ASGI entry point for the tutor.
+
+Serves the same routes as app.py over the same components (content,
+policy, tracer, store and session registry are built by app.SERVICES
+on first use, or at import with TUTOR_PRELOAD=1), but
+blocking work runs on bounded thread pools:
+
+  - "inference": tracer.step (or a BatchingTracer batch)
+  - "io": session restore, SQLite writes
+
+so the event loop only does the cheap work (cookies, JSON, grading,
+policy selection). When a pool already has its maximum of pending calls,
+new requests get 503 with Retry-After instead of queueing.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import app as flask_app
+from src import wire
+from src.batching import BatchingTracer
+from src.metrics import REGISTRY, REQUEST_LATENCY, STAGE_LATENCY, timed
+from src.offload import BoundedExecutor, PoolFullError
+from src.sessions import EPOCH_HEADER, SessionManager
+
+logger = logging.getLogger("asgi")
+
+# --- Pool settings ---
+INFERENCE_WORKERS = int(os.environ.get('TUTOR_INFERENCE_WORKERS', 4))
+INFERENCE_MAX_PENDING = int(os.environ.get('TUTOR_INFERENCE_MAX_PENDING', 1024))
+IO_WORKERS = int(os.environ.get('TUTOR_IO_WORKERS', 4))
+IO_MAX_PENDING = int(os.environ.get('TUTOR_IO_MAX_PENDING', 1024))
+RETRY_AFTER_SECONDS = 1
+MAX_BODY_BYTES = 64 * 1024
+
+INFERENCE_POOL = BoundedExecutor('inference', INFERENCE_WORKERS, INFERENCE_MAX_PENDING)
+IO_POOL = BoundedExecutor('io', IO_WORKERS, IO_MAX_PENDING)
+
+REGISTRY.gauge("tutor_pool_pending", "Calls running or waiting on each worker pool.",
+               lambda: {pool.name: pool.pending for pool in (INFERENCE_POOL, IO_POOL)},
+               label_name="pool")
+
+_TRACER_TIMER = STAGE_LATENCY.labels("tracer_update")
+
+with open(os.path.join(flask_app.BASE_DIR, 'templates', 'index.html'), 'rb') as f:
+    INDEX_HTML = f.read()
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+# --- Request helpers ---
+
+async def _read_json(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise HTTPError(400, "Client disconnected")
+        body.extend(message.get('body', b''))
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        if not message.get('more_body'):
+            break
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPError(400, "Request body is not valid JSON")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Request body must be a JSON object")
+    return data
+
+
+def _query(scope):
+    """Query parameters of the request (first value of each)."""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return {name: values[0] for name, values in query.items()}
+
+
+def _header(scope, name):
+    for header_name, value in scope.get('headers', ()):
+        if header_name == name:
+            return value.decode('latin-1')
+    return None
+
+
+_EPOCH_HEADER = EPOCH_HEADER.lower().encode('latin-1')
+
+
+def _session_id_from(scope):
+    cookie = SimpleCookie()
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            try:
+                cookie.load(value.decode('latin-1'))
+            except Exception:
+                pass # A malformed cookie header just means "no session"
+    morsel = cookie.get(flask_app.SESSION_COOKIE_NAME)
+    session_id = morsel.value if morsel is not None else None
+    if not SessionManager.is_valid_session_id(session_id):
+        session_id = SessionManager.new_session_id()
+    return session_id
+
+
+def _get_or_create(session_id, epoch):
+    session_manager = flask_app.SERVICES.get_session_manager() # Built on first use
+    if session_manager is None:
+        raise HTTPError(500, "Tutor failed to initialize")
+    return session_manager.get(session_id, epoch=epoch, pin=True)
+
+
+def _release_when_done(lookup):
+    """A pinned lookup outlived its cancelled request: unpin it once it finishes."""
+    def release(future):
+        if not future.cancelled() and future.exception() is None:
+            flask_app.SERVICES.session_manager.release(future.result())
+    lookup.add_done_callback(release)
+
+
+@contextlib.asynccontextmanager
+async def _locked_session(scope):
+    """
+    Finds (or creates) the caller's session and holds its async_lock for
+    the block. Yields (session, session_id). Lookups run on the io pool
+    because creating a session restores it from the store (and may evict
+    others); so does reloading it after a router handoff.
+    """
+    session_id = _session_id_from(scope)
+    epoch = _header(scope, _EPOCH_HEADER) # Set when behind the serve.py router
+    # Pinned for the whole request, so it cannot be evicted mid-answer
+    lookup = asyncio.ensure_future(IO_POOL.run(_get_or_create, session_id, epoch))
+    try:
+        session = await asyncio.shield(lookup)
+    except asyncio.CancelledError:
+        _release_when_done(lookup)
+        raise
+    session_manager = flask_app.SERVICES.session_manager # Built by the first _get_or_create
+    try:
+        if session.async_lock is None:
+            # Safe without a lock: only the event loop thread gets here
+            session.async_lock = asyncio.Lock()
+        async with session.async_lock:
+            if epoch is not None and session.epoch != epoch:
+                await IO_POOL.run(session_manager.refresh, session, epoch)
+            yield session, session_id
+    finally:
+        session_manager.release(session)
+
+
+def _session_cookie(session_id):
+    return (
+        f"{flask_app.SESSION_COOKIE_NAME}={session_id}; Max-Age={flask_app.SESSION_TTL_SECONDS}; "
+        "Path=/; HttpOnly; SameSite=Lax"
+    )
+
+
+async def _step_tracer(tracer_state, interaction):
+    """Runs tracer.step off the event loop (batched if the tracer batches)."""
+    tracer = flask_app.SERVICES.tracer
+    with timed(_TRACER_TIMER):
+        if isinstance(tracer, BatchingTracer):
+            return await INFERENCE_POOL.wait_future(tracer.submit, tracer_state, interaction)
+        return await INFERENCE_POOL.run(tracer.step, tracer_state, interaction)
+
+
+async def _settle_prefetch(tutor):
+    """Waits (without blocking the loop) for a prefetch still running for this tutor."""
+    future = tutor.pending_prefetch()
+    if future is not None and not future.done():
+        await asyncio.wait([asyncio.wrap_future(future)])
+
+
+# --- Routes ---
+# Each handler returns (status, payload, session_id). The session's
+# async_lock serializes one learner's requests without holding a thread.
+
+async def start_session(scope, receive):
+    protocol = wire.parse_protocol(_query(scope).get('v'))
+    IO_POOL.admit()
+    async with _locked_session(scope) as (session, session_id):
+        tutor = session.tutor
+        await _settle_prefetch(tutor)
+        action = tutor.start_session(persist=False)
+        await IO_POOL.run(tutor.save_progress)
+        tutor.schedule_prefetch(action)
+        payload = wire.start_payload(action, tutor, tutor.content_manager.index, protocol, session)
+    return 200, payload, session_id
+
+
+async def _answer(session, question_id, user_answer, response_time_ms):
+    """One answer through the tutor's phases; the caller holds the session's async_lock."""
+    tutor = session.tutor
+    await _settle_prefetch(tutor)
+    # 1. Grade and record (on the loop: a dict lookup and a precompiled matcher)
+    interaction = tutor.record_answer(question_id, user_answer, response_time_ms)
+    if interaction is None:
+        return tutor.next_action()
+    # 2. + 3. From the prefetch, or tracer off the loop and policy back on it
+    action = tutor.apply_prefetched(interaction)
+    if action is None:
+        tracer_state = await _step_tracer(session.student.tracer_state, interaction)
+        action = tutor.apply_tracer_state(tracer_state)
+    # 4. Persist off the loop
+    await IO_POOL.run(tutor.persist_answer)
+    tutor.schedule_prefetch(action)
+    return action
+
+
+async def handle_answer(scope, receive):
+    protocol = wire.parse_protocol(_query(scope).get('v'))
+    try:
+        question_id, user_answer, response_time_ms = wire.parse_answer(await _read_json(receive))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+    # Admit before anything changes, so a 503 never leaves a turn half recorded
+    INFERENCE_POOL.admit()
+    IO_POOL.admit()
+    async with _locked_session(scope) as (session, session_id):
+        action = await _answer(session, question_id, user_answer, response_time_ms)
+        payload = wire.action_payload(action, session.tutor.content_manager.index, protocol, session)
+    return 200, payload, session_id
+
+
+async def handle_answers(scope, receive):
+    protocol = wire.parse_protocol(_query(scope).get('v'))
+    try:
+        answers = wire.parse_answers(await _read_json(receive))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+    INFERENCE_POOL.admit()
+    IO_POOL.admit()
+    async with _locked_session(scope) as (session, session_id):
+        for question_id, user_answer, response_time_ms in answers:
+            action = await _answer(session, question_id, user_answer, response_time_ms)
+        payload = wire.action_payload(action, session.tutor.content_manager.index, protocol, session)
+    payload["accepted"] = len(answers)
+    return 200, payload, session_id
+
+
+async def next_concept(scope, receive):
+    protocol = wire.parse_protocol(_query(scope).get('v'))
+    IO_POOL.admit()
+    async with _locked_session(scope) as (session, session_id):
+        logger.debug("Frontend requested next concept.")
+        tutor = session.tutor
+        await _settle_prefetch(tutor)
+        action = tutor.advance_concept(persist=False)
+        await IO_POOL.run(tutor.save_progress)
+        tutor.schedule_prefetch(action)
+        payload = wire.action_payload(action, tutor.content_manager.index, protocol, session)
+    return 200, payload, session_id
+
+
+async def lookahead(scope, receive):
+    query = _query(scope)
+    protocol = wire.parse_protocol(query.get('v'))
+    count = wire.parse_count(query.get('n'))
+    IO_POOL.admit()
+    async with _locked_session(scope) as (session, session_id):
+        questions, concept_id = session.tutor.lookahead(count)
+    return 200, wire.lookahead_payload(questions, concept_id, protocol), session_id
+
+
+async def get_state(scope, receive):
+    IO_POOL.admit()
+    async with _locked_session(scope) as (session, session_id):
+        payload = {
+            "student_id": session.student.student_id,
+            "mastery": session.tutor.get_mastery_dict(),
+            "num_interactions": len(session.student.get_history())
+        }
+    return 200, payload, session_id
+
+
+ROUTES = {
+    ('POST', '/start'): start_session,
+    ('POST', '/answer'): handle_answer,
+    ('POST', '/answers'): handle_answers,
+    ('GET', '/lookahead'): lookahead,
+    ('POST', '/next_concept'): next_concept,
+    ('GET', '/state'): get_state,
+}
+_ROUTE_TIMERS = {key: REQUEST_LATENCY.labels(key[1]) for key in ROUTES if key[1] != '/state'}
+
+
+# --- ASGI plumbing ---
+
+async def _send_response(send, status, body, content_type, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+        ] + [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_json(send, status, payload, headers=()):
+    await _send_response(send, status, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+
+
+async def _send_content(scope, send):
+    """Concepts and lessons for the client to cache, keyed by the content version."""
+    try:
+        if await IO_POOL.run(flask_app.SERVICES.get_session_manager) is None:
+            await _send_json(send, 500, {"error": "Tutor failed to initialize"})
+            return
+    except PoolFullError:
+        await _send_json(send, 503, {"error": "Server busy, please retry"},
+                         [('retry-after', str(RETRY_AFTER_SECONDS))])
+        return
+    index = flask_app.SERVICES.content_manager.index
+    headers = [(name.lower(), value) for name, value in
+               wire.ContentBundle.headers(index, _query(scope).get('version'))]
+    if wire.ContentBundle.not_modified(index, _header(scope, b'if-none-match')):
+        await send({
+            'type': 'http.response.start',
+            'status': 304,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await _send_response(send, 200, wire.CONTENT_BUNDLE.body(index), 'application/json', headers)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            logger.info("ASGI server started (inference pool %d, io pool %d).", INFERENCE_WORKERS, IO_WORKERS)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            INFERENCE_POOL.shutdown()
+            IO_POOL.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path']
+    if method == 'GET' and path == '/':
+        await _send_response(send, 200, INDEX_HTML, 'text/html; charset=utf-8')
+        return
+    if method == 'GET' and path == '/metrics':
+        # Prometheus text exposition format
+        await _send_response(send, 200, REGISTRY.render().encode('utf-8'),
+                             'text/plain; version=0.0.4; charset=utf-8')
+        return
+
+    if method == 'GET' and path == '/content':
+        await _send_content(scope, send)
+        return
+
+    handler = ROUTES.get((method, path))
+    if handler is None:
+        await _send_json(send, 404, {"error": "Not found"})
+        return
+    started = time.perf_counter()
+    try:
+        status, payload, session_id = await handler(scope, receive)
+        await _send_json(send, status, payload, [('set-cookie', _session_cookie(session_id))])
+    except PoolFullError as e:
+        logger.warning("Rejecting %s: %s", path, e)
+        await _send_json(send, 503, {"error": "Server busy, please retry"},
+                         [('retry-after', str(RETRY_AFTER_SECONDS))])
+    except HTTPError as e:
+        await _send_json(send, e.status, {"error": str(e)}, e.headers)
+    except Exception as e:
+        logger.exception("Error in %s route: %s", path, e)
+        await _send_json(send, 500, {"error": str(e)})
+    finally:
+        timer = _ROUTE_TIMERS.get((method, path))
+        if timer is not None:
+            timer.observe(time.perf_counter() - started)
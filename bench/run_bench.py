@@ -0,0 +1,424 @@
+"""
+Throughput and latency benchmark for the tutor.
+
+Generates (or reuses) a synthetic content bank, then drives
+Tutor.start_session / submit_answer with simulated students who answer
+correctly with a given probability. Runs either in process or through
+the Flask test client, and writes the results as JSON so runs can be
+compared across commits.
+
+    python -m bench.run_bench --concepts 500 --questions-per-concept 200 \
+        --students 500 --turns 40 --out bench_results.json
+    python -m bench.run_bench --mode flask --compare bench_results.json
+
+Against a running server (e.g. serve.py) that uses the same content bank:
+
+    TUTOR_DATA_DIR=/tmp/bank python serve.py --workers 4 --port 5000 &
+    python -m bench.run_bench --content-dir /tmp/bank --mode http \
+        --url http://127.0.0.1:5000 --concurrency 32
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from bench.synthetic import generate_content
+from src.content import ContentManager
+from src.content_store import compile_content
+from src.metrics import PREFETCH, QUANTILES, STAGE_LATENCY
+from src.policies import SimpleDifficultyPolicy
+from src.student import Student
+from src.tracers import TransformerKnowledgeTracer
+from src.tutor import Tutor
+
+WRONG_ANSWER = "__wrong__"
+
+
+class SimulatedStudent:
+    """Answers each question correctly with probability `accuracy`."""
+    def __init__(self, student_id, accuracy, rng):
+        self.student_id = student_id
+        self.accuracy = accuracy
+        self.rng = rng
+
+    def answer(self, correct_answer):
+        if self.rng.random() < self.accuracy:
+            return correct_answer
+        return WRONG_ANSWER
+
+    def response_time_ms(self):
+        return int(self.rng.uniform(1500, 30000))
+
+
+def percentiles_ms(samples):
+    """p50/p95/p99/mean/max of a list of seconds, in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "mean": sum(ordered) / len(ordered) * 1000,
+        "max": ordered[-1] * 1000,
+        "count": len(ordered),
+    }
+
+
+def stage_percentiles_ms():
+    """Per-stage latency estimates from the tutor's own metrics."""
+    stages = {}
+    for (stage,), child in STAGE_LATENCY.items():
+        if child.count == 0:
+            continue
+        stages[stage] = {f"p{int(q * 100)}": child.quantile(q) * 1000 for q in QUANTILES}
+        stages[stage]["mean"] = child.total / child.count * 1000
+        stages[stage]["count"] = child.count
+    return stages
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BASE_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def load_content(content_dir, compiled=False):
+    """
+    Loads the content bank and returns (content_manager, load_seconds).
+    With compiled=True the bank is first compiled to content.bin (not timed)
+    and then mapped from it.
+    """
+    concepts_file = os.path.join(content_dir, 'knowledge.json')
+    questions_file = os.path.join(content_dir, 'question.json')
+    lessons_file = os.path.join(content_dir, 'lesson.json')
+    compiled_file = None
+    if compiled:
+        compiled_file = os.path.join(content_dir, 'content.bin')
+        source = ContentManager(concepts_file, questions_file, lessons_file)
+        compile_content(source.concepts, source.questions, source.lessons, compiled_file)
+    started = time.perf_counter()
+    content_manager = ContentManager(
+        concepts_file=concepts_file,
+        questions_file=questions_file,
+        lessons_file=lessons_file,
+        compiled_file=compiled_file
+    )
+    return content_manager, time.perf_counter() - started
+
+
+# --- In-process driver ---
+
+def build_tutor_factory(content_manager, prefetch_executor=None):
+    tracer = TransformerKnowledgeTracer(model_path='', content_manager=content_manager)
+    policy = SimpleDifficultyPolicy(
+        question_bank=content_manager.questions,
+        example_bank=content_manager.lessons,
+        content_manager=content_manager
+    )
+    def create(student_id):
+        return Tutor(Student(student_id), policy, tracer, content_manager, prefetch_executor=prefetch_executor)
+    return create
+
+
+def drive_tutor(tutor, simulated, action, content_manager):
+    """Plays one turn for a student given their last action; returns the next action."""
+    action_type, content, _ = action
+    if action_type == 'question':
+        question = content_manager.get_question(content['id'])
+        answer = simulated.answer(str(question.get('answer', '')))
+        return tutor.submit_answer(content['id'], answer, simulated.response_time_ms())
+    if action_type == 'example':
+        return tutor.advance_concept()
+    return tutor.start_session() # Mastery: start over
+
+
+def run_inprocess(content_manager, num_students, turns, accuracy, seed, prefetch_workers=0):
+    """
+    Round-robins all students one turn at a time, like interleaved requests.
+    With prefetch_workers, each student's next actions are prefetched
+    while the other students take their turns.
+    Returns (turn_latencies, elapsed_seconds).
+    """
+    prefetch_executor = ThreadPoolExecutor(prefetch_workers) if prefetch_workers > 0 else None
+    create = build_tutor_factory(content_manager, prefetch_executor)
+    rng = random.Random(seed)
+    students = []
+    for n in range(num_students):
+        tutor = create(f"sim{n}")
+        simulated = SimulatedStudent(f"sim{n}", accuracy, random.Random(rng.random()))
+        students.append([tutor, simulated, tutor.start_session()])
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(turns):
+        for entry in students:
+            tutor, simulated, action = entry
+            t0 = time.perf_counter()
+            entry[2] = drive_tutor(tutor, simulated, action, content_manager)
+            latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    if prefetch_executor is not None:
+        prefetch_executor.shutdown()
+    return latencies, elapsed
+
+
+def measure_session_memory(content_manager, num_students, turns, accuracy, seed):
+    """Bytes allocated per live session after `turns` turns (tracemalloc)."""
+    create = build_tutor_factory(content_manager)
+    rng = random.Random(seed)
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    students = []
+    for n in range(num_students):
+        tutor = create(f"mem{n}")
+        simulated = SimulatedStudent(f"mem{n}", accuracy, random.Random(rng.random()))
+        action = tutor.start_session()
+        for _ in range(turns):
+            action = drive_tutor(tutor, simulated, action, content_manager)
+        students.append(tutor)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(baseline, 'filename'))
+    return {
+        "sessions": num_students,
+        "turns_per_session": turns,
+        "bytes_per_session": allocated / max(1, num_students),
+    }
+
+
+# --- Flask test-client driver ---
+
+def run_flask(content_dir, content_manager, num_students, turns, accuracy, seed):
+    """
+    Same simulation through the HTTP routes, one test client (cookie jar)
+    per student. Returns (turn_latencies, elapsed_seconds).
+    """
+    os.environ['TUTOR_DATA_DIR'] = content_dir
+    os.environ.setdefault('TUTOR_STORE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_students.db'))
+    import app as app_module # Imported late: it initializes from the env vars above
+
+    rng = random.Random(seed)
+    students = []
+    for n in range(num_students):
+        client = app_module.app.test_client()
+        simulated = SimulatedStudent(f"web{n}", accuracy, random.Random(rng.random()))
+        data = client.post('/start', json={}).get_json()
+        students.append([client, simulated, data])
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(turns):
+        for entry in students:
+            client, simulated, data = entry
+            action = data.get('action', {})
+            t0 = time.perf_counter()
+            if action.get('type') == 'question':
+                question_id = action['content']['id']
+                question = content_manager.get_question(question_id)
+                entry[2] = client.post('/answer', json={
+                    "question_id": question_id,
+                    "user_answer": simulated.answer(str(question.get('answer', ''))),
+                    "response_time_ms": simulated.response_time_ms(),
+                }).get_json()
+            elif action.get('type') == 'example':
+                entry[2] = client.post('/next_concept', json={}).get_json()
+            else:
+                entry[2] = client.post('/start', json={}).get_json()
+            latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - started
+
+
+# --- HTTP driver ---
+
+def run_http(url, content_manager, num_students, turns, accuracy, seed, concurrency):
+    """
+    Same simulation against a running server: `concurrency` client threads,
+    each with one keep-alive connection, share the students; every student
+    keeps its session cookie. Returns (turn_latencies, elapsed_seconds).
+    """
+    parts = urlsplit(url)
+    rng = random.Random(seed)
+    simulated = [SimulatedStudent(f"http{n}", accuracy, random.Random(rng.random())) for n in range(num_students)]
+
+    def call(conn, path, cookie, body=None):
+        headers = {"Content-Type": "application/json"}
+        if cookie:
+            headers["Cookie"] = f"tutor_session={cookie}"
+        conn.request("POST", path, body=json.dumps(body if body is not None else {}), headers=headers)
+        response = conn.getresponse()
+        data = json.loads(response.read() or b"{}")
+        set_cookie = response.getheader("Set-Cookie")
+        if set_cookie:
+            cookie = set_cookie.split(";", 1)[0].split("=", 1)[1]
+        return data, cookie
+
+    def drive(students):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        entries = []
+        for student in students:
+            data, cookie = call(conn, "/start", None)
+            entries.append([student, cookie, data])
+        latencies = []
+        began = time.perf_counter()
+        for _ in range(turns):
+            for entry in entries:
+                student, cookie, data = entry
+                action = data.get("action", {})
+                t0 = time.perf_counter()
+                if action.get("type") == "question":
+                    question_id = action["content"]["id"]
+                    question = content_manager.get_question(question_id)
+                    entry[2], entry[1] = call(conn, "/answer", cookie, {
+                        "question_id": question_id,
+                        "user_answer": student.answer(str(question.get('answer', ''))),
+                        "response_time_ms": student.response_time_ms(),
+                    })
+                elif action.get("type") == "example":
+                    entry[2], entry[1] = call(conn, "/next_concept", cookie)
+                else:
+                    entry[2], entry[1] = call(conn, "/start", cookie)
+                latencies.append(time.perf_counter() - t0)
+        conn.close()
+        return latencies, began, time.perf_counter()
+
+    groups = [simulated[i::concurrency] for i in range(concurrency)]
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(drive, [group for group in groups if group]))
+    latencies = [latency for result in results for latency in result[0]]
+    return latencies, max(result[2] for result in results) - min(result[1] for result in results)
+
+
+# --- Entry point ---
+
+def compare(current, previous_path):
+    """Prints the change of the headline numbers against an earlier result file."""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    rows = [
+        ("turns_per_second", ("throughput", "turns_per_second")),
+        ("turn p50 ms", ("turn_latency_ms", "p50")),
+        ("turn p99 ms", ("turn_latency_ms", "p99")),
+        ("content load s", ("content", "load_seconds")),
+        ("bytes/session", ("memory", "bytes_per_session")),
+    ]
+    print(f"Compared with {previous_path} ({previous.get('meta', {}).get('git_revision')}):")
+    for label, (section, key) in rows:
+        old = previous.get(section, {}).get(key)
+        new = current.get(section, {}).get(key)
+        if old and new is not None:
+            print(f"  {label:>18}: {old:12.4f} -> {new:12.4f} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--content-dir', help="Use an existing bank instead of generating one")
+    parser.add_argument('--concepts', type=int, default=200)
+    parser.add_argument('--questions-per-concept', type=int, default=50)
+    parser.add_argument('--lessons-per-concept', type=int, default=2)
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=30)
+    parser.add_argument('--accuracy', type=float, default=0.7)
+    parser.add_argument('--mode', choices=('inproc', 'flask', 'http'), default='inproc')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="Server for the http mode")
+    parser.add_argument('--concurrency', type=int, default=16, help="Client threads for the http mode")
+    parser.add_argument('--compiled', action='store_true',
+                        help="Serve content from a compiled, memory-mapped content file")
+    parser.add_argument('--prefetch-workers', type=int, default=0,
+                        help="Prefetch threads for the in-process mode (0 = prefetch off)")
+    parser.add_argument('--memory-students', type=int, default=100,
+                        help="Sessions used for the (slower) tracemalloc memory pass; 0 to skip")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="Write results JSON here")
+    parser.add_argument('--compare', help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    generated = None
+    content_dir = args.content_dir
+    if content_dir is None:
+        content_dir = tempfile.mkdtemp(prefix='tutor_bench_')
+        generated = generate_content(
+            content_dir,
+            num_concepts=args.concepts,
+            questions_per_concept=args.questions_per_concept,
+            lessons_per_concept=args.lessons_per_concept,
+            seed=args.seed,
+        )
+
+    content_manager, load_seconds = load_content(content_dir, args.compiled)
+
+    if args.mode == 'flask':
+        latencies, elapsed = run_flask(content_dir, content_manager, args.students, args.turns, args.accuracy, args.seed)
+    elif args.mode == 'http':
+        latencies, elapsed = run_http(args.url, content_manager, args.students, args.turns, args.accuracy, args.seed,
+                                      max(1, args.concurrency))
+    else:
+        latencies, elapsed = run_inprocess(content_manager, args.students, args.turns, args.accuracy, args.seed,
+                                           args.prefetch_workers)
+    stages = stage_percentiles_ms()
+
+    memory = {}
+    if args.memory_students > 0:
+        memory = measure_session_memory(content_manager, args.memory_students, args.turns, args.accuracy, args.seed)
+
+    results = {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "args": vars(args),
+        },
+        "content": {
+            "content_dir": content_dir,
+            "num_concepts": content_manager.index.num_concepts,
+            "num_questions": content_manager.index.num_questions,
+            "num_lessons": content_manager.index.num_lessons,
+            "load_seconds": load_seconds,
+            "generated": generated,
+        },
+        "throughput": {
+            "mode": args.mode,
+            "students": args.students,
+            "turns": len(latencies),
+            "seconds": elapsed,
+            "turns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        },
+        "turn_latency_ms": percentiles_ms(latencies),
+        "stage_latency_ms": stages,
+        "prefetch": {result: child.value for (result,), child in PREFETCH.items()},
+        "memory": memory,
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Synthetic content banks for benchmarks and load simulation.
+Writes knowledge.json, question.json and lesson.json in the same
+schemas as data/, at any size (question.json is streamed to disk).
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+QUESTION_TYPES = ("mcq", "yes_no", "text")
+
+
+def generate_content(out_dir, num_concepts=1000, questions_per_concept=100,
+                     lessons_per_concept=2, max_prerequisites=3, seed=0):
+    """
+    Generates a content bank in out_dir and returns a summary dict.
+    Prerequisites only point from lower to higher concept numbers,
+    so the graph is always a DAG.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.perf_counter()
+
+    # --- knowledge.json ---
+    concepts = [{"id": f"c{i}", "name": f"Concept {i} (Khmer)"} for i in range(1, num_concepts + 1)]
+    prerequisites = []
+    for i in range(2, num_concepts + 1):
+        for j in rng.sample(range(1, i), min(i - 1, rng.randint(0, max_prerequisites))):
+            prerequisites.append({"from": f"c{j}", "to": f"c{i}"})
+    with open(os.path.join(out_dir, 'knowledge.json'), 'w', encoding='utf-8') as f:
+        json.dump({"concepts": concepts, "prerequisites": prerequisites}, f, ensure_ascii=False)
+
+    # --- question.json (streamed, one record at a time) ---
+    num_questions = 0
+    with open(os.path.join(out_dir, 'question.json'), 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        for i in range(1, num_concepts + 1):
+            for _ in range(questions_per_concept):
+                num_questions += 1
+                f.write(',\n' if num_questions > 1 else '')
+                json.dump(_make_question(rng, num_questions, f"c{i}"), f, ensure_ascii=False)
+        f.write('\n]\n')
+
+    # --- lesson.json ---
+    lessons = {}
+    for i in range(1, num_concepts + 1):
+        for k in range(lessons_per_concept):
+            lesson_id = f"l{i}_{k + 1}"
+            lessons[lesson_id] = {
+                "concept_id": f"c{i}",
+                "title": f"មេរៀន {lesson_id}",
+                "content": f"ខ្លឹមសារមេរៀន {lesson_id} ...",
+                "difficulty": round(rng.random(), 3),
+            }
+    with open(os.path.join(out_dir, 'lesson.json'), 'w', encoding='utf-8') as f:
+        json.dump(lessons, f, ensure_ascii=False)
+
+    return {
+        "out_dir": out_dir,
+        "num_concepts": num_concepts,
+        "num_prerequisites": len(prerequisites),
+        "num_questions": num_questions,
+        "num_lessons": len(lessons),
+        "generate_seconds": time.perf_counter() - started,
+    }
+
+
+def _make_question(rng, number, concept_id):
+    question_type = QUESTION_TYPES[number % len(QUESTION_TYPES)]
+    question = {
+        "id": f"q{number}",
+        "concept_id": concept_id,
+        "difficulty": round(rng.random(), 3),
+        "type": question_type,
+        "text": f"សំណួរទី {number}",
+    }
+    if question_type == "mcq":
+        options = [f"ជម្រើស {k}" for k in range(4)]
+        question["options"] = options
+        question["answer"] = rng.choice(options)
+    elif question_type == "yes_no":
+        question["answer"] = rng.choice(["Yes", "No"])
+    else:
+        question["answer"] = f"ចម្លើយ {number}"
+    return question
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('out_dir')
+    parser.add_argument('--concepts', type=int, default=1000)
+    parser.add_argument('--questions-per-concept', type=int, default=100)
+    parser.add_argument('--lessons-per-concept', type=int, default=2)
+    parser.add_argument('--max-prerequisites', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    summary = generate_content(
+        args.out_dir,
+        num_concepts=args.concepts,
+        questions_per_concept=args.questions_per_concept,
+        lessons_per_concept=args.lessons_per_concept,
+        max_prerequisites=args.max_prerequisites,
+        seed=args.seed,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
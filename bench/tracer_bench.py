@@ -0,0 +1,199 @@
+"""
+Accuracy and latency benchmark for the knowledge tracers.
+
+Simulates students on a synthetic content bank with a known skill model
+(per-student ability, per-concept knowledge that grows with practice),
+logs the training students into a temporary StudentStore, trains the
+windowed model from it with src.kt_training, and then replays held-out
+students through each tracer's real step()/get_mastery() API:
+
+  - accuracy: the mastery of the question's concept *before* the answer
+    is the prediction; AUC, log-loss and accuracy over all answers
+  - latency: time of one step() + get_mastery() per answer
+  - memory: peak bytes allocated during one step() + get_mastery()
+    (tracemalloc, measured in a separate pass so it does not slow the timing)
+
+for the placeholder and the trained model saved as float32, float16 and int8.
+
+    python -m bench.tracer_bench --concepts 50 --train-students 2000 --out tracer_results.json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from bench.run_bench import load_content, percentiles_ms
+from bench.synthetic import generate_content
+from src.history import InteractionLog
+from src.kt_model import PRECISIONS
+from src.kt_training import binary_metrics, train
+from src.store import StudentStore
+from src.student import Student
+from src.tracers import TransformerKnowledgeTracer, WindowedKnowledgeTracer
+
+
+class SimulatedLearner:
+    """
+    Ground truth: P(correct) = sigmoid(ability + knowledge[c] - 2 * (difficulty - 0.5)).
+    Knowledge of a concept grows with each attempt (more after a correct
+    one); knowledge of its prerequisites carries over a little.
+    """
+    def __init__(self, rng, num_concepts):
+        self.rng = rng
+        self.ability = rng.gauss(0.0, 1.0)
+        self.learn_rate = max(0.05, rng.gauss(0.35, 0.15))
+        self.knowledge = [rng.gauss(-1.0, 0.5) for _ in range(num_concepts)]
+
+    def answer(self, concept_index, difficulty):
+        logit = self.ability + self.knowledge[concept_index] - 2.0 * (difficulty - 0.5)
+        is_correct = self.rng.random() < 1.0 / (1.0 + math.exp(-logit))
+        self.knowledge[concept_index] += self.learn_rate * (1.5 if is_correct else 1.0)
+        if concept_index + 1 < len(self.knowledge):
+            self.knowledge[concept_index + 1] += 0.1 * self.learn_rate # Transfer to the next concept
+        return is_correct
+
+
+def simulate_history(rng, content_manager, concept_ids, turns):
+    """One learner working through the concepts in order, a few questions each, with revisits."""
+    index = content_manager.index
+    learner = SimulatedLearner(rng, len(concept_ids))
+    history = InteractionLog()
+    position = 0
+    while len(history) < turns:
+        if position > 0 and rng.random() < 0.2:
+            concept = rng.randrange(position) # Revisit an earlier concept
+        else:
+            concept = min(position, len(concept_ids) - 1)
+            position += 1
+        questions = index.get_questions_for_concept(concept_ids[concept])
+        for _ in range(rng.randint(3, 8)):
+            if not questions or len(history) >= turns:
+                break
+            question = questions[rng.randrange(len(questions))]
+            is_correct = learner.answer(concept, question.get('difficulty', 0.5))
+            history.append(question.get('id'), is_correct, rng.randint(2000, 30000))
+    return history
+
+
+def evaluate(tracer, histories, concept_position):
+    """Replays histories through the tracer; returns accuracy metrics and per-answer latencies."""
+    labels, probs, latencies = [], [], []
+    index = tracer.content_manager.index
+    for history in histories:
+        state = tracer.init_state()
+        mastery = tracer.get_mastery(state)
+        for interaction in history:
+            question = index.questions_by_id.get(interaction['question_id'])
+            labels.append(1.0 if interaction['is_correct'] else 0.0)
+            probs.append(mastery[concept_position[question['concept_id']]])
+            started = time.perf_counter()
+            state = tracer.step(state, interaction)
+            mastery = tracer.get_mastery(state)
+            latencies.append(time.perf_counter() - started)
+    return binary_metrics(labels, probs), percentiles_ms(latencies)
+
+
+def step_peak_bytes(tracer, history):
+    """Largest allocation peak of one step() + get_mastery() over a history."""
+    state = tracer.init_state()
+    tracer.get_mastery(state)
+    peak = 0
+    tracemalloc.start()
+    try:
+        for interaction in history:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            state = tracer.step(state, interaction)
+            tracer.get_mastery(state)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--content-dir', help="Use an existing bank instead of generating one")
+    parser.add_argument('--concepts', type=int, default=50)
+    parser.add_argument('--questions-per-concept', type=int, default=40)
+    parser.add_argument('--train-students', type=int, default=2000)
+    parser.add_argument('--test-students', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=150)
+    parser.add_argument('--window', type=int, default=50)
+    parser.add_argument('--dim', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="Write results JSON here")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    work_dir = tempfile.mkdtemp(prefix="tracer_bench_")
+    content_dir = args.content_dir
+    if content_dir is None:
+        content_dir = os.path.join(work_dir, 'content')
+        generate_content(content_dir, num_concepts=args.concepts,
+                         questions_per_concept=args.questions_per_concept, seed=args.seed)
+    content_manager, _ = load_content(content_dir)
+    concept_ids = list(content_manager.index.concept_ids)
+    concept_position = content_manager.index.concept_positions
+    rng = random.Random(args.seed)
+
+    # 1. Log the training students into a store, as the live app would
+    started = time.perf_counter()
+    store = StudentStore(os.path.join(work_dir, 'students.db'))
+    for number in range(args.train_students):
+        student = Student(f"train-{number}")
+        student.history = simulate_history(rng, content_manager, concept_ids, args.turns)
+        store.snapshot(student)
+    test_histories = [simulate_history(rng, content_manager, concept_ids, args.turns)
+                      for _ in range(args.test_students)]
+    simulate_seconds = time.perf_counter() - started
+
+    # 2. Train from the store (streamed in chunks)
+    started = time.perf_counter()
+    model, report = train(store, content_manager, window=args.window, dim=args.dim,
+                          epochs=args.epochs, seed=args.seed, log_every=0)
+    train_seconds = time.perf_counter() - started
+
+    # 3. Replay the held-out students through every tracer
+    tracers = {"placeholder": TransformerKnowledgeTracer(os.path.join(work_dir, 'none.pt'), content_manager)}
+    weight_bytes = {}
+    for precision in PRECISIONS:
+        path = os.path.join(work_dir, f'tracer-{precision}.npz')
+        weight_bytes[precision] = model.save(path, precision=precision)
+        tracers[precision] = WindowedKnowledgeTracer(path, content_manager)
+    results = {
+        "config": vars(args),
+        "simulate_seconds": simulate_seconds,
+        "train_seconds": train_seconds,
+        "training": report["epochs"],
+        "weight_bytes": weight_bytes,
+        "tracers": {},
+    }
+    for name, tracer in tracers.items():
+        tracer.load()
+        metrics, latency = evaluate(tracer, test_histories, concept_position)
+        results["tracers"][name] = {
+            "accuracy": metrics,
+            "step_latency_ms": latency,
+            "step_peak_bytes": step_peak_bytes(tracer, test_histories[0]),
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Production serving mode: N worker processes behind a sticky router.
+
+    python serve.py --workers 4 --port 5000
+    python serve.py --workers 4 --port 5000 --state-server   # workers share a state server
+
+Each worker is a full copy of the app (app.py, or asgi.py with
+--server asgi) on its own Unix socket. The router (src/routing.py) sends
+every request of a learner to the same worker by consistent hashing on
+the session id, so sessions stay in one worker's memory and no locking
+is shared between workers: throughput grows with the number of workers
+until the router's core is busy.
+
+Learner state is written through the shared state backend on every
+answer (TUTOR_STATE_BACKEND: sqlite, the default, shared by the processes
+of one machine; socket, a StateServer, see src/shared_store.py). When a
+worker dies it leaves the ring, its learners move to the other workers
+and are restored there from the store; the supervisor restarts it (with
+backoff if it keeps dying) and, once it accepts connections again, it
+takes its learners back.
+
+Several nodes: run workers only on each node (--no-router --worker-host
+0.0.0.0 --worker-port 5001) and one router in front of all of them
+(--workers 0 --upstream node1:5001 --upstream node1:5002 ...), with a
+state backend every node can reach. Run a single router: the ring
+version it sends to the workers is its own.
+
+Content, tracer weights and the policy are built once in the supervisor
+before the workers are forked (as with TUTOR_PRELOAD=1), so workers
+share them copy-on-write.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("serve")
+
+
+def _detach_from_supervisor(inherited_sockets):
+    """
+    Undoes what a forked worker inherits from the supervisor's process:
+    its listening sockets and its signal handling. Workers (re)started
+    from the running loop inherit the loop's signal wakeup fd, so without
+    resetting it a signal to the worker would also wake the supervisor.
+    """
+    for sock in inherited_sockets:
+        sock.close() # The router's listening sockets belong to the supervisor
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C is handled by the supervisor
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def run_worker(address, server, inherited_sockets):
+    """Worker process body: serves the app on `address` until killed."""
+    _detach_from_supervisor(inherited_sockets)
+    unix_path = address[len("unix:"):] if address.startswith("unix:") else None
+    host, _, port = address.rpartition(":")
+    if unix_path and os.path.exists(unix_path):
+        os.unlink(unix_path)
+
+    if server == 'asgi':
+        import uvicorn # Optional; only needed for --server asgi
+        import asgi
+        if unix_path:
+            uvicorn.run(asgi.application, uds=unix_path, log_level="warning")
+        else:
+            uvicorn.run(asgi.application, host=host, port=int(port), log_level="warning")
+    else:
+        from werkzeug.serving import make_server
+        import app as flask_app
+        logging.getLogger('werkzeug').setLevel(logging.WARNING) # No access log line per request
+        if unix_path:
+            http_server = make_server(f"unix://{unix_path}", 0, flask_app.app, threaded=True)
+        else:
+            http_server = make_server(host, int(port), flask_app.app, threaded=True)
+        http_server.serve_forever()
+
+
+class Supervisor:
+    """
+    Starts the workers, restarts any that exit, and keeps the router's
+    ring in step: a worker leaves the ring as soon as its process exits
+    and the router's probe puts it back once the new process accepts
+    connections.
+    """
+    def __init__(self, worker_addresses, server, router=None, restart_backoff=(0.5, 30.0)):
+        self.worker_addresses = worker_addresses # name -> address
+        self.server = server
+        self.router = router
+        self.restart_backoff = restart_backoff
+        self.inherited_sockets = []
+        self.processes = {}
+        self.restarts = {name: 0 for name in worker_addresses}
+        self._stopping = False
+        self._context = multiprocessing.get_context('fork') # Workers inherit the preloaded components
+
+    def start_worker(self, name):
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.worker_addresses[name], self.server, self.inherited_sockets),
+            name=f"tutor-{name}",
+            daemon=True
+        )
+        process.start()
+        self.processes[name] = (process, time.monotonic())
+        logger.info("Started %s (pid %d) on %s.", name, process.pid, self.worker_addresses[name])
+        loop = asyncio.get_running_loop()
+        loop.add_reader(process.sentinel, self._on_exit, name, process)
+
+    def _on_exit(self, name, process):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(process.sentinel)
+        process.join()
+        if self._stopping:
+            return
+        if self.router is not None:
+            self.router.mark_down(name, f"process exited with {process.exitcode}")
+        _, started = self.processes.pop(name)
+        # Back off if it keeps dying right after starting
+        if time.monotonic() - started < 10.0:
+            self.restarts[name] += 1
+        else:
+            self.restarts[name] = 0
+        minimum, maximum = self.restart_backoff
+        restarts = self.restarts[name]
+        delay = min(maximum, minimum * 2 ** (restarts - 2)) if restarts > 1 else 0.0
+        logger.warning("Worker %s (pid %d) exited with %s; restarting in %.1fs.",
+                       name, process.pid, process.exitcode, delay)
+        loop.call_later(delay, self._restart, name)
+
+    def _restart(self, name):
+        if not self._stopping and name not in self.processes:
+            self.start_worker(name)
+
+    def stop(self):
+        self._stopping = True
+        for process, _ in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process, _ in self.processes.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+
+
+def _run_state_server(address):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from src.shared_store import StateServer
+    server = StateServer(address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+async def serve(args, worker_addresses, upstreams, state_server=None):
+    import app as flask_app
+    from src.routing import Router, Upstream
+
+    router = None
+    if args.port:
+        router = Router(
+            [Upstream(name, address) for name, address in {**worker_addresses, **upstreams}.items()],
+            cookie_name=flask_app.SESSION_COOKIE_NAME,
+        )
+    supervisor = Supervisor(worker_addresses, args.server, router)
+
+    listener = None
+    if router is not None:
+        sock = socket.create_server((args.host, args.port), backlog=1024)
+        listener = await asyncio.start_server(router.handle_client, sock=sock, limit=64 * 1024)
+        supervisor.inherited_sockets = [sock]
+    for name in worker_addresses:
+        supervisor.start_worker(name)
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    if state_server is not None:
+        def state_server_exited():
+            # Not restarted: its state is in memory, a new one would start empty
+            loop.remove_reader(state_server.sentinel)
+            state_server.join()
+            logger.critical("State server exited with %s; answers cannot be stored until it is back.",
+                            state_server.exitcode)
+        loop.add_reader(state_server.sentinel, state_server_exited)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+
+    probing = None
+    if router is not None:
+        probing = asyncio.create_task(router.probe_down())
+        logger.info("Router listening on %s:%d for %d workers (%s).", args.host, args.port,
+                    len(router.upstreams), args.server)
+    await stopped.wait()
+
+    logger.info("Shutting down...")
+    if probing is not None:
+        probing.cancel()
+    if listener is not None:
+        listener.close()
+    supervisor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes on this machine (default: one per core)")
+    parser.add_argument('--host', default='0.0.0.0', help="Router listen address")
+    parser.add_argument('--port', type=int, default=5000, help="Router port")
+    parser.add_argument('--no-router', action='store_true', help="Only run workers (another node routes)")
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi',
+                        help="Worker server: threaded WSGI (app.py) or uvicorn (asgi.py)")
+    parser.add_argument('--worker-host', help="Workers listen on TCP at this host instead of Unix sockets")
+    parser.add_argument('--worker-port', type=int, default=5001, help="First worker TCP port (with --worker-host)")
+    parser.add_argument('--upstream', action='append', default=[],
+                        help="A worker on another node, host:port (repeatable)")
+    parser.add_argument('--run-dir', default=os.path.join(BASE_DIR, 'state', 'run'),
+                        help="Directory for the worker and state server sockets")
+    parser.add_argument('--state-server', action='store_true',
+                        help="Start a state server and use it as the workers' state backend")
+    args = parser.parse_args()
+    if args.no_router:
+        args.port = 0
+    if not args.port and not args.workers:
+        parser.error("Nothing to run: no router and no workers")
+    if not args.port and args.upstream:
+        parser.error("--upstream needs the router")
+
+    os.makedirs(args.run_dir, exist_ok=True)
+    state_server = None
+    if args.state_server:
+        os.environ['TUTOR_STATE_BACKEND'] = 'socket'
+        os.environ.setdefault('TUTOR_STATE_ADDRESS', os.path.join(args.run_dir, 'state.sock'))
+    os.environ.setdefault('TUTOR_PRELOAD', '1')
+
+    # Imported after the environment is set: app.py reads it at import
+    sys.path.insert(0, BASE_DIR)
+    import app as flask_app
+    if flask_app.STATE_BACKEND == 'memory' and args.workers + len(args.upstream) > 1:
+        parser.error("TUTOR_STATE_BACKEND=memory is per process; use sqlite or --state-server with several workers")
+    if not flask_app.preload():
+        logger.critical("Tutor failed to initialize; not starting workers.")
+        sys.exit(1)
+
+    if args.state_server:
+        if os.path.exists(flask_app.STATE_ADDRESS):
+            os.unlink(flask_app.STATE_ADDRESS) # Left over from an earlier run
+        state_server = multiprocessing.get_context('fork').Process(
+            target=_run_state_server, args=(flask_app.STATE_ADDRESS,), name="tutor-state", daemon=True
+        )
+        state_server.start()
+        deadline = time.monotonic() + 10
+        while not os.path.exists(flask_app.STATE_ADDRESS) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        logger.info("State server (pid %d) on %s.", state_server.pid, flask_app.STATE_ADDRESS)
+
+    worker_addresses = {}
+    for number in range(args.workers):
+        if args.worker_host:
+            worker_addresses[f"worker-{number}"] = f"{args.worker_host}:{args.worker_port + number}"
+        else:
+            worker_addresses[f"worker-{number}"] = "unix:" + os.path.join(args.run_dir, f"worker-{number}.sock")
+    upstreams = {address: address for address in args.upstream}
+
+    try:
+        asyncio.run(serve(args, worker_addresses, upstreams, state_server))
+    finally:
+        if state_server is not None:
+            state_server.terminate()
+            state_server.join(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
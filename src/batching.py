@@ -0,0 +1,152 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingTracer:
+    """
+    Micro-batching front for a tracer.
+    Concurrent step() calls from different sessions are queued and run
+    together through tracer.step_batch(), once max_batch_size calls are
+    waiting or max_wait_ms has passed since the first one arrived.
+    Each caller blocks only until its own result is ready.
+    Everything other than step() is passed straight to the wrapped tracer.
+    """
+    def __init__(self, tracer, max_batch_size=32, max_wait_ms=2.0):
+        """
+        tracer must provide step_batch(states, interactions).
+        """
+        self.tracer = tracer
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._num_batches = 0
+        self._num_items = 0
+        self._max_batch_seen = 0
+        self._batch_size_counts = {} # batch size -> number of batches
+        self._total_wait_s = 0.0     # Summed queueing delay of all items
+        self._total_run_s = 0.0      # Summed step_batch time
+
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="tracer-batcher", daemon=True)
+        self._worker.start()
+        logger.info("Tracer batching on (batch size %d, wait %sms).", self.max_batch_size, self.max_wait_ms)
+
+    def __getattr__(self, name):
+        # Only called for attributes not defined here (init_state, get_mastery, ...)
+        return getattr(self.tracer, name)
+
+    def step(self, state, interaction):
+        """Same contract as tracer.step(), but runs inside a batch."""
+        if self._closed or threading.current_thread() is self._worker:
+            return self.tracer.step(state, interaction)
+        return self.submit(state, interaction).result()
+
+    def submit(self, state, interaction):
+        """Queues one step and returns a Future for its new state."""
+        future = Future()
+        if self._closed:
+            future.set_exception(RuntimeError("BatchingTracer is closed"))
+            return future
+        self._queue.put((state, interaction, future, time.perf_counter()))
+        return future
+
+    def close(self, timeout=None):
+        """Stops the worker after the queued steps are done."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout)
+        # Steps queued while we were shutting down run unbatched
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftovers.append(item)
+        for item in leftovers:
+            self._run_batch([item])
+
+    def stats(self):
+        """Batch counters for monitoring."""
+        with self._stats_lock:
+            num_batches = self._num_batches
+            return {
+                "batches": num_batches,
+                "items": self._num_items,
+                "mean_batch_size": (self._num_items / num_batches) if num_batches else 0.0,
+                "max_batch_size_seen": self._max_batch_seen,
+                "batch_size_counts": dict(self._batch_size_counts),
+                "mean_wait_ms": (self._total_wait_s * 1000 / self._num_items) if self._num_items else 0.0,
+                "mean_run_ms": (self._total_run_s * 1000 / num_batches) if num_batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+            }
+
+    # --- Worker thread ---
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = self._collect(batch)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _collect(self, batch):
+        """
+        Fills batch until it is full or the deadline of its first item passes.
+        Returns True if the shutdown marker was seen.
+        """
+        deadline = batch[0][3] + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        states = [item[0] for item in batch]
+        interactions = [item[1] for item in batch]
+        try:
+            results = self.tracer.step_batch(states, interactions)
+        except Exception as e:
+            for item in batch:
+                item[2].set_exception(e)
+            results = None
+        finished = time.perf_counter()
+
+        if results is not None:
+            for item, new_state in zip(batch, results):
+                item[2].set_result(new_state)
+
+        with self._stats_lock:
+            size = len(batch)
+            self._num_batches += 1
+            self._num_items += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+            self._total_wait_s += sum(started - item[3] for item in batch)
+            self._total_run_s += finished - started
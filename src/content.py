@@ -1,57 +1,298 @@
+import hashlib
 import json
+import logging
 import os
+import threading
+import time
+
+from src.content_store import ContentFile, KeyedRecords, RecordSlice, RecordTable
+from src.grading import Grader
+from src.scheduler import ConceptGraph
+
+logger = logging.getLogger(__name__)
 
 class ContentManager:
     """
     Loads and manages all content (concepts, questions, lessons)
-    from JSON files.
+    from JSON files, or from a compiled content file (src/content_store.py)
+    whose records are decoded lazily.
+    reload() swaps in a new version atomically: requests already running
+    keep the index they started with, later ones see the new one.
     """
-    def __init__(self, concepts_file, questions_file, lessons_file):
+    def __init__(self, concepts_file=None, questions_file=None, lessons_file=None, compiled_file=None):
         """
-        Loads the data from the specified file paths.
+        Loads the data from the specified file paths. If compiled_file is
+        given, it is used instead of the three JSON files.
         """
-        print(f"  [ContentManager] Loading concepts from {concepts_file}")
-        self.concepts = self._load_json(concepts_file)
-        
-        print(f"  [ContentManager] Loading questions from {questions_file}")
-        self.questions = self._load_json(questions_file)
-        
-        print(f"  [ContentManager] Loading lessons from {lessons_file}")
-        self.lessons = self._load_json(lessons_file)
-
-    def _load_json(self, file_path):
-        """Helper function to load a JSON file."""
+        self.concepts_file = concepts_file
+        self.questions_file = questions_file
+        self.lessons_file = lessons_file
+        self.compiled_file = compiled_file
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._load()
+
+    def _load(self):
+        """Builds everything for the current files, then swaps it in."""
+        stamp = self._source_stamp()
+        if self.compiled_file:
+            logger.info("Mapping compiled content from %s", self.compiled_file)
+            index = BinaryContentIndex(ContentFile(self.compiled_file))
+            concepts, questions, lessons = index.concepts, index.question_records, index.lessons_by_id
+        else:
+            # The version is a hash of the raw file bytes, so every process
+            # loading the same files agrees on it (clients cache by it)
+            digest = hashlib.sha256()
+            logger.info("Loading concepts from %s", self.concepts_file)
+            concepts = self._load_json(self.concepts_file, digest)
+
+            logger.info("Loading questions from %s", self.questions_file)
+            questions = self._load_json(self.questions_file, digest)
+
+            logger.info("Loading lessons from %s", self.lessons_file)
+            lessons = self._load_json(self.lessons_file, digest)
+
+            # Build the lookup tables once so requests never scan the raw lists
+            index = ContentIndex(concepts, questions, lessons, version=digest.hexdigest()[:16])
+
+        # Reference assignments: readers see either the old or the new version
+        self.concepts = concepts
+        self.questions = questions
+        self.lessons = lessons
+        self.index = index
+        self._stamp = stamp
+        logger.info("Indexed %d questions across %d concepts.",
+                    self.index.num_questions, self.index.num_concepts)
+
+    def reload(self):
+        """
+        Reloads the content files. On any error the current content is kept.
+        Returns True if a new version was swapped in.
+        """
+        with self._reload_lock:
+            try:
+                self._load()
+            except Exception as e:
+                logger.exception("Content reload failed; keeping the current version: %s", e)
+                return False
+        return True
+
+    def reload_if_changed(self):
+        """Reloads if a source file was replaced or modified since the last load."""
+        if self._source_stamp() == self._stamp:
+            return False
+        logger.info("Content files changed; reloading.")
+        return self.reload()
+
+    def watch(self, interval_seconds):
+        """Starts a daemon thread that calls reload_if_changed every interval_seconds."""
+        if self._watcher is not None:
+            return
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                self.reload_if_changed()
+        self._watcher = threading.Thread(target=run, name="content-watcher", daemon=True)
+        self._watcher.start()
+        logger.info("Watching content files every %ss.", interval_seconds)
+
+    def _source_stamp(self):
+        files = [self.compiled_file] if self.compiled_file else [self.concepts_file, self.questions_file, self.lessons_file]
+        stamp = []
+        for path in files:
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except (OSError, TypeError):
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _load_json(self, file_path, digest=None):
+        """Helper function to load a JSON file (feeding its bytes to digest, if given)."""
         # In a real app, you'd add error handling if files are missing
         # For now, we assume they exist when app.py calls this.
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+            if digest is not None:
+                digest.update(raw)
+                digest.update(b"\0") # Keeps file boundaries apart
+            return json.loads(raw.decode('utf-8'))
         except FileNotFoundError:
-            print(f"  [ContentManager] WARNING: Data file not found: {file_path}. Returning empty data.")
+            logger.warning("Data file not found: %s. Returning empty data.", file_path)
             return {} # Return empty dict/list if file not found
-        except json.JSONDecodeError:
-            print(f"  [ContentManager] WARNING: Error decoding JSON from file: {file_path}. Returning empty data.")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            logger.warning("Error decoding JSON from file: %s. Returning empty data.", file_path)
             return {}
 
     def get_question(self, question_id):
         """Gets a single question by its ID."""
-        # Assumes self.questions is a list of dictionaries
-        for q in self.questions:
-            if q.get('id') == question_id:
-                return q
-        print(f"  [ContentManager] Warning: Question ID '{question_id}' not found.")
-        return None
+        try:
+            question = self.index.questions_by_id.get(question_id)
+        except TypeError: # Unhashable (e.g. a list from a JSON body): cannot be an id
+            question = None
+        if question is None:
+            logger.warning("Question ID %r not found.", question_id)
+        return question
 
     def get_lesson(self, lesson_id):
         """Gets a single lesson by its ID."""
         # Assumes self.lessons is a dictionary where keys are lesson_ids
-        return self.lessons.get(lesson_id, None)
-
-    # You might need a get_concept method later too
-    # def get_concept(self, concept_id):
-    #     """Gets a single concept by its ID."""
-    #     concepts_list = self.concepts.get('concepts', [])
-    #     for c in concepts_list:
-    #         if c.get('id') == concept_id:
-    #             return c
-    #     return None
+        return self.index.lessons_by_id.get(lesson_id, None)
+
+    def get_concept(self, concept_id):
+        """Gets a single concept by its ID."""
+        return self.index.concepts_by_id.get(concept_id, None)
+
+    def get_questions_for_concept(self, concept_id):
+        """Gets the questions of a concept, hardest first."""
+        return self.index.get_questions_for_concept(concept_id)
+
+    def get_lessons_for_concept(self, concept_id):
+        """Gets the lessons (examples) of a concept."""
+        return self.index.get_lessons_for_concept(concept_id)
+
+
+class ContentIndex:
+    """
+    Read-only lookup tables built once from the raw content:
+    id -> question, concept_id -> questions (hardest first),
+    concept_id -> lessons, id -> concept, the compiled prerequisite graph
+    and the answer matchers (`grader`).
+    `version` identifies the content (clients cache by it).
+    """
+    _lesson_ids = None # concept_id -> [(lesson_id, lesson)], built on first lesson_id()
+
+    def __init__(self, concepts, questions, lessons, version=None):
+        """
+        Accepts the same structures as the JSON files. Anything of the
+        wrong shape (e.g. {} from a missing file) is treated as empty.
+        """
+        self.version = version
+        questions = questions if isinstance(questions, list) else []
+        lessons = lessons if isinstance(lessons, dict) else {}
+        self._index_concepts(concepts)
+
+        # --- Questions ---
+        self.questions_by_id = {}
+        self.questions_by_concept = {}
+        for q in questions:
+            # First definition wins, same as the old linear scan in get_question
+            self.questions_by_id.setdefault(q.get('id'), q)
+            self.questions_by_concept.setdefault(q.get('concept_id'), []).append(q)
+        for concept_questions in self.questions_by_concept.values():
+            # Stable sort: among equal difficulties the file order is kept,
+            # which matches max() picking the first maximum.
+            concept_questions.sort(key=lambda q: q.get('difficulty', 0), reverse=True)
+        # Answers are normalized here, once, so grading a request only normalizes the student's
+        self.grader = Grader(self.questions_by_id).compile_all()
+
+        # --- Lessons ---
+        self.lessons_by_id = lessons
+        self.lessons_by_concept = {}
+        for lesson in lessons.values():
+            self.lessons_by_concept.setdefault(lesson.get('concept_id'), []).append(lesson)
+
+        self.num_questions = len(questions)
+        self.num_lessons = len(lessons)
+
+    def _index_concepts(self, concepts):
+        concepts_list = concepts.get('concepts', []) if isinstance(concepts, dict) else []
+
+        # --- Concepts ---
+        self.concepts_by_id = {}
+        for c in concepts_list:
+            # First definition wins, same as a linear scan would
+            self.concepts_by_id.setdefault(c.get('id'), c)
+
+        # Compile the prerequisite graph once; its topological order is the
+        # teaching order (ties broken by the number in the concept ID).
+        prerequisites = concepts.get('prerequisites', []) if isinstance(concepts, dict) else []
+        self.concept_graph = ConceptGraph(concepts_list, prerequisites)
+        self.ordered_concepts = self.concept_graph.ordered_concepts
+        # Position of each concept in the teaching order; compact per-concept
+        # arrays (e.g. mastery) are indexed by this position.
+        self.concept_ids = self.concept_graph.concept_ids
+        self.concept_positions = self.concept_graph.positions
+        self.num_concepts = self.concept_graph.num_concepts # Duplicates and id-less concepts are skipped
+
+    def get_questions_for_concept(self, concept_id):
+        """Questions for a concept sorted by difficulty, hardest first."""
+        return self.questions_by_concept.get(concept_id, [])
+
+    def get_lessons_for_concept(self, concept_id):
+        """Lessons for a concept, in file order."""
+        return self.lessons_by_concept.get(concept_id, [])
+
+    def lesson_id(self, lesson):
+        """The id a lesson is stored under (lesson records do not carry it), or None."""
+        lesson_ids = self._lesson_ids
+        if lesson_ids is None:
+            lesson_ids = {}
+            for lesson_id, record in self.lessons_by_id.items():
+                lesson_ids.setdefault(record.get('concept_id'), []).append((lesson_id, record))
+            self._lesson_ids = lesson_ids
+        for lesson_id, record in lesson_ids.get(lesson.get('concept_id'), ()):
+            if record is lesson or record == lesson:
+                return lesson_id
+        return None
+
+
+class BinaryContentIndex(ContentIndex):
+    """
+    ContentIndex over a mapped ContentFile. Concepts are decoded up front
+    (the prerequisite graph needs them); questions and lessons are decoded
+    one record at a time when first used. Per-concept question lists also
+    carry a `difficulties` column, so policies can score a concept without
+    decoding its questions.
+    """
+    def __init__(self, content_file, cache_size=4096):
+        meta = content_file.meta
+        self.content_file = content_file
+        self.version = meta.get('version')
+        self.concepts = meta.get('concepts') or {}
+        self._index_concepts(self.concepts)
+
+        # --- Questions ---
+        difficulty = content_file.column("question_difficulty", 'f')
+        questions = RecordTable(
+            content_file.sections["question_records"],
+            content_file.column("question_offsets", 'Q'),
+            cache_size
+        )
+        self.question_records = questions # Every question, grouped by concept
+        self.questions_by_id = KeyedRecords(
+            questions,
+            content_file.sections["question_keys"],
+            content_file.column("question_key_offsets", 'Q'),
+            content_file.column("question_key_targets", 'I'),
+            cache_size
+        )
+        self.questions_by_concept = {
+            concept_id: RecordSlice(questions, start, end, difficulty)
+            for concept_id, start, end in meta.get('question_groups', [])
+        }
+        # Matchers are compiled when a question is first graded (compiling
+        # them all here would decode every question)
+        self.grader = Grader(self.questions_by_id)
+
+        # --- Lessons ---
+        lessons = RecordTable(
+            content_file.sections["lesson_records"],
+            content_file.column("lesson_offsets", 'Q'),
+            cache_size
+        )
+        self.lessons_by_id = KeyedRecords(
+            lessons,
+            content_file.sections["lesson_keys"],
+            content_file.column("lesson_key_offsets", 'Q'),
+            content_file.column("lesson_key_targets", 'I'),
+            cache_size
+        )
+        self.lessons_by_concept = {
+            concept_id: RecordSlice(lessons, start, end)
+            for concept_id, start, end in meta.get('lesson_groups', [])
+        }
+
+        self.num_questions = len(questions)
+        self.num_lessons = len(lessons)
@@ -0,0 +1,378 @@
+"""
+Compiled content files.
+
+The JSON banks (knowledge.json, question.json, lesson.json) are compiled
+offline into one binary file that every worker maps read-only, so the
+records live once in the OS page cache instead of once per process as
+Python dicts. Records stay compact UTF-8 JSON and are only decoded when
+a request touches them.
+
+    python -m src.content_store data/ data/content.bin
+
+Layout (little-endian, every section 8-byte aligned):
+
+    header    magic "TUTORCB1", format version, number of sections
+    toc       (offset, length) per section, in SECTIONS order
+    meta      JSON: content version, concepts, per-concept record ranges
+    records   question / lesson records laid end to end, grouped by
+              concept (questions hardest first), plus u64 offsets
+    keys      JSON-encoded ids sorted bytewise, u64 offsets and the u32
+              record number of each id, for binary search
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TUTORCB1"
+FORMAT_VERSION = 1
+SECTIONS = (
+    "meta",
+    "question_records", "question_offsets", "question_difficulty",
+    "question_keys", "question_key_offsets", "question_key_targets",
+    "lesson_records", "lesson_offsets",
+    "lesson_keys", "lesson_key_offsets", "lesson_key_targets",
+)
+_HEADER = struct.Struct("<8sII") # magic, format version, number of sections
+_SECTION = struct.Struct("<QQ")  # offset, length
+_ALIGN = 8
+
+
+def encode_key(key):
+    """The byte form an id is stored and searched under (JSON, so 5 and "5" stay distinct)."""
+    return json.dumps(key, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _encode_record(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _typed_bytes(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column.tobytes()
+
+
+# --- Writing ---
+
+def _records_section(records):
+    """(records blob, offsets bytes) for a list of records."""
+    blob = bytearray()
+    offsets = [0]
+    for record in records:
+        blob.extend(_encode_record(record))
+        offsets.append(len(blob))
+    return bytes(blob), _typed_bytes('Q', offsets)
+
+
+def _keys_section(first_record):
+    """(keys blob, offsets bytes, targets bytes) for a dict of encoded key -> record number."""
+    blob = bytearray()
+    offsets = [0]
+    targets = []
+    for key in sorted(first_record):
+        blob.extend(key)
+        offsets.append(len(blob))
+        targets.append(first_record[key])
+    return bytes(blob), _typed_bytes('Q', offsets), _typed_bytes('I', targets)
+
+
+def _group_by_concept(items):
+    """
+    Groups (original position, record) pairs by concept_id, in order of first
+    appearance. Returns (ordered records, record number of each original position,
+    [[concept_id, start, end], ...]).
+    """
+    groups = {}
+    for position, record in items:
+        groups.setdefault(record.get('concept_id'), []).append((position, record))
+    ordered = []
+    record_of = {}
+    ranges = []
+    for concept_id, members in groups.items():
+        start = len(ordered)
+        for position, record in members:
+            record_of[position] = len(ordered)
+            ordered.append(record)
+        ranges.append([concept_id, start, len(ordered)])
+    return ordered, record_of, ranges
+
+
+def compile_content(concepts, questions, lessons, out_path):
+    """
+    Writes a compiled content file from the same structures the JSON files
+    hold. Matches ContentIndex: per-concept questions hardest first (stable),
+    first definition of a duplicate id wins. The file is written to a
+    temporary name and renamed, so readers never see a partial file.
+    Returns the content version (a SHA-256 of the compiled data).
+    """
+    concepts = concepts if isinstance(concepts, dict) else {}
+    questions = questions if isinstance(questions, list) else []
+    lessons = lessons if isinstance(lessons, dict) else {}
+
+    # --- Questions: grouped by concept, hardest first within a concept ---
+    grouped = {}
+    for position, question in enumerate(questions):
+        grouped.setdefault(question.get('concept_id'), []).append((position, question))
+    items = []
+    for members in grouped.values():
+        # Stable sort: same order as ContentIndex
+        members.sort(key=lambda item: item[1].get('difficulty', 0), reverse=True)
+        items.extend(members)
+    question_records, question_record_of, question_groups = _group_by_concept(items)
+    question_first = {}
+    for position, question in enumerate(questions): # File order decides duplicates
+        question_first.setdefault(encode_key(question.get('id')), question_record_of[position])
+    difficulty = [float(q.get('difficulty', 0) or 0) for q in question_records]
+
+    # --- Lessons: grouped by concept, file order within a concept ---
+    lesson_keys = list(lessons)
+    lesson_records, lesson_record_of, lesson_groups = _group_by_concept(
+        (position, lessons[key]) for position, key in enumerate(lesson_keys)
+    )
+    lesson_first = {encode_key(key): lesson_record_of[position] for position, key in enumerate(lesson_keys)}
+
+    sections = {}
+    sections["question_records"], sections["question_offsets"] = _records_section(question_records)
+    sections["question_difficulty"] = _typed_bytes('f', difficulty)
+    (sections["question_keys"], sections["question_key_offsets"],
+     sections["question_key_targets"]) = _keys_section(question_first)
+    sections["lesson_records"], sections["lesson_offsets"] = _records_section(lesson_records)
+    (sections["lesson_keys"], sections["lesson_key_offsets"],
+     sections["lesson_key_targets"]) = _keys_section(lesson_first)
+
+    digest = hashlib.sha256(_encode_record(concepts))
+    for name in SECTIONS[1:]:
+        digest.update(sections[name])
+    version = digest.hexdigest()[:16]
+    sections["meta"] = _encode_record({
+        "version": version,
+        "concepts": concepts,
+        "question_groups": question_groups,
+        "lesson_groups": lesson_groups,
+    })
+
+    # --- Lay out and write atomically ---
+    toc_size = _HEADER.size + _SECTION.size * len(SECTIONS)
+    offset = toc_size + (-toc_size % _ALIGN)
+    toc = []
+    for name in SECTIONS:
+        toc.append((offset, len(sections[name])))
+        offset += len(sections[name])
+        offset += -offset % _ALIGN
+
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.content-', dir=out_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(SECTIONS)))
+            for section_offset, length in toc:
+                f.write(_SECTION.pack(section_offset, length))
+            for name, (section_offset, _) in zip(SECTIONS, toc):
+                f.write(b"\0" * (section_offset - f.tell()))
+                f.write(sections[name])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    logger.info("Compiled %d questions and %d lessons into %s (version %s).",
+                len(question_records), len(lesson_records), out_path, version)
+    return version
+
+
+# --- Reading ---
+
+class ContentFile:
+    """
+    A compiled content file mapped read-only. Sections are zero-copy
+    memoryviews into the mapping, so every process that opens the same
+    file shares its pages.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, num_sections = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled content file")
+        if format_version != FORMAT_VERSION or num_sections != len(SECTIONS):
+            raise ValueError(f"{path} has content format {format_version}; expected {FORMAT_VERSION}")
+        view = memoryview(self._map)
+        self.sections = {}
+        for number, name in enumerate(SECTIONS):
+            offset, length = _SECTION.unpack_from(self._map, _HEADER.size + number * _SECTION.size)
+            self.sections[name] = view[offset:offset + length]
+        self.meta = json.loads(bytes(self.sections["meta"]))
+
+    def column(self, name, typecode):
+        """A numeric section as a typed, indexable view (copied only on big-endian hosts)."""
+        section = self.sections[name]
+        if sys.byteorder == 'little':
+            return section.cast(typecode)
+        column = array(typecode, bytes(section))
+        column.byteswap()
+        return column
+
+
+class RecordTable:
+    """
+    Records laid end to end in a mapped section, found through an offsets
+    column. A record is decoded from JSON when first read; recently used
+    ones are kept in an LRU cache.
+    """
+    def __init__(self, blob, offsets, cache_size=4096):
+        self.blob = blob
+        self.offsets = offsets
+        self._read = lru_cache(maxsize=cache_size)(self._decode)
+
+    def _decode(self, number):
+        return json.loads(bytes(self.blob[self.offsets[number]:self.offsets[number + 1]]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, number):
+        if isinstance(number, slice):
+            return [self._read(n) for n in range(*number.indices(len(self)))]
+        if number < 0:
+            number += len(self)
+        if not 0 <= number < len(self):
+            raise IndexError("record index out of range")
+        return self._read(number)
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self._read(number)
+
+
+class RecordSlice:
+    """
+    Records start..end of a RecordTable (one concept's questions or lessons),
+    usable wherever a list of record dicts was. `difficulties` is the
+    matching slice of the difficulty column, if the table has one.
+    """
+    __slots__ = ("table", "start", "end", "difficulties")
+
+    def __init__(self, table, start, end, difficulties=None):
+        self.table = table
+        self.start = start
+        self.end = end
+        self.difficulties = difficulties[start:end] if difficulties is not None else None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __bool__(self):
+        return self.end > self.start
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("record index out of range")
+        return self.table[self.start + position]
+
+    def __iter__(self):
+        for number in range(self.start, self.end):
+            yield self.table[number]
+
+
+class KeyedRecords:
+    """
+    Read-only mapping of id -> record, by binary search over the sorted
+    encoded ids (no per-process dict of every id).
+    """
+    def __init__(self, table, keys_blob, key_offsets, key_targets, cache_size=4096):
+        self.table = table
+        self.keys_blob = keys_blob
+        self.key_offsets = key_offsets
+        self.key_targets = key_targets
+        # Cached by encoded id: as dict keys 1, 1.0 and True are one key, but they are distinct ids
+        self._lookup = lru_cache(maxsize=cache_size)(self._find)
+
+    def _key_at(self, slot):
+        return bytes(self.keys_blob[self.key_offsets[slot]:self.key_offsets[slot + 1]])
+
+    def _find(self, encoded):
+        """Record number for an encoded id (see encode_key), or -1."""
+        low, high = 0, len(self.key_targets)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.key_targets) and self._key_at(low) == encoded:
+            return self.key_targets[low]
+        return -1
+
+    def get(self, key, default=None):
+        try:
+            number = self._lookup(encode_key(key))
+        except TypeError: # Not JSON-encodable: cannot be an id
+            return default
+        return self.table[number] if number >= 0 else default
+
+    def __getitem__(self, key):
+        record = self.get(key, self)
+        if record is self:
+            raise KeyError(key)
+        return record
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self.key_targets)
+
+    def keys(self):
+        return [json.loads(self._key_at(slot)) for slot in range(len(self))]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        return [self.table[self.key_targets[slot]] for slot in range(len(self))]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+
+# --- Command line ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the JSON content bank into a binary content file.")
+    parser.add_argument('data_dir', help="Directory with knowledge.json, question.json and lesson.json")
+    parser.add_argument('out', help="Compiled file to write (replaced atomically)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from src.content import ContentManager # Also validates the prerequisite graph
+    content_manager = ContentManager(
+        concepts_file=os.path.join(args.data_dir, 'knowledge.json'),
+        questions_file=os.path.join(args.data_dir, 'question.json'),
+        lessons_file=os.path.join(args.data_dir, 'lesson.json')
+    )
+    version = compile_content(content_manager.concepts, content_manager.questions,
+                              content_manager.lessons, args.out)
+    print(version)
+
+
+if __name__ == '__main__':
+    main()
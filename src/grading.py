@@ -0,0 +1,264 @@
+"""
+Answer grading.
+
+Each question gets a matcher, compiled once from its record when the
+content is loaded: the accepted answers are normalized up front, so
+grading a request only normalizes what the student typed.
+
+Normalization (normalize()) is Unicode NFC, zero-width characters removed
+(Khmer text often carries ZWSP/ZWNJ/ZWJ between words), runs of
+whitespace collapsed to one space, and casefold.
+
+Matchers by question `type`:
+    mcq     the chosen option; `answer` is the option text or its position
+    yes_no  yes/no in English or Khmer (Yes/No, បាទ/ចាស/ទេ, ...)
+    text    `answer` plus any alternatives in `answers`; if the answer is a
+            number (or `tolerance` is set) numeric answers within the
+            tolerance are accepted too
+Unknown types are graded like text. register_matcher() adds a type.
+"""
+import logging
+import math
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# ZWSP, ZWNJ, ZWJ, word joiner, BOM, soft hyphen, Khmer inherent vowels (invisible)
+_INVISIBLE = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff\u00ad\u17b4\u17b5"))
+_WHITESPACE = re.compile(r"\s+")
+# Sentence punctuation a typed text answer may end with (Khmer khan and bariyoosan included)
+_TRAILING_PUNCTUATION = ".!?។៕"
+# Commas are only accepted as thousands separators ("1,000"); "1,5" is not a number
+_GROUPED_NUMBER = re.compile(r"[+-]?\d{1,3}(?:,\d{3})+(?:\.\d*)?")
+
+YES_WORDS = frozenset({"yes", "y", "true", "បាទ", "ចាស", "ចា", "បាទ ចាស", "បាទចាស", "មែន", "ត្រូវ"})
+NO_WORDS = frozenset({"no", "n", "false", "ទេ", "អត់", "មិនមែន", "មិនត្រូវ"})
+
+DEFAULT_TOLERANCE = 1e-9
+
+# Answers up to this many characters are cached (typed answers are short and
+# repeat); longer ones come straight from a request body and are not kept
+CACHED_ANSWER_LENGTH = 64
+
+
+def normalize(text):
+    """The comparable form of an answer (see the module docstring)."""
+    text = str(text)
+    if len(text) <= CACHED_ANSWER_LENGTH:
+        return _normalize_short(text)
+    return _normalize(text)
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFC", text).translate(_INVISIBLE)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+_normalize_short = lru_cache(maxsize=4096)(_normalize) # At most 4096 x CACHED_ANSWER_LENGTH characters
+
+
+def parse_number(text):
+    """
+    A float from normalized text ("1,000" and Khmer digits such as "៣.៥"
+    included), or None. A comma that is not a thousands separator (a
+    decimal comma such as "1,5") makes the text non-numeric.
+    """
+    try:
+        text = text.replace(" ", "")
+        if "," in text:
+            if not _GROUPED_NUMBER.fullmatch(text):
+                return None
+            text = text.replace(",", "")
+        # float() already accepts any Unicode decimal digits, Khmer ones included
+        number = float(text)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+class ExactMatcher:
+    """Correct if the normalized answer is one of the accepted ones."""
+    __slots__ = ("accepted",)
+
+    def __init__(self, accepted):
+        self.accepted = frozenset(normalize(answer) for answer in accepted)
+
+    def __call__(self, normalized):
+        return normalized in self.accepted
+
+
+class TextMatcher(ExactMatcher):
+    """ExactMatcher that also ignores sentence punctuation at the end."""
+    __slots__ = ()
+
+    def __init__(self, accepted):
+        super().__init__(accepted)
+        self.accepted = frozenset(answer.rstrip(_TRAILING_PUNCTUATION).rstrip() for answer in self.accepted)
+
+    def __call__(self, normalized):
+        return normalized.rstrip(_TRAILING_PUNCTUATION).rstrip() in self.accepted
+
+
+class NumericMatcher:
+    """Correct within an absolute tolerance of the expected value, or an exact text match."""
+    __slots__ = ("value", "tolerance", "text")
+
+    def __init__(self, value, tolerance, text):
+        self.value = value
+        self.tolerance = tolerance
+        self.text = text
+
+    def __call__(self, normalized):
+        number = parse_number(normalized)
+        if number is not None and abs(number - self.value) <= self.tolerance:
+            return True
+        return self.text(normalized)
+
+
+class YesNoMatcher:
+    """Correct if the answer means the same yes/no as the expected one."""
+    __slots__ = ("expected",)
+
+    def __init__(self, expected):
+        self.expected = expected
+
+    def __call__(self, normalized):
+        return yes_no_value(normalized) is self.expected
+
+
+class NeverMatcher:
+    """For questions without a usable answer: nothing is correct."""
+    __slots__ = ()
+
+    def __call__(self, normalized):
+        return False
+
+
+def yes_no_value(normalized):
+    """True/False for a normalized yes/no answer, None if it is neither."""
+    if normalized in YES_WORDS:
+        return True
+    if normalized in NO_WORDS:
+        return False
+    return None
+
+
+def _accepted_answers(question):
+    """The question's answer plus its alternatives, as a list."""
+    answer = question.get('answer')
+    accepted = list(answer) if isinstance(answer, (list, tuple)) else ([] if answer is None else [answer])
+    alternatives = question.get('answers')
+    if isinstance(alternatives, (list, tuple)):
+        accepted.extend(alternatives)
+    return [answer for answer in accepted if not isinstance(answer, (dict, list))]
+
+
+def compile_text(question):
+    accepted = _accepted_answers(question)
+    if not accepted:
+        return NeverMatcher()
+    matcher = TextMatcher(accepted)
+    tolerance = question.get('tolerance')
+    value = parse_number(normalize(accepted[0]))
+    if value is None or isinstance(accepted[0], bool):
+        return matcher
+    try:
+        tolerance = abs(float(tolerance)) if tolerance is not None else DEFAULT_TOLERANCE
+    except (TypeError, ValueError):
+        logger.warning("Question %s has an invalid tolerance %r; grading exactly.", question.get('id'), tolerance)
+        tolerance = DEFAULT_TOLERANCE
+    return NumericMatcher(value, tolerance, matcher)
+
+
+def compile_mcq(question):
+    accepted = _accepted_answers(question)
+    options = question.get('options')
+    if isinstance(options, list):
+        # An integer answer is the position of the correct option
+        accepted = [options[answer] if isinstance(answer, int) and not isinstance(answer, bool)
+                    and 0 <= answer < len(options) else answer
+                    for answer in accepted]
+    return ExactMatcher(accepted) if accepted else NeverMatcher()
+
+
+def compile_yes_no(question):
+    answer = question.get('answer')
+    expected = answer if isinstance(answer, bool) else yes_no_value(normalize(answer if answer is not None else ""))
+    if expected is None:
+        # Not a recognised yes/no word: fall back to comparing the text
+        logger.warning("Question %s has yes/no answer %r; grading it as text.", question.get('id'), answer)
+        return compile_text(question)
+    return YesNoMatcher(expected)
+
+
+MATCHERS = {
+    "mcq": compile_mcq,
+    "yes_no": compile_yes_no,
+    "text": compile_text,
+}
+
+
+def register_matcher(question_type, compile_function):
+    """
+    Adds (or replaces) the matcher for a question type. compile_function
+    takes the question record and returns a callable that takes the
+    normalized answer and returns True if it is correct. Registered types
+    apply to content loaded afterwards.
+    """
+    MATCHERS[question_type] = compile_function
+
+
+def compile_matcher(question):
+    """The matcher for one question record."""
+    return MATCHERS.get(question.get('type'), compile_text)(question)
+
+
+class Grader:
+    """
+    The compiled matchers for one content version, by question id.
+    compile_all() builds them all up front (JSON content); otherwise each
+    is built on first use and kept (mapped content, whose questions are
+    only decoded when needed).
+    """
+    def __init__(self, questions_by_id):
+        self.questions_by_id = questions_by_id
+        self._matchers = {}
+        self._lock = threading.Lock()
+
+    def compile_all(self):
+        for question_id, question in self.questions_by_id.items():
+            self._matchers[question_id] = compile_matcher(question)
+        return self
+
+    def matcher(self, question_id):
+        """The matcher for a question, or None if there is no such question."""
+        matcher = self._matchers.get(question_id)
+        if matcher is None:
+            question = self.questions_by_id.get(question_id)
+            if question is None:
+                return None
+            with self._lock:
+                matcher = self._matchers.get(question_id)
+                if matcher is None:
+                    matcher = self._matchers[question_id] = compile_matcher(question)
+        return matcher
+
+    def grade(self, question_id, user_answer):
+        """True/False for the answer, or None if the question is unknown."""
+        matcher = self.matcher(question_id)
+        if matcher is None:
+            return None
+        if user_answer is None:
+            return False
+        return matcher(normalize(str(user_answer)))
+
+    def grade_many(self, answers):
+        """
+        Grades (question_id, user_answer) pairs, e.g. a replay or a test set.
+        Returns a list with True/False (None for unknown questions) per pair.
+        """
+        grade = self.grade
+        return [grade(question_id, user_answer) for question_id, user_answer in answers]
@@ -0,0 +1,189 @@
+import threading
+import time
+from array import array
+
+INT32_MAX = 2**31 - 1
+NO_RESPONSE_TIME = -1 # Stored when the client sent no usable response time
+
+
+class QuestionIdTable:
+    """
+    Interns question IDs to small ints so each history row stores an
+    int32 instead of a reference to a string. Shared by all students.
+    """
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+        self._lock = threading.Lock()
+
+    def intern(self, question_id):
+        """Returns the int for question_id, adding it if it is new."""
+        position = self.positions.get(question_id)
+        if position is None:
+            with self._lock:
+                position = self.positions.get(question_id)
+                if position is None:
+                    position = len(self.ids)
+                    self.ids.append(question_id)
+                    self.positions[question_id] = position
+        return position
+
+    def lookup(self, position):
+        """Returns the question ID stored under position."""
+        return self.ids[position]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# Process-wide table; interned ints are only meaningful inside one process.
+QUESTION_IDS = QuestionIdTable()
+
+
+class InteractionLog:
+    """
+    Columnar, append-only interaction history.
+    Columns: interned question ids (int32), correctness (bit-packed),
+    response times in ms (int32) and wall-clock timestamps (float64 epoch
+    seconds: they are stored and read back by other processes and hosts).
+
+    Reading it like the old list of dicts still works: len(), indexing
+    and iteration yield {"question_id", "is_correct", "response_time_ms",
+    "timestamp"} dicts. Hot paths should use the column helpers instead.
+    """
+    __slots__ = ("question_table", "question_indices", "correct_bits",
+                 "response_times", "timestamps", "_num_correct")
+
+    def __init__(self, question_table=QUESTION_IDS):
+        self.question_table = question_table
+        self.question_indices = array('i')
+        self.correct_bits = bytearray() # Bit i is set if interaction i was correct
+        self.response_times = array('i')
+        self.timestamps = array('d')
+        self._num_correct = 0
+
+    def append(self, question_id, is_correct, response_time_ms, timestamp=None):
+        """
+        Adds one interaction. Returns its position in the log.
+        timestamp defaults to time.time().
+        """
+        position = len(self.question_indices)
+        self.question_indices.append(self.question_table.intern(question_id))
+
+        if position % 8 == 0:
+            self.correct_bits.append(0)
+        if is_correct:
+            self.correct_bits[position >> 3] |= 1 << (position & 7)
+            self._num_correct += 1
+
+        self.response_times.append(self._to_int32_ms(response_time_ms))
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+        return position
+
+    # --- Column helpers (fast paths) ---
+
+    def question_id(self, position):
+        return self.question_table.lookup(self.question_indices[position])
+
+    def is_correct(self, position):
+        if position < 0:
+            position += len(self.question_indices)
+        return bool(self.correct_bits[position >> 3] >> (position & 7) & 1)
+
+    def num_correct(self):
+        """Number of correct answers, kept as a running count."""
+        return self._num_correct
+
+    def correct_flags(self):
+        """Yields correctness as bools, in order, without building row dicts."""
+        bits = self.correct_bits
+        for position in range(len(self.question_indices)):
+            yield bool(bits[position >> 3] >> (position & 7) & 1)
+
+    def question_id_set(self):
+        """Set of all question IDs that appear in the log."""
+        lookup = self.question_table.lookup
+        return {lookup(index) for index in set(self.question_indices)}
+
+    # --- Serialization (used by the persistent store) ---
+
+    def to_columns(self):
+        """
+        Returns the log as plain columns with process-independent question ids:
+        (question_ids, local_indices, correct_bits, response_times, timestamps).
+        The array columns are raw bytes in native byte order.
+        """
+        local_positions = {}
+        question_ids = []
+        local_indices = array('i')
+        lookup = self.question_table.lookup
+        for index in self.question_indices:
+            local = local_positions.get(index)
+            if local is None:
+                local = local_positions[index] = len(question_ids)
+                question_ids.append(lookup(index))
+            local_indices.append(local)
+        return (
+            question_ids,
+            local_indices.tobytes(),
+            bytes(self.correct_bits),
+            self.response_times.tobytes(),
+            self.timestamps.tobytes(),
+        )
+
+    @classmethod
+    def from_columns(cls, columns, question_table=QUESTION_IDS):
+        """Rebuilds a log from the output of to_columns()."""
+        question_ids, local_indices, correct_bits, response_times, timestamps = columns
+        log = cls(question_table)
+        interned = [question_table.intern(question_id) for question_id in question_ids]
+        local = array('i')
+        local.frombytes(local_indices)
+        log.question_indices = array('i', [interned[i] for i in local])
+        log.correct_bits = bytearray(correct_bits)
+        log.response_times.frombytes(response_times)
+        log.timestamps.frombytes(timestamps)
+        log._num_correct = sum(bin(byte).count("1") for byte in log.correct_bits)
+        return log
+
+    # --- List-of-dicts compatibility ---
+
+    def row(self, position):
+        """Dict view of one interaction (the old history row format)."""
+        response_time = self.response_times[position]
+        return {
+            "question_id": self.question_id(position),
+            "is_correct": self.is_correct(position),
+            "response_time_ms": None if response_time == NO_RESPONSE_TIME else response_time,
+            "timestamp": self.timestamps[position],
+        }
+
+    def __len__(self):
+        return len(self.question_indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.row(position) for position in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("interaction index out of range")
+        return self.row(key)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.row(position)
+
+    def __bool__(self):
+        return len(self.question_indices) > 0
+
+    @staticmethod
+    def _to_int32_ms(response_time_ms):
+        """Clamps a client-supplied response time into an int32 column."""
+        try:
+            value = int(response_time_ms)
+        except (TypeError, ValueError, OverflowError):
+            return NO_RESPONSE_TIME
+        if value < 0:
+            return NO_RESPONSE_TIME
+        return min(value, INT32_MAX)
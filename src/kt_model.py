@@ -0,0 +1,296 @@
+"""
+Windowed knowledge-tracing model for CPU inference (NumPy only).
+
+Input tokens use the encoding of tracers.get_interaction_id: concept
+index k answered wrong is token k, answered right is k + num_concepts.
+Token 2 * num_concepts pads windows shorter than the context length.
+
+For the last `window` tokens (oldest first):
+
+    h = tanh(c + sum_k decay[k] * E[token_k])
+    P(correct on concept j) = sigmoid(b[j] + Q[j] . h)
+
+so one answer costs a (window x dim) gather and a (num_concepts x dim)
+matrix-vector product. The embedding tables E and Q can be stored as
+float32, float16 or int8 (symmetric, one scale per row); they stay in that
+precision in memory: a step widens the E rows of its window and Q a
+block of rows at a time (MATVEC_BLOCK_ROWS), never the whole table.
+"""
+import json
+import logging
+import os
+
+np = None # Imported on first use, so the serving process only pays for it with this tracer
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("float32", "float16", "int8")
+FORMAT_VERSION = 1
+MATVEC_BLOCK_ROWS = 256 # Rows of a float16/int8 table widened at once by QuantizedTable.matvec
+
+
+def load_numpy():
+    """Imports NumPy (once) and returns it."""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def _sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x)) # Never overflows, unlike 1 / (1 + exp(-x))
+
+
+class QuantizedTable:
+    """
+    A float matrix kept in float32, float16 or int8.
+    int8 rows are stored as round(row / scale) with scale = max|row| / 127.
+    """
+    __slots__ = ("values", "scales", "precision")
+
+    def __init__(self, values, scales=None, precision="float32"):
+        self.values = values
+        self.scales = scales
+        self.precision = precision
+
+    @classmethod
+    def from_float(cls, matrix, precision):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision!r}")
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if precision == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            values = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+            return cls(values, scales.astype(np.float32), precision)
+        if precision == "float16":
+            # Subnormal halves widen far slower than normal ones; they are ~0 anyway
+            matrix = np.where(np.abs(matrix) < np.finfo(np.float16).tiny, 0.0, matrix)
+        return cls(matrix.astype(precision), None, precision)
+
+    def rows(self, indices):
+        """Dequantized rows (float32), any index shape."""
+        rows = self.values[indices].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[indices][..., None]
+        return rows
+
+    def matvec(self, vectors):
+        """
+        vectors (..., dim) -> (..., num_rows): each vector dotted with every
+        row. float16/int8 rows are widened MATVEC_BLOCK_ROWS at a time, so a
+        step never holds a float32 copy of the whole table.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.values.dtype == np.float32:
+            return vectors @ self.values.T # No copy: multiplied as stored
+        num_rows = self.values.shape[0]
+        out = np.empty(vectors.shape[:-1] + (num_rows,), dtype=np.float32)
+        for start in range(0, num_rows, MATVEC_BLOCK_ROWS):
+            stop = min(start + MATVEC_BLOCK_ROWS, num_rows)
+            np.matmul(vectors, self.values[start:stop].T.astype(np.float32), out=out[..., start:stop])
+        if self.scales is not None:
+            out *= self.scales
+        return out
+
+    def to_float(self):
+        return self.rows(np.arange(self.values.shape[0]))
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+class KnowledgeModel:
+    """
+    The model's parameters plus batched forward/backward passes.
+    Training keeps every table in float32; save() writes the embedding
+    tables at the requested precision, and load() keeps them that way.
+    """
+    def __init__(self, num_concepts, window, dim, params, precision="float32"):
+        load_numpy()
+        self.num_concepts = int(num_concepts)
+        self.window = int(window)
+        self.dim = int(dim)
+        self.pad_token = 2 * self.num_concepts
+        self.precision = precision
+        self.embeddings = params["embeddings"] # QuantizedTable (2N + 1, dim); the pad row is zero
+        self.decay = params["decay"]           # (window,) weight of each window slot, oldest first
+        self.hidden_bias = params["hidden_bias"] # (dim,)
+        self.concept_vectors = params["concept_vectors"] # QuantizedTable (N, dim)
+        self.concept_bias = params["concept_bias"]   # (N,)
+        self.metadata = {}
+
+    @classmethod
+    def create(cls, num_concepts, window=50, dim=32, seed=0):
+        """A freshly initialized float32 model."""
+        load_numpy()
+        rng = np.random.default_rng(seed)
+        embeddings = rng.normal(0.0, 0.1, (2 * num_concepts + 1, dim)).astype(np.float32)
+        embeddings[2 * num_concepts] = 0.0
+        params = {
+            "embeddings": QuantizedTable(embeddings),
+            # Recent answers start out weighing more than old ones
+            "decay": np.linspace(0.2, 1.0, window, dtype=np.float32),
+            "hidden_bias": np.zeros(dim, dtype=np.float32),
+            "concept_vectors": QuantizedTable(rng.normal(0.0, 0.1, (num_concepts, dim)).astype(np.float32)),
+            "concept_bias": np.zeros(num_concepts, dtype=np.float32),
+        }
+        return cls(num_concepts, window, dim, params)
+
+    # --- Inference ---
+
+    def hidden(self, windows):
+        """windows: int array (..., window) of tokens -> hidden vectors (..., dim)."""
+        pre = np.einsum('...k,...kd->...d', self.decay, self.embeddings.rows(windows))
+        return np.tanh(pre + self.hidden_bias)
+
+    def mastery(self, windows):
+        """Probability of a correct answer on every concept: (..., num_concepts) float32."""
+        logits = self.concept_vectors.matvec(self.hidden(windows)) + self.concept_bias
+        return _sigmoid(logits).astype(np.float32)
+
+    def predict(self, windows, concepts):
+        """Probability of a correct answer on concepts[i] after windows[i]."""
+        hidden = self.hidden(windows)
+        logits = (self.concept_vectors.rows(concepts) * hidden).sum(axis=-1) + self.concept_bias[concepts]
+        return _sigmoid(logits)
+
+    # --- Training (float32 only) ---
+
+    def parameters(self):
+        """The trainable float32 arrays, by name (views, updated in place)."""
+        return {
+            "embeddings": self.embeddings.values,
+            "decay": self.decay,
+            "hidden_bias": self.hidden_bias,
+            "concept_vectors": self.concept_vectors.values,
+            "concept_bias": self.concept_bias,
+        }
+
+    def loss_and_gradients(self, windows, concepts, labels):
+        """
+        Mean log-loss of predicting labels (0/1) for concepts after windows,
+        and its gradient for every parameter.
+        """
+        if self.precision != "float32":
+            raise ValueError("Only a float32 model can be trained")
+        batch = len(labels)
+        embedded = self.embeddings.values[windows]                   # (B, W, D)
+        hidden = np.tanh(np.einsum('k,bkd->bd', self.decay, embedded) + self.hidden_bias)
+        vectors = self.concept_vectors.values[concepts]              # (B, D)
+        probs = _sigmoid((vectors * hidden).sum(axis=1) + self.concept_bias[concepts])
+
+        clipped = np.clip(probs, 1e-7, 1 - 1e-7)
+        loss = -np.mean(labels * np.log(clipped) + (1 - labels) * np.log(1 - clipped))
+
+        # Backward pass
+        d_logits = ((probs - labels) / batch).astype(np.float32)     # (B,)
+        d_concept_bias = np.bincount(concepts, d_logits, self.num_concepts).astype(np.float32)
+        d_concept_vectors = np.zeros_like(self.concept_vectors.values)
+        np.add.at(d_concept_vectors, concepts, d_logits[:, None] * hidden)
+        d_pre = d_logits[:, None] * vectors * (1 - hidden * hidden)  # (B, D)
+        d_hidden_bias = d_pre.sum(axis=0)
+        d_decay = np.einsum('bkd,bd->k', embedded, d_pre)
+        d_embeddings = np.zeros_like(self.embeddings.values)
+        np.add.at(d_embeddings, windows.ravel(),
+                  (self.decay[None, :, None] * d_pre[:, None, :]).reshape(-1, self.dim))
+        d_embeddings[self.pad_token] = 0.0 # Padding stays a zero vector
+
+        return float(loss), {
+            "embeddings": d_embeddings,
+            "decay": d_decay,
+            "hidden_bias": d_hidden_bias,
+            "concept_vectors": d_concept_vectors,
+            "concept_bias": d_concept_bias,
+        }
+
+    # --- Persistence ---
+
+    def save(self, path, precision="int8", metadata=None):
+        """
+        Writes the model as an .npz file with the embedding tables at
+        `precision`. Returns the number of bytes the weights take.
+        """
+        tables = {}
+        for name in ("embeddings", "concept_vectors"):
+            table = QuantizedTable.from_float(getattr(self, name).to_float(), precision)
+            tables[name] = table.values
+            if table.scales is not None:
+                tables[name + "_scales"] = table.scales
+        header = {
+            "format_version": FORMAT_VERSION,
+            "num_concepts": self.num_concepts,
+            "window": self.window,
+            "dim": self.dim,
+            "precision": precision,
+            "metadata": metadata or {},
+        }
+        # Written next to the target and renamed, so a reader never sees half a file
+        temp_path = f"{path}.tmp.{os.getpid()}"
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                header=np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8),
+                decay=self.decay,
+                hidden_bias=self.hidden_bias,
+                concept_bias=self.concept_bias,
+                **tables
+            )
+        os.replace(temp_path, path)
+        return sum(array.nbytes for array in tables.values())
+
+    @classmethod
+    def load(cls, path):
+        """Reads a model written by save(); tables keep their stored precision."""
+        load_numpy()
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode('utf-8'))
+            if header.get("format_version") != FORMAT_VERSION:
+                raise ValueError(f"Unsupported model format in {path}: {header.get('format_version')!r}")
+            precision = header["precision"]
+
+            def table(name):
+                scales = data[name + "_scales"] if precision == "int8" else None
+                return QuantizedTable(data[name], scales, precision)
+
+            params = {
+                "embeddings": table("embeddings"),
+                "decay": data["decay"].astype(np.float32),
+                "hidden_bias": data["hidden_bias"].astype(np.float32),
+                "concept_vectors": table("concept_vectors"),
+                "concept_bias": data["concept_bias"].astype(np.float32),
+            }
+        model = cls(header["num_concepts"], header["window"], header["dim"], params, precision)
+        model.metadata = header.get("metadata") or {}
+        return model
+
+
+class Adam:
+    """Adam optimizer over a dict of float32 arrays, updated in place."""
+    def __init__(self, parameters, learning_rate=0.01, beta1=0.9, beta2=0.999, epsilon=1e-8, weight_decay=0.0):
+        self.parameters = parameters
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.weight_decay = weight_decay
+        self.steps = 0
+        self.first = {name: np.zeros_like(value) for name, value in parameters.items()}
+        self.second = {name: np.zeros_like(value) for name, value in parameters.items()}
+
+    def step(self, gradients):
+        self.steps += 1
+        correction1 = 1 - self.beta1 ** self.steps
+        correction2 = 1 - self.beta2 ** self.steps
+        for name, value in self.parameters.items():
+            gradient = gradients[name]
+            if self.weight_decay and value.ndim > 1:
+                gradient = gradient + self.weight_decay * value
+            first, second = self.first[name], self.second[name]
+            first *= self.beta1
+            first += (1 - self.beta1) * gradient
+            second *= self.beta2
+            second += (1 - self.beta2) * gradient * gradient
+            value -= self.learning_rate * (first / correction1) / (np.sqrt(second / correction2) + self.epsilon)
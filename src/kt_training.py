@@ -0,0 +1,231 @@
+"""
+Offline trainer for the windowed knowledge-tracing model (src/kt_model.py).
+
+Streams logged histories out of a StudentStore a chunk of students at a
+time, turns each answer into a training example (the window of answers
+before it -> was this one correct), and fits the model with Adam.
+Students are split into train/validation by a hash of their id, so the
+split is stable across epochs and runs.
+
+    python -m src.kt_training --store state/students.db --data-dir data/ \
+        --out model/tracer.npz --precision int8
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import zlib
+
+from src.kt_model import PRECISIONS, Adam, KnowledgeModel, load_numpy
+from src.tracers import concept_number, get_interaction_id
+
+logger = logging.getLogger(__name__)
+
+
+class ExampleBuilder:
+    """
+    Turns InteractionLogs into (windows, concepts, labels) arrays, using the
+    content index to map questions to concepts. Answers to questions the
+    index does not know (or whose concept has no number) are skipped.
+    """
+    def __init__(self, content_manager, num_concepts, window):
+        self.np = load_numpy()
+        self.content_manager = content_manager
+        self.num_concepts = num_concepts
+        self.window = window
+        self.pad_token = 2 * num_concepts
+        self._concepts = {} # question_id -> concept id string, or None
+
+    def concept_of(self, question_id):
+        concept_id = self._concepts.get(question_id, False)
+        if concept_id is False:
+            question = self.content_manager.index.questions_by_id.get(question_id)
+            concept_id = question.get('concept_id') if question else None
+            number = concept_number(concept_id)
+            if number is None or not 1 <= number <= self.num_concepts:
+                concept_id = None
+            self._concepts[question_id] = concept_id
+        return concept_id
+
+    def tokens(self, history):
+        """The history's token sequence (get_interaction_id encoding)."""
+        tokens = []
+        for position in range(len(history)):
+            concept_id = self.concept_of(history.question_id(position))
+            if concept_id is not None:
+                tokens.append(get_interaction_id(concept_id, history.is_correct(position), self.num_concepts))
+        return tokens
+
+    def examples(self, histories):
+        """One example per known answer in histories: the window before it and its outcome."""
+        np = self.np
+        windows, concepts, labels = [], [], []
+        for history in histories:
+            tokens = np.asarray(self.tokens(history), dtype=np.int32)
+            if not len(tokens):
+                continue
+            padded = np.concatenate([np.full(self.window, self.pad_token, dtype=np.int32), tokens])
+            # Row t holds tokens t - window .. t - 1 (left-padded)
+            windows.append(np.lib.stride_tricks.sliding_window_view(padded, self.window)[:len(tokens)])
+            correct = tokens >= self.num_concepts
+            concepts.append(tokens - self.num_concepts * correct)
+            labels.append(correct.astype(np.float32))
+        if not windows:
+            empty = np.zeros(0, dtype=np.int32)
+            return np.zeros((0, self.window), dtype=np.int32), empty, empty.astype(np.float32)
+        return np.concatenate(windows), np.concatenate(concepts), np.concatenate(labels)
+
+
+def is_validation(student_id, fraction):
+    """Stable train/validation split by student id."""
+    return fraction > 0 and zlib.crc32(str(student_id).encode('utf-8')) % 10000 < fraction * 10000
+
+
+def iter_chunks(histories, chunk_students):
+    """Groups (student_id, history) pairs into lists of chunk_students."""
+    chunk = []
+    for item in histories:
+        chunk.append(item)
+        if len(chunk) >= chunk_students:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def binary_metrics(labels, probs):
+    """Log-loss, accuracy (at 0.5) and ROC AUC of probs for 0/1 labels."""
+    np = load_numpy()
+    labels = np.asarray(labels, dtype=np.float64)
+    probs = np.asarray(probs, dtype=np.float64)
+    if not len(labels):
+        return {"examples": 0, "log_loss": None, "accuracy": None, "auc": None}
+    clipped = np.clip(probs, 1e-7, 1 - 1e-7)
+    log_loss = -np.mean(labels * np.log(clipped) + (1 - labels) * np.log(1 - clipped))
+    accuracy = np.mean((probs >= 0.5) == (labels == 1))
+
+    # AUC from average ranks (ties share their rank)
+    num_positive = labels.sum()
+    num_negative = len(labels) - num_positive
+    auc = None
+    if num_positive and num_negative:
+        order = np.argsort(probs, kind='mergesort')
+        sorted_probs = probs[order]
+        ranks = np.empty(len(probs))
+        _, first, counts = np.unique(sorted_probs, return_index=True, return_counts=True)
+        average = first + (counts + 1) / 2.0 # Average 1-based rank of each group of ties
+        ranks[order] = np.repeat(average, counts)
+        auc = (ranks[labels == 1].sum() - num_positive * (num_positive + 1) / 2) / (num_positive * num_negative)
+    return {"examples": int(len(labels)), "log_loss": float(log_loss),
+            "accuracy": float(accuracy), "auc": None if auc is None else float(auc)}
+
+
+def train(store, content_manager, num_concepts=None, window=50, dim=32, epochs=3,
+          batch_size=256, chunk_students=512, learning_rate=0.01, weight_decay=1e-5,
+          validation_fraction=0.1, seed=0, log_every=50):
+    """
+    Fits a KnowledgeModel on every history in store. Only one chunk of
+    students (and its examples) is in memory at a time.
+    num_concepts defaults to the highest concept number in the content.
+    Returns (model, report) where report has per-epoch training loss and
+    validation metrics.
+    """
+    np = load_numpy()
+    if num_concepts is None:
+        numbers = [concept_number(concept_id) for concept_id in content_manager.index.concept_ids]
+        num_concepts = max([n for n in numbers if n is not None], default=0)
+    if num_concepts <= 0:
+        raise ValueError("The content has no numbered concepts to train on")
+
+    model = KnowledgeModel.create(num_concepts, window=window, dim=dim, seed=seed)
+    optimizer = Adam(model.parameters(), learning_rate=learning_rate, weight_decay=weight_decay)
+    builder = ExampleBuilder(content_manager, num_concepts, window)
+    rng = np.random.default_rng(seed)
+    report = {"num_concepts": num_concepts, "window": window, "dim": dim, "epochs": []}
+
+    for epoch in range(1, epochs + 1):
+        started = time.perf_counter()
+        losses, train_examples = [], 0
+        val_labels, val_probs = [], []
+        for chunk in iter_chunks(store.iter_histories(batch_size=chunk_students), chunk_students):
+            # 1. Split the chunk and build its examples
+            train_histories = [h for student_id, h in chunk if not is_validation(student_id, validation_fraction)]
+            val_histories = [h for student_id, h in chunk if is_validation(student_id, validation_fraction)]
+
+            # 2. Shuffled minibatch updates on the training part
+            windows, concepts, labels = builder.examples(train_histories)
+            order = rng.permutation(len(labels))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                loss, gradients = model.loss_and_gradients(windows[batch], concepts[batch], labels[batch])
+                optimizer.step(gradients)
+                losses.append(loss)
+                if log_every and optimizer.steps % log_every == 0:
+                    logger.info("epoch %d step %d: loss %.4f", epoch, optimizer.steps, np.mean(losses[-log_every:]))
+            train_examples += len(labels)
+
+            # 3. Score the validation part with the current weights
+            windows, concepts, labels = builder.examples(val_histories)
+            if len(labels):
+                val_labels.append(labels)
+                val_probs.append(model.predict(windows, concepts))
+
+        validation = binary_metrics(
+            np.concatenate(val_labels) if val_labels else [],
+            np.concatenate(val_probs) if val_probs else []
+        )
+        epoch_report = {
+            "epoch": epoch,
+            "train_examples": train_examples,
+            "train_loss": float(np.mean(losses)) if losses else None,
+            "validation": validation,
+            "seconds": time.perf_counter() - started,
+        }
+        report["epochs"].append(epoch_report)
+        logger.info("epoch %d done: %s", epoch, json.dumps(epoch_report))
+    return model, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the windowed knowledge-tracing model from a student store.")
+    parser.add_argument("--store", required=True, help="StudentStore SQLite file with logged histories")
+    parser.add_argument("--data-dir", default="data", help="Directory with knowledge.json, question.json, lesson.json")
+    parser.add_argument("--content-file", default=None, help="Compiled content file (instead of --data-dir)")
+    parser.add_argument("--out", default=os.path.join("model", "tracer.npz"))
+    parser.add_argument("--precision", choices=PRECISIONS, default="int8", help="Precision of the saved weights")
+    parser.add_argument("--window", type=int, default=50, help="Answers of context the model looks at")
+    parser.add_argument("--dim", type=int, default=32)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--chunk-students", type=int, default=512, help="Students read from the store at a time")
+    parser.add_argument("--learning-rate", type=float, default=0.01)
+    parser.add_argument("--validation-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    from src.content import ContentManager
+    from src.store import StudentStore
+
+    content_manager = ContentManager(
+        concepts_file=os.path.join(args.data_dir, 'knowledge.json'),
+        questions_file=os.path.join(args.data_dir, 'question.json'),
+        lessons_file=os.path.join(args.data_dir, 'lesson.json'),
+        compiled_file=args.content_file
+    )
+    store = StudentStore(args.store)
+    model, report = train(
+        store, content_manager, window=args.window, dim=args.dim, epochs=args.epochs,
+        batch_size=args.batch_size, chunk_students=args.chunk_students,
+        learning_rate=args.learning_rate, validation_fraction=args.validation_fraction, seed=args.seed
+    )
+    out_dir = os.path.dirname(os.path.abspath(args.out))
+    os.makedirs(out_dir, exist_ok=True)
+    weight_bytes = model.save(args.out, precision=args.precision, metadata={"report": report})
+    logger.info("Saved %s model to %s (%d bytes of embedding weights).", args.precision, args.out, weight_bytes)
+    print(json.dumps(report["epochs"][-1] if report["epochs"] else {}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
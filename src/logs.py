@@ -0,0 +1,96 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+DEFAULT_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_listener = None
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that hands the raw record to the listener thread.
+    The stock prepare() formats the message on the calling thread;
+    here formatting (and all I/O) happens in the background.
+    """
+    def prepare(self, record):
+        return record
+
+
+def parse_module_levels(spec):
+    """
+    Parses "src.tracers=DEBUG,src.policies=WARNING" into a dict of
+    logger name -> level name. Blank or malformed entries are skipped.
+    """
+    levels = {}
+    for entry in (spec or "").split(","):
+        name, sep, level = entry.partition("=")
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level=None, module_levels=None, stream=None, fmt=DEFAULT_FORMAT):
+    """
+    Sets up queue-based logging for the whole process:
+    loggers put records on an in-memory queue and one background thread
+    formats and writes them. Safe to call more than once; the last call wins.
+
+    level defaults to $TUTOR_LOG_LEVEL (or INFO); module_levels defaults to
+    $TUTOR_LOG_LEVELS, e.g. "src.tracers=DEBUG,werkzeug=WARNING".
+    """
+    global _listener
+
+    if level is None:
+        level = os.environ.get("TUTOR_LOG_LEVEL", "INFO")
+    if module_levels is None:
+        module_levels = parse_module_levels(os.environ.get("TUTOR_LOG_LEVELS"))
+
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(fmt))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _DeferredQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flushes queued records and stops the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    """
+    The writer thread does not survive fork: give a forked child its own,
+    reading the queue the inherited handler already points at.
+    """
+    global _listener
+    if _listener is not None:
+        _listener = logging.handlers.QueueListener(
+            _listener.queue, *_listener.handlers, respect_handler_level=_listener.respect_handler_level
+        )
+        _listener.start()
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,262 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds: 1us .. 10s, 1-2.5-5 steps per decade
+DEFAULT_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    """
+    Fixed-bucket histogram. observe() is one bisect plus two adds under a
+    lock; quantiles are estimated from the buckets when scraped.
+    """
+    __slots__ = ("buckets", "counts", "total", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is the +Inf overflow
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.total += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimates quantile q by linear interpolation inside its bucket."""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for slot, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[slot - 1] if slot > 0 else 0.0
+                if slot >= len(self.buckets):
+                    return lower # Overflow bucket: best we can say is "above the last bound"
+                upper = self.buckets[slot]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class _Family:
+    """A metric name with a fixed set of label names and one child per label set."""
+    def __init__(self, name, help_text, label_names, child_factory):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._child_factory = child_factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child_factory())
+        return child
+
+    def items(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class Counter(_Family):
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names, _CounterChild)
+
+    def inc(self, amount=1):
+        """Increments the unlabelled counter."""
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for values, child in self.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}")
+        return lines
+
+
+class Histogram(_Family):
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, label_names, lambda: _HistogramChild(self.buckets))
+
+    def observe(self, value):
+        """Records a value on the unlabelled histogram."""
+        self.labels().observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        quantile_lines = []
+        for values, child in self.items():
+            with child._lock:
+                counts = list(child.counts)
+                total = child.total
+                count = child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, values, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            plain = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{plain} {_format_value(total)}")
+            lines.append(f"{self.name}_count{plain} {count}")
+            for q in QUANTILES:
+                labels = _format_labels(self.label_names, values, [("quantile", q)])
+                quantile_lines.append(f"{self.name}_quantile{labels} {_format_value(child.quantile(q))}")
+        if quantile_lines:
+            lines.append(f"# HELP {self.name}_quantile Estimated p50/p95/p99 of {self.name}")
+            lines.append(f"# TYPE {self.name}_quantile gauge")
+            lines.extend(quantile_lines)
+        return lines
+
+
+class Gauge:
+    """A value read from a callback at scrape time. The callback may return a dict of label value -> number."""
+    def __init__(self, name, help_text, callback, label_name=None):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.label_name = label_name
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        if isinstance(value, dict):
+            for label_value, number in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels((self.label_name,), (label_value,))} {_format_value(number)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metric families and renders them in the Prometheus text format."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge(self, name, help_text, callback, label_name=None):
+        """Registers (or replaces) a callback gauge."""
+        with self._lock:
+            gauge = Gauge(name, help_text, callback, label_name)
+            self._metrics[name] = gauge
+            return gauge
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# ERROR rendering {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+# --- Process-wide registry and the tutor's standard metrics ---
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "tutor_stage_latency_seconds",
+    "Time spent in each stage of a tutoring turn.",
+    ("stage",)
+)
+REQUEST_LATENCY = REGISTRY.histogram(
+    "tutor_request_latency_seconds",
+    "Time spent in each HTTP handler.",
+    ("route",)
+)
+ACTIONS = REGISTRY.counter(
+    "tutor_actions_total",
+    "Actions returned to students, by type.",
+    ("type",)
+)
+CONCEPT_TRANSITIONS = REGISTRY.counter(
+    "tutor_concept_transitions_total",
+    "Times a student moved on to another concept, by reason.",
+    ("reason",)
+)
+
+PREFETCH = REGISTRY.counter(
+    "tutor_prefetch_total",
+    "Prefetched next actions: hit (used), miss (answer not covered) or dropped (never needed).",
+    ("result",)
+)
+REJECTIONS = REGISTRY.counter(
+    "tutor_rejected_requests_total",
+    "Requests turned away because a worker pool queue was full, by pool.",
+    ("pool",)
+)
+
+
+@contextmanager
+def timed(histogram_child):
+    """Times the with-block and records the elapsed seconds in histogram_child."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram_child.observe(time.perf_counter() - started)
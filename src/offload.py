@@ -0,0 +1,66 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class PoolFullError(RuntimeError):
+    """Raised instead of queueing when a BoundedExecutor is at capacity."""
+
+
+class BoundedExecutor:
+    """
+    A thread pool for blocking work (tracer inference, SQLite writes)
+    called from an asyncio event loop.
+
+    admit() is the backpressure point: once max_pending calls are running
+    or waiting it raises PoolFullError, so the server can answer 503
+    before it changes any state instead of letting an unbounded queue
+    build up latency. Work for an already admitted request is never
+    refused (refusing halfway would leave a turn half recorded).
+    All methods except shutdown() must be called from the event loop.
+    """
+    def __init__(self, name, max_workers=8, max_pending=1024):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(self.max_workers, int(max_pending))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._rejected = REJECTIONS.labels(name)
+        self.pending = 0 # Only touched on the event loop thread, so no lock
+        logger.info("Pool %r: %d workers, at most %d pending.", name, self.max_workers, self.max_pending)
+
+    def admit(self):
+        """Raises PoolFullError if the pool is at capacity."""
+        if self.pending >= self.max_pending:
+            self._rejected.inc()
+            raise PoolFullError(f"{self.name} pool is full ({self.pending} pending)")
+
+    async def run(self, fn, *args):
+        """Runs fn(*args) on a pool thread and returns its result."""
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        finally:
+            self.pending -= 1
+
+    async def wait_future(self, submit, *args):
+        """
+        Awaits the concurrent.futures.Future returned by submit(*args)
+        (e.g. BatchingTracer.submit), counting it as pending work.
+        """
+        self.pending += 1
+        try:
+            return await asyncio.wrap_future(submit(*args))
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {"pending": self.pending, "max_pending": self.max_pending, "workers": self.max_workers}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
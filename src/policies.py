@@ -1,4 +1,29 @@
+import heapq
+import logging
+import math
 import random
+from array import array
+
+from src.content import ContentIndex
+
+# NumPy is optional (MasteryTargetPolicy falls back to pure Python) and is
+# imported on first use, so the default policy does not pay for it at startup
+np = None
+_numpy_checked = False
+
+
+def _load_numpy():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+        _numpy_checked = True
+    return np
+
+logger = logging.getLogger(__name__)
 
 class SimpleDifficultyPolicy:
     """
@@ -6,74 +31,268 @@ class SimpleDifficultyPolicy:
     Selects the hardest unseen question for the current concept.
     Falls back to examples if no questions are left.
     """
-    def __init__(self, question_bank, example_bank):
+    def __init__(self, question_bank, example_bank, content_manager=None):
         """
         Requires the full list of questions and examples.
+        If a content_manager is given, its prebuilt index is used;
+        otherwise the policy indexes the banks itself.
         """
         self.question_bank = question_bank # Assumes a list of question dicts
         self.example_bank = example_bank   # Assumes a dict of example dicts (lessons)
-        print(f"  [Policy] Initialized with {len(question_bank)} questions.")
+        self.content_manager = content_manager
+        if content_manager is None:
+            self._own_index = ContentIndex({}, question_bank, example_bank)
+        else:
+            self._own_index = None
+        logger.info("Initialized with %d questions.", len(question_bank))
+
+    @property
+    def index(self):
+        """The ContentIndex used for per-concept lookups."""
+        if self._own_index is not None:
+            return self._own_index
+        return self.content_manager.index
 
-    def _select_question(self, student_history, current_concept_id):
+    def _select_question(self, student_history, current_concept_id, student=None):
         """
         Finds the hardest available question for the current concept.
+        With a Student, uses its incremental seen set and cursor;
+        otherwise rebuilds the seen set from the history.
         """
-        # 1. Filter questions by concept
-        questions_for_concept = [
-            q for q in self.question_bank
-            if q.get('concept_id') == current_concept_id
-        ]
+        # 1. Questions for this concept, already sorted hardest first
+        questions_for_concept = self.index.get_questions_for_concept(current_concept_id)
         if not questions_for_concept:
             return None # No questions found for this concept
 
-        # 2. Filter out seen questions
-        seen_question_ids = set(
-            interaction['question_id'] for interaction in student_history
-        )
-        available_questions = [
-            q for q in questions_for_concept
-            if q.get('id') not in seen_question_ids
-        ]
-
-        # 3. Select the hardest available one
-        if not available_questions:
-            print(f"  [Policy] No unseen questions found for concept {current_concept_id}.")
-            return None
+        # 2. + 3. Skip seen questions and take the hardest available one
+        if student is not None:
+            question = student.next_unseen_question(current_concept_id, questions_for_concept)
         else:
-            # Find question with max difficulty
-            return max(available_questions, key=lambda q: q.get('difficulty', 0))
+            if hasattr(student_history, 'question_id_set'):
+                seen_question_ids = student_history.question_id_set() # Columnar fast path
+            else:
+                seen_question_ids = set(
+                    interaction['question_id'] for interaction in student_history
+                )
+            question = next(
+                (q for q in questions_for_concept if q.get('id') not in seen_question_ids),
+                None
+            )
+
+        if question is None:
+            logger.debug("No unseen questions found for concept %s.", current_concept_id)
+        return question
 
     def _select_example(self, current_concept_id):
         """
         Finds a random example (lesson) for the concept.
         """
-        # Assumes example_bank is a dict like {"l1": {"concept_id": "c1", ...}}
-        examples_for_concept = [
-            ex for ex in self.example_bank.values()
-            if ex.get('concept_id') == current_concept_id
-        ]
+        examples_for_concept = self.index.get_lessons_for_concept(current_concept_id)
         if examples_for_concept:
             return random.choice(examples_for_concept)
         else:
-            print(f"  [Policy] No examples found for concept {current_concept_id}.")
+            logger.debug("No examples found for concept %s.", current_concept_id)
             return None
 
-    def select_action(self, student_state, student_history, current_concept_id):
+    def select_action(self, student_state, student_history, current_concept_id, student=None):
         """
         The main method called by the Tutor.
         Decides the next action based on a priority list.
+        Passing the Student enables the incremental seen-question fast path.
         """
         # --- Priority 1: Try to select a question ---
-        question = self._select_question(student_history, current_concept_id)
+        question = self._select_question(student_history, current_concept_id, student)
+        return self._action_for(question, current_concept_id)
+
+    def _action_for(self, question, current_concept_id):
+        """
+        Turns the chosen question (or None) into an action,
+        falling back to an example and then to ending the concept.
+        """
         if question is not None:
             return ("question", question)
 
         # --- Priority 2: Try to select an example ---
-        print(f"  [Policy] No questions left for {current_concept_id}. Trying example.")
+        logger.debug("No questions left for %s. Trying example.", current_concept_id)
         example = self._select_example(current_concept_id)
         if example is not None:
             return ("example", example)
 
         # --- Priority 3: Give up ---
-        print(f"  [Policy] No questions or examples left for {current_concept_id}.")
+        logger.debug("No questions or examples left for %s.", current_concept_id)
         return ("end_concept", {"concept_id": current_concept_id, "message": "Concept complete!"})
+
+
+class MasteryTargetPolicy(SimpleDifficultyPolicy):
+    """
+    A mastery-driven policy.
+    Predicts each question's success probability from the student's mastery
+    of its concept and the question's difficulty,
+        p = sigmoid(slope * (mastery - difficulty)),
+    and picks the unseen question that best fits the objective:
+      - "target":      p closest to target_success (desirable difficulty)
+      - "information": largest p * (1 - p) (most informative answer)
+    Difficulties live in one array ordered by concept, so every candidate of
+    a concept is scored in a single vectorized pass; select_actions() scores
+    a whole batch of students at once. Uses NumPy when available.
+    Falls back to examples / end_concept like SimpleDifficultyPolicy.
+    """
+    def __init__(self, question_bank, example_bank, content_manager=None,
+                 objective="target", target_success=0.7, slope=6.0,
+                 top_k=8, default_mastery=0.5):
+        super().__init__(question_bank, example_bank, content_manager)
+        _load_numpy()
+        if objective not in ("target", "information"):
+            raise ValueError(f"Unknown objective: {objective!r}")
+        self.objective = objective
+        self.target_success = target_success
+        self.slope = slope
+        self.top_k = max(1, int(top_k))
+        self.default_mastery = default_mastery
+        self._arrays = None # (ContentIndex, rows, slices, difficulty) for the index they came from
+        self._build_arrays()
+        logger.info("MasteryTargetPolicy ready (objective=%s, numpy=%s).", objective, np is not None)
+
+    def _build_arrays(self):
+        """
+        Lays out the difficulties concept by concept (each concept's questions
+        hardest first, as in the ContentIndex) so a concept is one contiguous
+        slice. Question lists that carry a `difficulties` column (compiled
+        content) are read without decoding their questions.
+        """
+        index = self.index
+        concept_ids = list(index.concept_ids)
+        known = set(concept_ids)
+        concept_ids.extend(c for c in index.questions_by_concept if c not in known)
+
+        difficulties = []
+        slices = {}
+        rows = {}
+        for concept_id in concept_ids:
+            concept_questions = index.get_questions_for_concept(concept_id)
+            start = len(difficulties)
+            column = getattr(concept_questions, 'difficulties', None)
+            if column is not None:
+                difficulties.extend(column.tolist())
+            else:
+                difficulties.extend(float(q.get('difficulty', 0) or 0) for q in concept_questions)
+            slices[concept_id] = (start, len(difficulties))
+            rows[concept_id] = concept_questions
+        difficulty = np.asarray(difficulties, dtype=np.float32) if np is not None else array('f', difficulties)
+        # One tuple, swapped in one assignment, so a reload never pairs new slices with old arrays
+        self._arrays = (index, rows, slices, difficulty)
+
+    # --- Selection ---
+
+    def select_action(self, student_state, student_history, current_concept_id, student=None):
+        """
+        The main method called by the Tutor (same interface as SimpleDifficultyPolicy).
+        """
+        return self.select_actions([student_state], [student_history], [current_concept_id], [student])[0]
+
+    def select_actions(self, student_states, student_histories, concept_ids, students=None):
+        """
+        Selects the next action for a batch of students in one call.
+        Students on the same concept are scored together as a matrix.
+        Returns a list of (action_type, content), one per student.
+        """
+        questions = self.select_questions(student_states, student_histories, concept_ids, students)
+        return [self._action_for(q, concept_id) for q, concept_id in zip(questions, concept_ids)]
+
+    def select_questions(self, student_states, student_histories, concept_ids, students=None):
+        """Returns the best unseen question (or None) for each student."""
+        if self._arrays[0] is not self.index:
+            self._build_arrays() # Content was swapped underneath us
+        index, concept_rows, concept_slices, difficulty = self._arrays
+        if students is None:
+            students = [None] * len(concept_ids)
+
+        # Group the batch by concept so each group is one scoring pass
+        groups = {}
+        for row, concept_id in enumerate(concept_ids):
+            groups.setdefault(concept_id, []).append(row)
+
+        results = [None] * len(concept_ids)
+        positions = index.concept_positions
+        for concept_id, rows in groups.items():
+            start, end = concept_slices.get(concept_id, (0, 0))
+            if start == end:
+                continue
+            position = positions.get(concept_id)
+            mastery = [self._mastery_of(student_states[r], position) for r in rows]
+            scores = self._score(mastery, difficulty[start:end])
+            for i, r in enumerate(rows):
+                seen = self._seen_ids(student_histories[r], students[r])
+                results[r] = self._best_unseen(scores[i], concept_rows[concept_id], seen)
+        return results
+
+    def _mastery_of(self, student_state, position):
+        if position is None or student_state is None or position >= len(student_state):
+            return self.default_mastery
+        return float(student_state[position])
+
+    @staticmethod
+    def _seen_ids(student_history, student):
+        if student is not None:
+            return student.seen_question_ids
+        if hasattr(student_history, 'question_id_set'):
+            return student_history.question_id_set()
+        return {interaction['question_id'] for interaction in student_history}
+
+    def _score(self, mastery, difficulty):
+        """
+        Scores a concept's questions (given their difficulties) for each mastery value.
+        Returns one row of scores per student (higher is better).
+        """
+        if np is not None:
+            m = np.asarray(mastery, dtype=np.float32)[:, None]
+            d = difficulty[None, :]
+            p = 1.0 / (1.0 + np.exp(-self.slope * (m - d)))
+            if self.objective == "target":
+                return -np.abs(p - self.target_success)
+            return p * (1.0 - p)
+
+        rows = []
+        for m in mastery:
+            p = [1.0 / (1.0 + math.exp(-self.slope * (m - d))) for d in difficulty]
+            if self.objective == "target":
+                rows.append([-abs(x - self.target_success) for x in p])
+            else:
+                rows.append([x * (1.0 - x) for x in p])
+        return rows
+
+    def _best_unseen(self, scores, concept_questions, seen):
+        """
+        Masked argmax: checks the top_k scores first and doubles k while
+        all of them were already seen, so a mostly seen concept still costs
+        a partial selection rather than a full sort. Ties go to the earlier
+        (harder) question.
+        """
+        num = len(scores)
+        k = min(self.top_k, num)
+        checked = 0
+        while True:
+            # _top is a stable ranking, so the first `checked` were seen already
+            for offset in self._top(scores, k)[checked:]:
+                question = concept_questions[offset]
+                if question.get('id') not in seen:
+                    return question
+            if k >= num:
+                return None
+            checked = k
+            k = min(2 * k, num)
+
+    @staticmethod
+    def _top(scores, k):
+        """Indices of the k best scores, best first, ties by index."""
+        if np is not None:
+            num = len(scores)
+            if k < num:
+                # Everything tied with the k-th best, so ties really go by index
+                kth = -np.partition(-scores, k - 1)[k - 1]
+                candidates = np.flatnonzero(scores >= kth)
+            else:
+                candidates = np.arange(num)
+            order = np.lexsort((candidates, -scores[candidates]))
+            return candidates[order][:k].tolist()
+        return heapq.nsmallest(k, range(len(scores)), key=lambda i: (-scores[i], i))
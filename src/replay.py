@@ -0,0 +1,361 @@
+"""
+Bulk replay of stored learner histories.
+
+Re-traces every student in a StudentStore with the current tracer (and
+optionally writes the new tracer states back), scores the tracer's
+predictions against the logged outcomes, and optionally replays a policy
+against the logs to see how often it would have asked the same question.
+
+The parent only pages through student ids; each chunk of ids goes to a
+worker process, which reads those histories itself, traces them as whole
+sequences, writes its snapshots in one transaction and sends back a small
+summary. Snapshots are tagged with the tracer kind that wrote them; --write
+refuses a store whose snapshots came from a different tracer, since the app
+running on that tracer could not read the new states. At most a few chunks are in flight, and the summaries are
+fixed-size histograms, so memory does not grow with the number of students.
+
+    python -m src.replay --store state/students.db --tracer windowed \
+        --model model/tracer.npz --policy mastery --workers 4 --write
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class ScoreHistogram:
+    """
+    Prediction quality in constant memory: counts of correct and incorrect
+    answers per probability bin, plus running log-loss and accuracy sums.
+    Histograms from different workers merge by addition.
+    """
+    def __init__(self, bins=1000):
+        self.bins = bins
+        self.positive = [0] * bins
+        self.negative = [0] * bins
+        self.log_loss_sum = 0.0
+        self.num_accurate = 0
+        self.examples = 0
+
+    def add(self, prob, is_correct):
+        prob = min(max(float(prob), 1e-7), 1 - 1e-7)
+        bucket = min(self.bins - 1, int(prob * self.bins))
+        if is_correct:
+            self.positive[bucket] += 1
+            self.log_loss_sum -= math.log(prob)
+        else:
+            self.negative[bucket] += 1
+            self.log_loss_sum -= math.log(1 - prob)
+        self.num_accurate += 1 if (prob >= 0.5) == bool(is_correct) else 0
+        self.examples += 1
+
+    def merge(self, other):
+        for bucket in range(self.bins):
+            self.positive[bucket] += other.positive[bucket]
+            self.negative[bucket] += other.negative[bucket]
+        self.log_loss_sum += other.log_loss_sum
+        self.num_accurate += other.num_accurate
+        self.examples += other.examples
+
+    def summary(self):
+        """log_loss, accuracy and AUC (ties within a bin count as half)."""
+        num_positive, num_negative = sum(self.positive), sum(self.negative)
+        auc = None
+        if num_positive and num_negative:
+            area = 0.0
+            negatives_below = 0
+            for positive, negative in zip(self.positive, self.negative):
+                area += positive * (negatives_below + negative / 2.0)
+                negatives_below += negative
+            auc = area / (num_positive * num_negative)
+        return {
+            "examples": self.examples,
+            "log_loss": self.log_loss_sum / self.examples if self.examples else None,
+            "accuracy": self.num_accurate / self.examples if self.examples else None,
+            "auc": auc,
+        }
+
+
+class ReplayWorker:
+    """
+    Everything one process needs to replay chunks of students: content,
+    tracer, optional policy and its own store connection.
+    config is a plain dict (it is sent to worker processes):
+    store, data_dir, content_file, tracer, model, policy, write, score.
+    """
+    def __init__(self, config):
+        from src.content import ContentManager
+        from src.store import StudentStore
+        from src.tracers import TransformerKnowledgeTracer, WindowedKnowledgeTracer
+
+        self.config = config
+        data_dir = config.get('data_dir') or 'data'
+        self.content_manager = ContentManager(
+            concepts_file=os.path.join(data_dir, 'knowledge.json'),
+            questions_file=os.path.join(data_dir, 'question.json'),
+            lessons_file=os.path.join(data_dir, 'lesson.json'),
+            compiled_file=config.get('content_file')
+        )
+        if config.get('tracer') == 'windowed':
+            self.tracer = WindowedKnowledgeTracer(config.get('model'), self.content_manager)
+        else:
+            self.tracer = TransformerKnowledgeTracer(config.get('model') or '', self.content_manager)
+        self.tracer.load()
+
+        self.policy = None
+        if config.get('policy'):
+            from src.policies import MasteryTargetPolicy, SimpleDifficultyPolicy
+            policy_class = MasteryTargetPolicy if config['policy'] == 'mastery' else SimpleDifficultyPolicy
+            self.policy = policy_class(
+                question_bank=self.content_manager.questions or [],
+                example_bank=self.content_manager.lessons or {},
+                content_manager=self.content_manager
+            )
+        self.store = StudentStore(config['store'], tracer_kind=self.tracer.state_kind)
+
+    def run(self, student_ids):
+        """Replays one chunk of students. Returns a picklable summary."""
+        started = time.perf_counter()
+        # 1. Read the chunk (two queries)
+        histories = self.store.load_histories(student_ids)
+        student_ids = [student_id for student_id in student_ids if len(histories[student_id])]
+        logs = [histories[student_id] for student_id in student_ids]
+
+        # 2. Final tracer states, whole sequences at a time
+        states = self.tracer.trace_many(logs)
+
+        # 3. Score predictions and replay the policy, step by step across the chunk
+        histogram = ScoreHistogram()
+        policy_counts = {"decisions": 0, "same_question": 0, "actions": {}}
+        if self.config.get('score', True) or self.policy is not None:
+            self._replay(student_ids, logs, histogram, policy_counts)
+
+        # 4. Write the new states back in one transaction
+        if self.config.get('write'):
+            self.store.write_snapshots(list(zip(student_ids, logs, states)))
+
+        return {
+            "students": len(student_ids),
+            "interactions": sum(len(log) for log in logs),
+            "histogram": histogram,
+            "policy": policy_counts,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def _replay(self, student_ids, logs, histogram, policy_counts):
+        """
+        Walks every history of the chunk in lockstep. At step t each active
+        student's pre-answer mastery scores the logged outcome, and the policy
+        (batched if it can be) picks what it would have asked instead.
+        """
+        from src.student import Student
+
+        index = self.content_manager.index
+        positions = index.concept_positions
+        score = self.config.get('score', True)
+        sequences = [iter(self.tracer.mastery_sequence(log)) for log in logs]
+        students = [Student(student_id) for student_id in student_ids] if self.policy is not None else None
+        select_actions = getattr(self.policy, 'select_actions', None)
+
+        for step in range(max((len(log) for log in logs), default=0)):
+            active = [i for i, log in enumerate(logs) if step < len(log)]
+            masteries, concept_ids = [], []
+            for i in active:
+                mastery = next(sequences[i])
+                question = index.questions_by_id.get(logs[i].question_id(step))
+                concept_id = question.get('concept_id') if question else None
+                position = positions.get(concept_id)
+                if score and position is not None:
+                    histogram.add(mastery[position], logs[i].is_correct(step))
+                masteries.append(mastery)
+                concept_ids.append(concept_id)
+
+            if students is None:
+                continue
+            decided = [(i, mastery, concept_id) for i, mastery, concept_id in zip(active, masteries, concept_ids)
+                       if concept_id is not None]
+            if select_actions is not None:
+                actions = select_actions(
+                    [mastery for _, mastery, _ in decided],
+                    [students[i].history for i, _, _ in decided],
+                    [concept_id for _, _, concept_id in decided],
+                    [students[i] for i, _, _ in decided]
+                )
+            else:
+                actions = [self.policy.select_action(mastery, students[i].history, concept_id, student=students[i])
+                           for i, mastery, concept_id in decided]
+            for (i, _, _), (action_type, content) in zip(decided, actions):
+                policy_counts["decisions"] += 1
+                policy_counts["actions"][action_type] = policy_counts["actions"].get(action_type, 0) + 1
+                if action_type == "question" and content.get('id') == logs[i].question_id(step):
+                    policy_counts["same_question"] += 1
+            # The logged answer is what really happened next
+            for i in active:
+                log = logs[i]
+                students[i].update_history(log.question_id(step), log.is_correct(step), log.response_times[step])
+
+
+# --- Worker process plumbing ---
+
+_worker = None
+
+
+def _init_worker(config):
+    global _worker
+    _worker = ReplayWorker(config)
+
+
+def _run_chunk(student_ids):
+    return _worker.run(student_ids)
+
+
+class ReplayEngine:
+    """
+    Streams student ids out of the store and fans chunks out to a process
+    pool (workers=0 runs everything in this process). Reports progress
+    every progress_seconds and returns the merged summary.
+    """
+    def __init__(self, config, workers=None, chunk_students=256, max_in_flight=None, progress_seconds=5.0):
+        self.config = dict(config)
+        self.workers = (os.cpu_count() or 1) if workers is None else max(0, int(workers))
+        self.chunk_students = max(1, int(chunk_students))
+        self.max_in_flight = max_in_flight or max(2, 2 * self.workers)
+        self.progress_seconds = progress_seconds
+
+    def run(self, on_progress=None):
+        """
+        Replays every stored student. on_progress(report), if given, is
+        called with the running totals along with each progress log line.
+        Raises ValueError if write is set and the store holds snapshots of
+        another tracer kind.
+        """
+        from src.store import StudentStore
+
+        store = StudentStore(self.config['store'])
+        worker = None
+        if self.config.get('write'):
+            worker = ReplayWorker(self.config)
+            kind = worker.tracer.state_kind
+            others = sorted(k for k in store.tracer_kinds() if k is not None and k != kind)
+            if others:
+                raise ValueError(
+                    f"Store {self.config['store']} holds tracer states of kind {', '.join(others)}; "
+                    f"refusing to write {kind} states over them")
+        total = store.count_students()
+        logger.info("Replaying %d students (%d workers, %d per chunk).", total, self.workers, self.chunk_students)
+        report = {
+            "students": 0, "total_students": total, "interactions": 0, "chunks": 0,
+            "histogram": ScoreHistogram(), "policy": {"decisions": 0, "same_question": 0, "actions": {}},
+        }
+        started = time.perf_counter()
+        last_progress = started
+
+        def merge(result):
+            nonlocal last_progress
+            report["students"] += result["students"]
+            report["interactions"] += result["interactions"]
+            report["chunks"] += 1
+            report["histogram"].merge(result["histogram"])
+            policy = report["policy"]
+            policy["decisions"] += result["policy"]["decisions"]
+            policy["same_question"] += result["policy"]["same_question"]
+            for action_type, count in result["policy"]["actions"].items():
+                policy["actions"][action_type] = policy["actions"].get(action_type, 0) + count
+            now = time.perf_counter()
+            if now - last_progress >= self.progress_seconds:
+                last_progress = now
+                self._log_progress(report, now - started, on_progress)
+
+        chunks = store.iter_student_ids(self.chunk_students)
+        if self.workers == 0:
+            worker = worker or ReplayWorker(self.config)
+            for student_ids in chunks:
+                merge(worker.run(student_ids))
+        else:
+            context = multiprocessing.get_context("spawn") # Workers open their own SQLite connections
+            with ProcessPoolExecutor(self.workers, mp_context=context,
+                                     initializer=_init_worker, initargs=(self.config,)) as pool:
+                in_flight = set()
+                for student_ids in chunks:
+                    in_flight.add(pool.submit(_run_chunk, student_ids))
+                    if len(in_flight) >= self.max_in_flight:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            merge(future.result())
+                for future in in_flight:
+                    merge(future.result())
+
+        seconds = time.perf_counter() - started
+        self._log_progress(report, seconds, on_progress)
+        return self._final(report, seconds)
+
+    def _log_progress(self, report, seconds, on_progress):
+        logger.info("Replayed %d/%d students, %d interactions (%.0f students/s, %.0f interactions/s).",
+                    report["students"], report["total_students"], report["interactions"],
+                    report["students"] / seconds if seconds else 0.0,
+                    report["interactions"] / seconds if seconds else 0.0)
+        if on_progress is not None:
+            on_progress(report)
+
+    def _final(self, report, seconds):
+        policy = report["policy"]
+        return {
+            "students": report["students"],
+            "interactions": report["interactions"],
+            "chunks": report["chunks"],
+            "workers": self.workers,
+            "seconds": seconds,
+            "students_per_second": report["students"] / seconds if seconds else 0.0,
+            "interactions_per_second": report["interactions"] / seconds if seconds else 0.0,
+            "written": bool(self.config.get('write')),
+            "tracer": report["histogram"].summary(),
+            "policy": dict(policy, same_question_rate=(
+                policy["same_question"] / policy["decisions"] if policy["decisions"] else None
+            )) if self.config.get('policy') else None,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-trace and re-score every stored student history.")
+    parser.add_argument("--store", required=True, help="StudentStore SQLite file")
+    parser.add_argument("--data-dir", default="data", help="Directory with knowledge.json, question.json, lesson.json")
+    parser.add_argument("--content-file", default=None, help="Compiled content file (instead of --data-dir)")
+    parser.add_argument("--tracer", choices=("placeholder", "windowed"), default="placeholder")
+    parser.add_argument("--model", default=os.path.join("model", "tracer.npz"), help="Model file of the windowed tracer")
+    parser.add_argument("--policy", choices=("difficulty", "mastery"), default=None,
+                        help="Also replay this policy against the logs")
+    parser.add_argument("--write", action="store_true", help="Write the recomputed tracer states back")
+    parser.add_argument("--no-score", action="store_true", help="Skip scoring the tracer's predictions")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (0: run in this process)")
+    parser.add_argument("--chunk-students", type=int, default=256)
+    parser.add_argument("--progress-seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    config = {
+        "store": args.store,
+        "data_dir": args.data_dir,
+        "content_file": args.content_file,
+        "tracer": args.tracer,
+        "model": args.model,
+        "policy": args.policy,
+        "write": args.write,
+        "score": not args.no_score,
+    }
+    engine = ReplayEngine(config, workers=args.workers, chunk_students=args.chunk_students,
+                          progress_seconds=args.progress_seconds)
+    try:
+        result = engine.run()
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
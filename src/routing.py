@@ -0,0 +1,469 @@
+"""
+Sticky request routing for the multi-process serving mode (serve.py).
+
+HashRing maps a session id (the student id) to a worker by consistent
+hashing: each worker owns many points on a 64-bit ring, and a key goes to
+the first point after its hash. When a worker leaves, only its keys move
+(spread over the others); when it comes back they move back.
+
+Router is a small asyncio HTTP/1.1 reverse proxy in front of the workers.
+Per request it:
+
+  1. reads the session cookie (and assigns a new session id if there is
+     none, so the first request already lands on the worker that will own it)
+  2. forwards the request to the ring owner, with the ring version since
+     which that worker has owned the session (HashRing.owner_epoch) in
+     X-Tutor-Epoch: a worker reloads a session from the shared store when
+     it was loaded under another one (it was served elsewhere in between,
+     see SessionManager.refresh)
+  3. sends the response back, keeping both connections alive
+
+A worker that refuses connections is taken off the ring at once and
+probed until it accepts them again. Request and response bodies are
+buffered (they are small JSON documents here).
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import socket
+import time
+from collections import deque
+from http.cookies import CookieError, SimpleCookie
+
+from src.sessions import EPOCH_HEADER, SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Headers that describe one connection, not the message (RFC 9110 7.6.1)
+_HOP_BY_HOP = frozenset({
+    b"connection", b"keep-alive", b"proxy-connection", b"proxy-authenticate",
+    b"proxy-authorization", b"te", b"trailer", b"transfer-encoding", b"upgrade",
+})
+_EPOCH_HEADER = EPOCH_HEADER.lower().encode('latin-1')
+_MAX_HEAD_BYTES = 64 * 1024
+
+
+class HashRing:
+    """
+    Consistent hashing of string keys onto nodes, `replicas` points per
+    node. `epoch` increases on every membership change; the last
+    `history` versions of the ring are kept for owner_epoch().
+    """
+    def __init__(self, nodes=(), replicas=100, history=64):
+        self.replicas = replicas
+        self.epoch = 0
+        self._nodes = set()
+        self._points = [] # Sorted hash points
+        self._owners = [] # Node owning each point
+        self._history = deque(maxlen=history) # Earlier (epoch, points, owners), newest last
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash_key(key):
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, node):
+        """Adds a node; returns False if it was already on the ring."""
+        if node in self._nodes:
+            return False
+        self._nodes.add(node)
+        self._rebuild()
+        return True
+
+    def remove(self, node):
+        """Removes a node; returns False if it was not on the ring."""
+        if node not in self._nodes:
+            return False
+        self._nodes.discard(node)
+        self._rebuild()
+        return True
+
+    def node_for(self, key):
+        """The node owning key, or None if the ring is empty."""
+        return self._owner(self._points, self._owners, self.hash_key(key))
+
+    def owner_epoch(self, key):
+        """
+        The oldest ring version since which key's current owner has owned it
+        without a break. It only changes when the key moves, so ring changes
+        that leave a key where it was do not reload its session. Once that
+        version is older than the kept history, the oldest kept one is
+        returned (at worst one extra reload).
+        """
+        key_hash = self.hash_key(key)
+        owner = self._owner(self._points, self._owners, key_hash)
+        since = self.epoch
+        for epoch, points, owners in reversed(self._history):
+            if self._owner(points, owners, key_hash) != owner:
+                break
+            since = epoch
+        return since
+
+    @property
+    def nodes(self):
+        return sorted(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    @staticmethod
+    def _owner(points, owners, key_hash):
+        if not points:
+            return None
+        position = bisect.bisect(points, key_hash)
+        return owners[position if position < len(points) else 0]
+
+    def _rebuild(self):
+        self._history.append((self.epoch, self._points, self._owners))
+        ring = sorted(
+            (self.hash_key(f"{node}#{replica}"), node)
+            for node in self._nodes
+            for replica in range(self.replicas)
+        )
+        # One swap of both lists: node_for never sees a half-built ring
+        self._points, self._owners = [point for point, _ in ring], [node for _, node in ring]
+        self.epoch += 1
+
+
+class Upstream:
+    """
+    A worker the router forwards to: "unix:/path/to.sock" or "host:port".
+    Keeps up to max_idle keep-alive connections for reuse.
+    """
+    def __init__(self, name, address, max_idle=32):
+        self.name = name
+        self.address = address
+        self.max_idle = max_idle
+        self._idle = []
+
+    async def connect(self, timeout):
+        if self.address.startswith("unix:"):
+            opening = asyncio.open_unix_connection(self.address[len("unix:"):], limit=_MAX_HEAD_BYTES)
+        else:
+            host, _, port = self.address.rpartition(":")
+            opening = asyncio.open_connection(host, int(port), limit=_MAX_HEAD_BYTES)
+        return await asyncio.wait_for(opening, timeout)
+
+    def acquire(self):
+        """An idle connection, or None."""
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    def release(self, connection):
+        if len(self._idle) < self.max_idle:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+
+    def close_idle(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class _UpstreamDown(Exception):
+    """The upstream is not listening (connection refused / no socket)."""
+
+
+class _StaleConnection(Exception):
+    """A pooled connection was closed by the upstream before any response byte."""
+
+
+def _parse_head(head):
+    """(first line, [(lowercase name, name, value)]) of an HTTP message head."""
+    lines = head.decode('latin-1').split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(":")
+        if not separator:
+            raise ValueError(f"Malformed header line {line!r}")
+        headers.append((name.strip().lower().encode('latin-1'), name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def _header_value(headers, lower_name):
+    for name, _, value in headers:
+        if name == lower_name:
+            return value
+    return None
+
+
+def _plain_response(status, reason, payload, extra_headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    head = [f"HTTP/1.1 {status} {reason}", "Content-Type: application/json",
+            f"Content-Length: {len(body)}"] + [f"{name}: {value}" for name, value in extra_headers]
+    return ("\r\n".join(head) + "\r\n").encode('latin-1'), body
+
+
+class Router:
+    """
+    Forwards each request to the worker owning its session (see the module
+    docstring). Upstreams join the ring with mark_up() and leave it with
+    mark_down(); probe_down() re-adds those that accept connections again.
+    """
+    def __init__(self, upstreams, cookie_name, replicas=100, connect_timeout=2.0,
+                 response_timeout=60.0, max_body_bytes=1 << 20, retry_after_seconds=1):
+        self.upstreams = {upstream.name: upstream for upstream in upstreams}
+        self.cookie_name = cookie_name
+        self.ring = HashRing(replicas=replicas)
+        self.connect_timeout = connect_timeout
+        self.response_timeout = response_timeout
+        self.max_body_bytes = max_body_bytes
+        self.retry_after_seconds = retry_after_seconds
+        self.started = time.time()
+        self.counters = {"requests": 0, "retries": 0, "unavailable": 0, "bad_gateway": 0, "ring_changes": 0}
+
+    # --- Membership ---
+
+    def mark_up(self, name):
+        if self.ring.add(name):
+            self.counters["ring_changes"] += 1
+            logger.info("Worker %s joined the ring (epoch %d, %d workers).", name, self.ring.epoch, len(self.ring))
+
+    def mark_down(self, name, reason=""):
+        if self.ring.remove(name):
+            self.counters["ring_changes"] += 1
+            logger.warning("Worker %s left the ring%s (epoch %d, %d workers); its sessions move to the others.",
+                           name, f" ({reason})" if reason else "", self.ring.epoch, len(self.ring))
+        upstream = self.upstreams.get(name)
+        if upstream is not None:
+            upstream.close_idle()
+
+    async def probe(self, name):
+        """True if the upstream accepts a connection."""
+        try:
+            _, writer = await self.upstreams[name].connect(self.connect_timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    async def probe_down(self, interval=0.5):
+        """Forever: puts upstreams that are off the ring back once they accept connections."""
+        while True:
+            for name in self.upstreams:
+                if name not in self.ring and await self.probe(name):
+                    self.mark_up(name)
+            await asyncio.sleep(interval)
+
+    def status(self):
+        return {
+            "epoch": self.ring.epoch,
+            "workers_up": self.ring.nodes,
+            "workers_down": sorted(name for name in self.upstreams if name not in self.ring),
+            "uptime_seconds": time.time() - self.started,
+            **self.counters,
+        }
+
+    # --- Client side ---
+
+    async def handle_client(self, reader, writer):
+        """asyncio.start_server callback: serves one client connection."""
+        peer = writer.get_extra_info('peername')
+        peer = peer[0] if isinstance(peer, tuple) else "local"
+        client_socket = writer.get_extra_info('socket')
+        if client_socket is not None and client_socket.family in (socket.AF_INET, socket.AF_INET6):
+            # asyncio only disables Nagle for sockets created with proto=IPPROTO_TCP,
+            # not for those accepted on a socket.create_server() listener
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return # Client closed the connection
+                except asyncio.LimitOverrunError:
+                    await self._reply(writer, *_plain_response(431, "Request Header Fields Too Large",
+                                                               {"error": "Request head too large"}))
+                    return
+                keep_alive = await self._serve_one(head, reader, writer, peer)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # Client went away mid-request
+        except asyncio.CancelledError:
+            pass # Shutting down with the connection open
+        except Exception as e:
+            logger.exception("Router error: %s", e)
+        finally:
+            writer.close()
+
+    async def _serve_one(self, head, reader, writer, peer):
+        """Handles one request; returns True if the client connection stays open."""
+        try:
+            request_line, headers = _parse_head(head)
+            method, target, version = request_line.split(" ")
+        except ValueError:
+            await self._reply(writer, *_plain_response(400, "Bad Request", {"error": "Malformed request"}))
+            return False
+        connection = (_header_value(headers, b"connection") or "").lower()
+        keep_alive = "close" not in connection if version == "HTTP/1.1" else "keep-alive" in connection
+
+        if _header_value(headers, b"transfer-encoding") is not None:
+            await self._reply(writer, *_plain_response(411, "Length Required", {"error": "Send Content-Length"}))
+            return False
+        try:
+            length = int(_header_value(headers, b"content-length") or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= self.max_body_bytes:
+            await self._reply(writer, *_plain_response(413, "Content Too Large", {"error": "Body too large"}))
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        if method == "GET" and target == "/router/status":
+            await self._reply(writer, *_plain_response(200, "OK", self.status()), keep_alive)
+            return keep_alive
+
+        self.counters["requests"] += 1
+        session_id, headers = self._session(headers)
+        response_head, response_body = await self._forward(session_id, method, target, headers, body, peer)
+        await self._reply(writer, response_head, response_body, keep_alive)
+        return keep_alive
+
+    def _session(self, headers):
+        """
+        The request's session id and its headers for the worker. Without a
+        valid session cookie a new id is assigned here and sent in the
+        Cookie header, so the worker creates the session under it (and its
+        Set-Cookie hands it to the client).
+        """
+        cookies = SimpleCookie()
+        for name, _, value in headers:
+            if name == b"cookie":
+                try:
+                    cookies.load(value)
+                except CookieError:
+                    pass
+        morsel = cookies.get(self.cookie_name)
+        session_id = morsel.value if morsel is not None else None
+        if SessionManager.is_valid_session_id(session_id):
+            return session_id, headers
+        session_id = SessionManager.new_session_id()
+        cookies[self.cookie_name] = session_id
+        cookie = "; ".join(f"{key}={morsel.coded_value}" for key, morsel in cookies.items())
+        headers = [header for header in headers if header[0] != b"cookie"]
+        headers.append((b"cookie", "Cookie", cookie))
+        return session_id, headers
+
+    async def _reply(self, writer, response_head, body, keep_alive=False):
+        # One write: head and body in a single segment
+        writer.write(b"".join((response_head, b"Connection: keep-alive\r\n\r\n" if keep_alive
+                                              else b"Connection: close\r\n\r\n", body or b"")))
+        await writer.drain()
+
+    # --- Upstream side ---
+
+    def _request_head(self, method, target, headers, body, peer, epoch):
+        lines = [f"{method} {target} HTTP/1.1"]
+        for name, original, value in headers:
+            if name in _HOP_BY_HOP or name == b"content-length" or name == _EPOCH_HEADER:
+                continue
+            lines.append(f"{original}: {value}")
+        lines.append(f"{EPOCH_HEADER}: {epoch}")
+        lines.append(f"X-Forwarded-For: {peer}")
+        if body or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(body)}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    async def _forward(self, session_id, method, target, headers, body, peer):
+        """The worker's response as (head without the final CRLF, body)."""
+        for attempt in range(len(self.upstreams) + 2):
+            if attempt:
+                self.counters["retries"] += 1
+            name = self.ring.node_for(session_id)
+            if name is None:
+                break
+            request = self._request_head(method, target, headers, body, peer,
+                                         self.ring.owner_epoch(session_id)) + body
+            try:
+                return await self._exchange(self.upstreams[name], method, request)
+            except _UpstreamDown as e:
+                self.mark_down(name, str(e))
+            except _StaleConnection:
+                pass # Try again on a fresh connection
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                # The request may have been processed: do not send it again
+                logger.warning("Worker %s failed on %s %s: %r", name, method, target, e)
+                self.counters["bad_gateway"] += 1
+                return _plain_response(502, "Bad Gateway", {"error": "Worker failed, please retry"},
+                                       [("Retry-After", str(self.retry_after_seconds))])
+        self.counters["unavailable"] += 1
+        return _plain_response(503, "Service Unavailable", {"error": "No worker available, please retry"},
+                               [("Retry-After", str(self.retry_after_seconds))])
+
+    async def _exchange(self, upstream, method, request):
+        connection = upstream.acquire()
+        pooled = connection is not None
+        if connection is None:
+            try:
+                connection = await upstream.connect(self.connect_timeout)
+            except (ConnectionRefusedError, FileNotFoundError) as e:
+                raise _UpstreamDown(type(e).__name__) from e
+        reader, writer = connection
+        try:
+            writer.write(request)
+            await writer.drain()
+            try:
+                response_head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.response_timeout)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                if pooled and not getattr(e, 'partial', b""):
+                    raise _StaleConnection() from e
+                raise
+            head, body, reusable = await asyncio.wait_for(
+                self._read_response(reader, method, response_head), self.response_timeout
+            )
+        except BaseException:
+            writer.close()
+            raise
+        if reusable:
+            upstream.release(connection)
+        else:
+            writer.close()
+        return head, body
+
+    @staticmethod
+    async def _read_response(reader, method, response_head):
+        status_line, headers = _parse_head(response_head)
+        version, status = status_line.split(" ", 2)[:2]
+        status = int(status)
+        connection = (_header_value(headers, b"connection") or "").lower()
+        reusable = "close" not in connection if version == "HTTP/1.1" else "keep-alive" in connection
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif (_header_value(headers, b"transfer-encoding") or "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass # Trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif _header_value(headers, b"content-length") is not None:
+            body = await reader.readexactly(int(_header_value(headers, b"content-length")))
+        else:
+            body = await reader.read() # Delimited by the end of the connection
+            reusable = False
+
+        lines = [status_line] + [
+            f"{original}: {value}" for name, original, value in headers
+            if name not in _HOP_BY_HOP and name != b"content-length"
+        ]
+        if not (status in (204, 304) or 100 <= status < 200):
+            lines.append(f"Content-Length: {len(body)}")
+        return ("\r\n".join(lines) + "\r\n").encode('latin-1'), body, reusable
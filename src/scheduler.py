@@ -0,0 +1,245 @@
+import heapq
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+class ConceptGraph:
+    """
+    The prerequisite DAG from knowledge.json, compiled once at load time.
+
+    Concepts are numbered by their position in a topological order (ties
+    broken by the numeric part of the ID, so a graph that agrees with the
+    IDs keeps the old "c1, c2, c3" order). Edges are stored as compact
+    CSR arrays of positions in both directions. Raises ValueError on a
+    prerequisite cycle.
+    """
+    def __init__(self, concepts_list, prerequisites):
+        # --- 1. Fallback order: numeric part of the ID, then file order ---
+        fallback = []
+        seen_ids = set()
+        for file_position, concept in enumerate(concepts_list):
+            concept_id = concept.get('id')
+            if not concept_id:
+                logger.warning("Skipping concept without an ID: %r", concept)
+                continue
+            if concept_id in seen_ids:
+                logger.warning("Duplicate concept ID %r; keeping the first definition.", concept_id)
+                continue
+            seen_ids.add(concept_id)
+            fallback.append((self._id_rank(concept_id), file_position, concept))
+        fallback.sort(key=lambda item: item[:2])
+        by_rank = [item[2] for item in fallback]
+        rank_of = {concept.get('id'): rank for rank, concept in enumerate(by_rank)}
+        num_concepts = len(by_rank)
+
+        # --- 2. Edges, as fallback ranks ---
+        children = [[] for _ in range(num_concepts)]
+        in_degree = [0] * num_concepts
+        edges = set()
+        for edge in prerequisites or []:
+            source = rank_of.get(edge.get('from'))
+            target = rank_of.get(edge.get('to'))
+            if source is None or target is None:
+                logger.warning("Ignoring prerequisite with unknown concept: %r", edge)
+                continue
+            if (source, target) in edges:
+                continue
+            edges.add((source, target))
+            children[source].append(target)
+            in_degree[target] += 1
+
+        # --- 3. Kahn's algorithm; the heap keeps the fallback order among ready concepts ---
+        remaining = list(in_degree)
+        ready = [rank for rank in range(num_concepts) if remaining[rank] == 0]
+        heapq.heapify(ready)
+        topo_ranks = []
+        while ready:
+            rank = heapq.heappop(ready)
+            topo_ranks.append(rank)
+            for child in children[rank]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    heapq.heappush(ready, child)
+        if len(topo_ranks) < num_concepts:
+            cycle = self._find_cycle(children, remaining)
+            raise ValueError(
+                "Prerequisite cycle detected: " + " -> ".join(by_rank[r].get('id') for r in cycle)
+            )
+
+        # --- 4. Renumber everything by topological position ---
+        position_of_rank = [0] * num_concepts
+        for position, rank in enumerate(topo_ranks):
+            position_of_rank[rank] = position
+        self.ordered_concepts = [by_rank[rank] for rank in topo_ranks]
+        self.concept_ids = [concept.get('id') for concept in self.ordered_concepts]
+        self.positions = {concept_id: position for position, concept_id in enumerate(self.concept_ids)}
+        self.num_concepts = num_concepts
+        self.num_edges = len(edges)
+
+        parents = [[] for _ in range(num_concepts)]
+        kids = [[] for _ in range(num_concepts)]
+        for source, target in edges:
+            parents[position_of_rank[target]].append(position_of_rank[source])
+            kids[position_of_rank[source]].append(position_of_rank[target])
+        self.prereq_offsets, self.prereq_targets = self._to_csr(parents)
+        self.child_offsets, self.child_targets = self._to_csr(kids)
+        # Concepts with no prerequisites, in teaching order
+        self.roots = array('i', [p for p in range(num_concepts) if not parents[p]])
+
+    def prerequisites_of(self, position):
+        return self.prereq_targets[self.prereq_offsets[position]:self.prereq_offsets[position + 1]]
+
+    def dependents_of(self, position):
+        return self.child_targets[self.child_offsets[position]:self.child_offsets[position + 1]]
+
+    @staticmethod
+    def _id_rank(concept_id):
+        """
+        Sort key for IDs like "c12". IDs without a number sort after all
+        numbered ones (in file order) instead of silently becoming 0.
+        """
+        try:
+            return (0, int(str(concept_id)[1:]))
+        except ValueError:
+            logger.warning("Concept ID %r has no numeric part; ordering it after numbered concepts.", concept_id)
+            return (1, 0)
+
+    @staticmethod
+    def _to_csr(adjacency):
+        offsets = array('i', [0])
+        targets = array('i')
+        for neighbours in adjacency:
+            targets.extend(sorted(neighbours))
+            offsets.append(len(targets))
+        return offsets, targets
+
+    @staticmethod
+    def _find_cycle(children, remaining):
+        """Returns one cycle (list of ranks) among the nodes Kahn could not place."""
+        stuck = {rank for rank, count in enumerate(remaining) if count > 0}
+        start = min(stuck)
+        path, index_in_path = [], {}
+        node = start
+        while node not in index_in_path:
+            index_in_path[node] = len(path)
+            path.append(node)
+            node = next(child for child in children[node] if child in stuck)
+        return path[index_in_path[node]:] + [node]
+
+
+class ConceptScheduler:
+    """
+    Per-student concept scheduler over a ConceptGraph.
+
+    Tracks completed concepts in a bitset and a frontier of concepts whose
+    prerequisites are all complete. The current concept is the earliest
+    (in topological order) unlocked, unfinished concept. Completing a
+    concept costs O(its out-degree * in-degree of its dependents).
+    If mastery_threshold is set, a concept the tracer already rates at or
+    above it is completed (skipped) when it would become current, which
+    unlocks its dependents. Completion, not mastery, is what unlocks: a
+    student who moves on with "next concept" has not mastered the concept
+    but must not be stuck behind it.
+    """
+    __slots__ = ("graph", "mastery_threshold", "completed", "num_completed",
+                 "_frontier", "_root_cursor")
+
+    def __init__(self, graph, mastery_threshold=None):
+        self.graph = graph
+        self.mastery_threshold = mastery_threshold
+        self.reset()
+
+    def reset(self):
+        """Forgets all progress."""
+        self.completed = bytearray((self.graph.num_concepts + 7) // 8)
+        self.num_completed = 0
+        self._frontier = []    # Heap of unlocked non-root positions
+        self._root_cursor = 0  # Roots before this index are completed
+
+    def is_completed(self, position):
+        return bool(self.completed[position >> 3] >> (position & 7) & 1)
+
+    def current(self, mastery=None):
+        """
+        Returns the position of the concept to teach now, or None when all
+        reachable concepts are done. Skips concepts already mastered
+        (when a threshold and a mastery vector are given).
+        """
+        while True:
+            position = self._peek()
+            if position is None:
+                return None
+            if self.is_mastered(position, mastery):
+                logger.debug("Concept %s already mastered; skipping.", self.graph.concept_ids[position])
+                self.complete(position)
+                continue
+            return position
+
+    def is_mastered(self, position, mastery):
+        """True if a threshold is set and mastery rates the concept at or above it."""
+        return (self.mastery_threshold is not None and mastery is not None
+                and position < len(mastery) and mastery[position] >= self.mastery_threshold)
+
+    def complete(self, position):
+        """Marks a concept finished and unlocks dependents whose prerequisites are all done."""
+        if self.is_completed(position):
+            return
+        self.completed[position >> 3] |= 1 << (position & 7)
+        self.num_completed += 1
+        for child in self.graph.dependents_of(position):
+            if self.is_completed(child):
+                continue
+            if all(self.is_completed(p) for p in self.graph.prerequisites_of(child)):
+                heapq.heappush(self._frontier, child)
+
+    def completed_bytes(self):
+        """The completed-concept bitset (positions in this graph's order)."""
+        return bytes(self.completed)
+
+    def restore(self, completed_bytes):
+        """Rebuilds the scheduler from a completed_bytes() value."""
+        self.reset()
+        size = len(self.completed)
+        for position in range(min(size, len(completed_bytes)) * 8):
+            if position >= self.graph.num_concepts:
+                break
+            if completed_bytes[position >> 3] >> (position & 7) & 1:
+                self.complete(position)
+
+    def completed_ids(self):
+        """
+        IDs of the completed concepts, in topological order, for persistence.
+        Unlike the bitset they stay valid when the content changes.
+        """
+        return [self.graph.concept_ids[position] for position in range(self.graph.num_concepts)
+                if self.is_completed(position)]
+
+    def restore_ids(self, concept_ids):
+        """Rebuilds the scheduler from completed concept IDs; IDs not in the graph are ignored."""
+        self.reset()
+        for concept_id in concept_ids:
+            position = self.graph.positions.get(concept_id)
+            if position is not None:
+                self.complete(position)
+
+    def complete_before(self, position):
+        """Marks every concept earlier in topological order as completed."""
+        self.reset()
+        for earlier in range(min(position, self.graph.num_concepts)):
+            self.complete(earlier)
+
+    def _peek(self):
+        roots = self.graph.roots
+        while self._root_cursor < len(roots) and self.is_completed(roots[self._root_cursor]):
+            self._root_cursor += 1
+        while self._frontier and self.is_completed(self._frontier[0]):
+            heapq.heappop(self._frontier)
+
+        candidates = []
+        if self._root_cursor < len(roots):
+            candidates.append(roots[self._root_cursor])
+        if self._frontier:
+            candidates.append(self._frontier[0])
+        return min(candidates) if candidates else None
@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Set by the router (serve.py) on every request it forwards: the ring version
+# since which this worker has owned the session. A session loaded under
+# another one was served by another worker in the meantime, so it is
+# reloaded from the store (SessionManager.refresh).
+EPOCH_HEADER = "X-Tutor-Epoch"
+
+
+class Session:
+    """
+    One learner's Student/Tutor pair plus the lock that serializes
+    requests for that learner.
+    """
+    __slots__ = ("session_id", "student", "tutor", "lock", "async_lock", "last_seen", "sent_concept_id", "epoch",
+                 "users", "drop_on_release", "sent_content_version")
+
+    def __init__(self, session_id, student, tutor, now, epoch=None):
+        self.session_id = session_id
+        self.student = student
+        self.tutor = tutor
+        self.lock = threading.Lock() # Held for the whole request of this learner only
+        self.async_lock = None # asyncio.Lock, created on first use by the ASGI server
+        self.last_seen = now
+        self.sent_concept_id = None # Last concept id sent in a protocol 2 response (deltas are against it)
+        self.sent_content_version = None # Content version the client was last told about
+        self.epoch = epoch # Router owner epoch the session was loaded under (None: not behind a router)
+        self.users = 0 # Requests holding the session (get(pin=True)); never evicted while > 0
+        self.drop_on_release = False # remove() was called while pinned; the last release() drops it
+
+
+class SessionManager:
+    """
+    Registry of active learner sessions, keyed by a session token.
+    Creates Student/Tutor pairs on demand through a factory, so the
+    read-only components (ContentManager, policy, tracer) are shared.
+    Old sessions are dropped by LRU order (max_sessions) and by idle time (ttl_seconds).
+    A request pins its session (get(pin=True), then release()) while it works on it; pinned
+    sessions are skipped, so the registry may briefly hold more than
+    max_sessions, and a learner never has two sessions at once.
+    """
+    def __init__(self, session_factory, max_sessions=50000, ttl_seconds=3600,
+                 on_evict=None, clock=time.monotonic):
+        """
+        session_factory(session_id) must return a (student, tutor) tuple.
+        on_evict(session) is called after a session leaves the registry.
+        """
+        self.session_factory = session_factory
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self.clock = clock
+
+        # Ordered from least to most recently used
+        self._sessions = OrderedDict()
+        # Guards only the dict itself; never held while a tutor is working
+        self._registry_lock = threading.Lock()
+        self.created_count = 0
+        self.evicted_count = 0
+        self.reloaded_count = 0
+        logger.info("Initialized (max_sessions=%s, ttl=%ss).", max_sessions, ttl_seconds)
+
+    @staticmethod
+    def new_session_id():
+        """Returns a fresh, unguessable session token."""
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def is_valid_session_id(session_id):
+        """Checks that a token from the client looks like one we issued."""
+        if not isinstance(session_id, str) or len(session_id) != 32:
+            return False
+        try:
+            int(session_id, 16)
+        except ValueError:
+            return False
+        return True
+
+    def get(self, session_id, create=True, epoch=None, pin=False):
+        """
+        Returns the Session for session_id, creating it if needed.
+        Returns None if it does not exist and create is False.
+        A new session is loaded under `epoch` (see refresh()). With pin,
+        the session is marked in use (in the same step, so it cannot be
+        evicted in between) until release() is called.
+        """
+        now = self.clock()
+        evicted = []
+        with self._registry_lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if self._is_expired(session, now):
+                    del self._sessions[session_id]
+                    evicted.append(session)
+                    session = None
+                else:
+                    session.last_seen = now
+                    self._sessions.move_to_end(session_id)
+                    session.users += 1 if pin else 0
+            self._pop_expired(now, evicted)
+        self._notify_evicted(evicted)
+
+        if session is not None or not create:
+            return session
+
+        # Build the Student/Tutor outside the registry lock so other
+        # learners are not blocked while this one is being set up.
+        student, tutor = self.session_factory(session_id)
+        new_session = Session(session_id, student, tutor, now, epoch)
+
+        evicted = [] # Those found above were already notified
+        with self._registry_lock:
+            # Another request for the same token may have won the race
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = new_session
+                self._sessions[session_id] = session
+                self.created_count += 1
+            else:
+                session.last_seen = now
+                self._sessions.move_to_end(session_id)
+            session.users += 1 if pin else 0
+            self._pop_overflow(evicted, keep=session)
+        self._notify_evicted(evicted)
+        return session
+
+    def release(self, session):
+        """
+        Ends a get(pin=True); evicts what was kept over max_sessions while
+        pinned, and the session itself if remove() was called meanwhile.
+        """
+        evicted = []
+        with self._registry_lock:
+            session.users -= 1
+            if (not session.users and session.drop_on_release
+                    and self._sessions.get(session.session_id) is session):
+                del self._sessions[session.session_id]
+                evicted.append(session)
+            if len(self._sessions) > self.max_sessions:
+                self._pop_overflow(evicted)
+        self._notify_evicted(evicted)
+
+    def refresh(self, session, epoch):
+        """
+        Reloads the session from the store if it was loaded under another
+        router epoch: another worker served this learner in the meantime.
+        Call with the session's lock held. The Student and Tutor are
+        replaced in place, so no second copy of the session ever exists
+        and the request that held the lock before has already persisted
+        its answers. Returns True if the session was reloaded.
+        """
+        if epoch is None or session.epoch == epoch:
+            return False
+        session.student, session.tutor = self.session_factory(session.session_id)
+        session.epoch = epoch
+        session.sent_concept_id = None # The client is sent the concept again
+        session.sent_content_version = None
+        with self._registry_lock:
+            self.reloaded_count += 1
+        return True
+
+    def remove(self, session_id):
+        """
+        Drops a session from the registry. Returns True if it existed.
+        A pinned session is dropped by its last release() instead, so a
+        request still working on it never sees it restored a second time;
+        until then get() keeps returning it.
+        """
+        with self._registry_lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            if session.users:
+                session.drop_on_release = True
+                return True
+            del self._sessions[session_id]
+        self._notify_evicted([session])
+        return True
+
+    def evict_expired(self):
+        """Drops every session idle for longer than ttl_seconds. Returns the count."""
+        evicted = []
+        with self._registry_lock:
+            self._pop_expired(self.clock(), evicted)
+        self._notify_evicted(evicted)
+        return len(evicted)
+
+    def stats(self):
+        """Returns a small dict of registry counters."""
+        return {
+            "active_sessions": len(self._sessions),
+            "created": self.created_count,
+            "evicted": self.evicted_count,
+            "reloaded": self.reloaded_count,
+            "max_sessions": self.max_sessions,
+        }
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    # --- Internal helpers ---
+
+    def _is_expired(self, session, now):
+        return (self.ttl_seconds is not None and not session.users
+                and now - session.last_seen > self.ttl_seconds)
+
+    def _pop_expired(self, now, evicted):
+        """
+        Removes expired sessions from the LRU end. Must hold the registry lock.
+        The dict is ordered by last use, so we can stop at the first live one
+        (a pinned one is moved to the recent end and skipped).
+        """
+        for _ in range(len(self._sessions)):
+            oldest = next(iter(self._sessions.values()))
+            if oldest.users:
+                self._sessions.move_to_end(oldest.session_id)
+                continue
+            if not self._is_expired(oldest, now):
+                break
+            self._sessions.popitem(last=False)
+            evicted.append(oldest)
+
+    def _pop_overflow(self, evicted, keep=None):
+        """
+        Removes least recently used sessions beyond max_sessions, skipping
+        pinned ones and `keep` (the one just created). Must hold the registry lock.
+        """
+        for _ in range(len(self._sessions)):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            oldest = next(iter(self._sessions.values()))
+            if oldest.users or oldest is keep:
+                self._sessions.move_to_end(oldest.session_id)
+                continue
+            self._sessions.popitem(last=False)
+            evicted.append(oldest)
+
+    def _notify_evicted(self, evicted):
+        if not evicted:
+            return
+        with self._registry_lock:
+            self.evicted_count += len(evicted)
+        if self.on_evict is not None:
+            for session in evicted:
+                try:
+                    self.on_evict(session)
+                except Exception as e:
+                    logger.exception("Error in on_evict for %s: %s", session.session_id, e)
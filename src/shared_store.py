@@ -0,0 +1,363 @@
+"""
+Student state backends other than SQLite, with the same interface as
+StudentStore (record_answer, save_progress, snapshot, restore, bulk reads):
+
+  - MemoryStudentStore: everything in this process's memory. For tests
+    and single-process runs; nothing survives a restart.
+  - SocketStudentStore: a client of a StateServer on a local (Unix)
+    socket, which several worker processes share. A stand-in for a
+    networked store: every worker sees every learner's latest state, so a
+    session can move to another worker (see serve.py) and be restored there.
+
+Both keep the StudentStore data model (an event per answer, progress per
+student, periodic snapshots that replace the events they cover) in a
+StateTable; restore() goes through src.store.restore_student like the
+SQLite store, so all backends load a learner identically.
+
+    python -m src.shared_store --address state/state.sock
+
+Messages on the socket are pickled: only listen on a socket the workers'
+user owns (the server creates it with mode 0600).
+"""
+import argparse
+import bisect
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+
+from src.history import InteractionLog
+from src.store import event_row, restore_student, snapshot_row
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct("!I") # Message framing: 4-byte big-endian length, then the pickle
+
+
+class StateBackendError(Exception):
+    """A state server could not be reached or refused a request."""
+
+
+class StateTable:
+    """
+    The stored state of every student, in memory. All methods take plain
+    values and return plain values, so they can be called directly or
+    through a StateServer. Thread-safe.
+    """
+    # Methods a StateServer may call
+    OPERATIONS = frozenset({
+        "append", "save_progress", "write_snapshots", "num_events",
+        "load", "load_many", "student_ids", "count_students",
+    })
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}    # student_id -> {seq: event row} not covered by the snapshot
+        self._progress = {}  # student_id -> (current_concept_index, completed concept IDs)
+        self._snapshots = {} # student_id -> (num_events, history blob, tracer blob, tracer kind)
+        self._sorted_ids = None # Sorted student ids for paging; rebuilt after a new student
+
+    def append(self, student_id, seq, event, progress):
+        """One answer (see src.store.event_row) and the progress after it."""
+        with self._lock:
+            events = self._events.get(student_id)
+            if events is None:
+                events = self._events[student_id] = {}
+                self._sorted_ids = None
+            events[seq] = event
+            self._progress[student_id] = progress
+
+    def save_progress(self, student_id, progress):
+        with self._lock:
+            self._progress[student_id] = progress
+
+    def write_snapshots(self, rows):
+        """
+        Rows are (student_id, num_events, history blob, tracer blob, tracer kind).
+        As in StudentStore, a snapshot never replaces one that covers more events.
+        """
+        with self._lock:
+            for student_id, num_events, history_blob, tracer_blob, tracer_kind in rows:
+                current = self._snapshots.get(student_id)
+                if current is None:
+                    self._sorted_ids = None
+                elif current[0] > num_events:
+                    continue
+                self._snapshots[student_id] = (num_events, history_blob, tracer_blob, tracer_kind)
+                events = self._events.get(student_id)
+                if events:
+                    for seq in [seq for seq in events if seq < num_events]:
+                        del events[seq]
+
+    def num_events(self, student_id):
+        """Events written since the student's last snapshot."""
+        with self._lock:
+            return len(self._events.get(student_id) or ())
+
+    def load(self, student_id):
+        """(snapshot, tail events in order, progress) for restore_student()."""
+        with self._lock:
+            snapshot = self._snapshots.get(student_id)
+            return snapshot, self._tail(student_id, snapshot), self._progress.get(student_id)
+
+    def load_many(self, student_ids):
+        """{student_id: (snapshot, tail events)} for the given students."""
+        with self._lock:
+            loaded = {}
+            for student_id in student_ids:
+                snapshot = self._snapshots.get(student_id)
+                loaded[student_id] = (snapshot, self._tail(student_id, snapshot))
+            return loaded
+
+    def student_ids(self, after=None, limit=256):
+        """Up to `limit` stored student ids greater than `after`, in order."""
+        with self._lock:
+            if self._sorted_ids is None:
+                self._sorted_ids = sorted(self._events.keys() | self._snapshots.keys())
+            start = bisect.bisect_right(self._sorted_ids, after) if after is not None else 0
+            return self._sorted_ids[start:start + limit]
+
+    def count_students(self):
+        with self._lock:
+            return len(self._events.keys() | self._snapshots.keys())
+
+    def _tail(self, student_id, snapshot):
+        events = self._events.get(student_id) or {}
+        covered = snapshot[0] if snapshot is not None else 0
+        return [events[seq] for seq in sorted(events) if seq >= covered]
+
+
+class SharedStudentStore:
+    """
+    StudentStore interface over a StateTable, or over anything with the
+    same methods (e.g. a StateServer connection).
+    """
+    def __init__(self, table, snapshot_every=200, tracer_kind=None):
+        self.table = table
+        self.snapshot_every = max(1, int(snapshot_every))
+        self.tracer_kind = tracer_kind
+
+    # --- Writes ---
+
+    def record_answer(self, student, position, current_concept_index, completed_concepts=None):
+        """Appends interaction `position` and the Tutor's progress; snapshots every snapshot_every answers."""
+        self.table.append(student.student_id, position, event_row(student.get_history(), position),
+                          (current_concept_index, completed_concepts))
+        if (position + 1) % self.snapshot_every == 0:
+            self.snapshot(student)
+
+    def save_progress(self, student_id, current_concept_index, completed_concepts=None):
+        self.table.save_progress(student_id, (current_concept_index, completed_concepts))
+
+    def snapshot(self, student):
+        self.write_snapshots([(student.student_id, student.get_history(), student.tracer_state)])
+
+    def write_snapshots(self, entries):
+        """Entries are (student_id, history, tracer_state); see StudentStore.write_snapshots."""
+        rows = []
+        for student_id, history, tracer_state in entries:
+            student_id, num_events, history_blob, tracer_blob, _, tracer_kind = snapshot_row(
+                student_id, history, tracer_state, self.tracer_kind)
+            rows.append((student_id, num_events, history_blob, tracer_blob, tracer_kind))
+        self.table.write_snapshots(rows)
+
+    def snapshot_if_dirty(self, student):
+        if self.table.num_events(student.student_id):
+            self.snapshot(student)
+
+    # --- Reads ---
+
+    def restore(self, tutor):
+        """Loads the student's stored state into the Student and Tutor; True if anything was stored."""
+        snapshot, tail, progress = self.table.load(tutor.student.student_id)
+        return restore_student(tutor, snapshot, tail, progress)
+
+    def iter_histories(self, batch_size=256, after=None):
+        for student_ids in self.iter_student_ids(batch_size, after):
+            histories = self.load_histories(student_ids)
+            for student_id in student_ids:
+                yield student_id, histories[student_id]
+
+    def iter_student_ids(self, batch_size=256, after=None):
+        while True:
+            student_ids = self.table.student_ids(after, batch_size)
+            if not student_ids:
+                return
+            yield student_ids
+            after = student_ids[-1]
+
+    def count_students(self):
+        return self.table.count_students()
+
+    def load_histories(self, student_ids):
+        """{student_id: InteractionLog} (empty logs for unknown ids)."""
+        histories = {}
+        for student_id, (snapshot, tail) in self.table.load_many(list(student_ids)).items():
+            history = InteractionLog.from_columns(pickle.loads(snapshot[1])) if snapshot else InteractionLog()
+            for question_id, is_correct, response_time_ms, ts in tail:
+                history.append(question_id, bool(is_correct), response_time_ms, ts)
+            histories[student_id] = history
+        return histories
+
+    def close(self):
+        close = getattr(self.table, 'close', None)
+        if close is not None:
+            close()
+
+
+class MemoryStudentStore(SharedStudentStore):
+    """Student state in this process only (tests, single-process runs)."""
+    def __init__(self, snapshot_every=200, tracer_kind=None):
+        super().__init__(StateTable(), snapshot_every, tracer_kind)
+        logger.info("Using in-memory student store (snapshot every %d answers).", self.snapshot_every)
+
+
+class SocketStudentStore(SharedStudentStore):
+    """Student state on a StateServer, shared by every process that connects to it."""
+    def __init__(self, address, snapshot_every=200, timeout=10.0, tracer_kind=None):
+        super().__init__(StateConnection(address, timeout), snapshot_every, tracer_kind)
+        logger.info("Using state server at %s (snapshot every %d answers).", address, self.snapshot_every)
+
+
+# --- Socket transport ---
+
+def _send_message(sock, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_message(sock):
+    (size,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+class StateConnection:
+    """
+    StateTable methods called on a StateServer. One connection per
+    thread; a broken connection is reopened once per call (the server
+    may have restarted).
+    """
+    def __init__(self, address, timeout=10.0):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __getattr__(self, operation):
+        if operation not in StateTable.OPERATIONS:
+            raise AttributeError(operation)
+        def call(*args):
+            return self._call(operation, args)
+        return call
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except OSError as e:
+            sock.close()
+            raise StateBackendError(f"Cannot reach state server at {self.address}: {e}") from e
+        self._local.sock = sock
+        return sock
+
+    def _call(self, operation, args):
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None) or self._connect()
+            try:
+                _send_message(sock, (operation, args))
+                ok, result = _recv_message(sock)
+                break
+            except (OSError, ConnectionError) as e:
+                self.close()
+                if attempt:
+                    raise StateBackendError(f"State server at {self.address} failed: {e}") from e
+        if not ok:
+            raise StateBackendError(result)
+        return result
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+
+class _StateRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        table = self.server.table
+        while True:
+            try:
+                operation, args = _recv_message(self.request)
+            except (OSError, ConnectionError, EOFError):
+                return # Client went away
+            if operation in StateTable.OPERATIONS:
+                try:
+                    reply = (True, getattr(table, operation)(*args))
+                except Exception as e:
+                    logger.exception("State operation %s failed: %s", operation, e)
+                    reply = (False, f"{operation} failed: {e}")
+            else:
+                reply = (False, f"Unknown operation {operation!r}")
+            try:
+                _send_message(self.request, reply)
+            except OSError:
+                return
+
+
+class StateServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves a StateTable on a Unix socket, one thread per connection.
+    serve_forever() runs it; shutdown() stops it (from another thread).
+    """
+    daemon_threads = True
+
+    def __init__(self, address, table=None):
+        if os.path.exists(address):
+            os.unlink(address) # Left over from a server that did not shut down cleanly
+        os.makedirs(os.path.dirname(os.path.abspath(address)), exist_ok=True)
+        self.table = table if table is not None else StateTable()
+        old_umask = os.umask(0o177) # Socket file mode 0600
+        try:
+            super().__init__(address, _StateRequestHandler)
+        finally:
+            os.umask(old_umask)
+        logger.info("State server listening on %s.", address)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve shared student state on a Unix socket.")
+    parser.add_argument('--address', default=os.path.join('state', 'state.sock'))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    server = StateServer(args.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
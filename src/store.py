@@ -0,0 +1,382 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from src.history import InteractionLog
+
+logger = logging.getLogger(__name__)
+
+EVENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    student_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    question_id, -- No type affinity: integer and string IDs come back as written
+    is_correct INTEGER NOT NULL,
+    response_time_ms INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (student_id, seq)
+) WITHOUT ROWID;
+"""
+
+SCHEMA = EVENTS_SCHEMA + """
+CREATE TABLE IF NOT EXISTS progress (
+    student_id TEXT PRIMARY KEY,
+    current_concept_index INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    completed_concepts BLOB,
+    completed_ids TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    student_id TEXT PRIMARY KEY,
+    num_events INTEGER NOT NULL,
+    history BLOB NOT NULL,
+    tracer_state BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    tracer_kind TEXT
+) WITHOUT ROWID;
+"""
+
+
+def event_row(history, position):
+    """(question_id, is_correct, response_time_ms, timestamp) of one logged interaction (epoch seconds)."""
+    return (
+        history.question_id(position),
+        1 if history.is_correct(position) else 0,
+        history.response_times[position],
+        history.timestamps[position],
+    )
+
+
+def snapshot_row(student_id, history, tracer_state, tracer_kind=None):
+    """(student_id, num_events, history blob, tracer blob, created_at, tracer_kind) for a snapshot."""
+    return (
+        student_id,
+        len(history),
+        pickle.dumps(history.to_columns(), protocol=pickle.HIGHEST_PROTOCOL),
+        pickle.dumps(tracer_state, protocol=pickle.HIGHEST_PROTOCOL),
+        time.time(),
+        tracer_kind
+    )
+
+
+def restore_student(tutor, snapshot, tail, progress):
+    """
+    Loads stored state into tutor.student and the Tutor: `snapshot` is
+    (num_events, history blob, tracer blob, tracer_kind) or None, `tail` the
+    event rows written since (see event_row), replayed through the tracer,
+    and `progress` (current_concept_index, completed_concepts) or None, where
+    completed_concepts is a list of concept IDs, a completed-concepts bitset
+    (rows written before IDs were stored) or None.
+    A tracer state written by another kind of tracer is not loaded; the
+    state is traced again from the history instead.
+    Shared by every store backend. Returns True if anything was stored.
+    """
+    student = tutor.student
+    tracer = tutor.tracer
+    found = snapshot is not None
+    if snapshot is not None:
+        num_events, history_blob, tracer_blob, tracer_kind = snapshot
+        student.history = InteractionLog.from_columns(pickle.loads(history_blob))
+        if tracer_kind is not None and tracer_kind != tracer.state_kind:
+            logger.debug("Snapshot of %s is from tracer %s, not %s; tracing its history again.",
+                         student.student_id, tracer_kind, tracer.state_kind)
+            student.tracer_state = tracer.trace(student.history)
+        else:
+            student.tracer_state = pickle.loads(tracer_blob)
+    else:
+        student.tracer_state = tracer.init_state()
+
+    # Replay the tail written since the snapshot
+    history = student.history
+    for question_id, is_correct, response_time_ms, ts in tail:
+        found = True
+        position = history.append(question_id, bool(is_correct), response_time_ms, ts)
+        student.tracer_state = tracer.step(student.tracer_state, history.row(position))
+
+    student.seen_question_ids = history.question_id_set()
+    student.question_cursors = {}
+    student.state = tracer.get_mastery(student.tracer_state)
+
+    if progress is not None:
+        found = True
+        current_concept_index, completed_concepts = progress
+        if isinstance(completed_concepts, (bytes, bytearray)):
+            # Positions in the topological order of the content at the time
+            tutor.scheduler.restore(completed_concepts)
+        elif completed_concepts is not None:
+            tutor.scheduler.restore_ids(completed_concepts)
+        else:
+            # Rows from before the scheduler: everything before the index counts as done
+            tutor.scheduler.complete_before(current_concept_index)
+    return found
+
+
+class StudentStore:
+    """
+    Durable, append-only storage for Student history, tracer state and
+    the Tutor's current_concept_index, backed by SQLite in WAL mode.
+
+    Hot path: each answer is one small transaction (append the event row,
+    upsert progress). Every `snapshot_every` answers the student's whole
+    history and tracer state are written as one compact snapshot and the
+    covered events are deleted, so a reload reads one blob plus a short tail.
+    Students are only read when restore() is called (lazily, on first access).
+    Snapshots are tagged with tracer_kind (the writing tracer's state_kind).
+    """
+    def __init__(self, db_path, snapshot_every=200, tracer_kind=None):
+        self.db_path = db_path
+        self.snapshot_every = max(1, int(snapshot_every))
+        self.tracer_kind = tracer_kind
+        self._local = threading.local() # One connection per thread
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        logger.info("Using student store at %s (snapshot every %d answers).", db_path, self.snapshot_every)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: commits append to the log without an fsync each
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Writes ---
+
+    def record_answer(self, student, position, current_concept_index, completed_concepts=None):
+        """
+        Appends interaction `position` of the student's history and the
+        Tutor's progress (concept index and completed concept IDs).
+        Takes a snapshot every snapshot_every answers.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                (student.student_id, position) + event_row(student.get_history(), position)
+            )
+            self._upsert_progress(conn, student.student_id, current_concept_index, completed_concepts)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if (position + 1) % self.snapshot_every == 0:
+            self.snapshot(student)
+
+    def save_progress(self, student_id, current_concept_index, completed_concepts=None):
+        """Stores the Tutor's concept progress (e.g. after /start or /next_concept)."""
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            self._upsert_progress(conn, student_id, current_concept_index, completed_concepts)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def snapshot(self, student):
+        """
+        Writes the student's full history and tracer state as one blob and
+        drops the events it covers.
+        """
+        self.write_snapshots([(student.student_id, student.get_history(), student.tracer_state)])
+
+    def write_snapshots(self, entries):
+        """
+        Bulk form of snapshot(): entries are (student_id, history, tracer_state)
+        and are all written in one transaction (e.g. after a bulk replay).
+        A snapshot never replaces one that covers more events, so an offline
+        writer cannot undo a snapshot the live app took in the meantime.
+        """
+        rows = [snapshot_row(student_id, history, tracer_state, self.tracer_kind)
+                for student_id, history, tracer_state in entries]
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO snapshots (student_id, num_events, history, tracer_state, created_at, tracer_kind) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(student_id) DO UPDATE SET "
+                "num_events = excluded.num_events, history = excluded.history, "
+                "tracer_state = excluded.tracer_state, created_at = excluded.created_at, "
+                "tracer_kind = excluded.tracer_kind "
+                "WHERE excluded.num_events >= snapshots.num_events",
+                rows
+            )
+            conn.executemany(
+                "DELETE FROM events WHERE student_id = ? AND seq < ?",
+                [(row[0], row[1]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def snapshot_if_dirty(self, student):
+        """Takes a snapshot if there are events newer than the last one."""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT COUNT(*) FROM events WHERE student_id = ?", (student.student_id,)
+        ).fetchone()
+        if row[0]:
+            self.snapshot(student)
+
+    # --- Reads ---
+
+    def restore(self, tutor):
+        """
+        Loads the stored progress of tutor.student into the Student and Tutor:
+        latest snapshot, then the events after it replayed through the tracer.
+        Returns True if anything was stored for this student.
+        """
+        student_id = tutor.student.student_id
+        conn = self._connection()
+        snapshot = conn.execute(
+            "SELECT num_events, history, tracer_state, tracer_kind FROM snapshots WHERE student_id = ?",
+            (student_id,)
+        ).fetchone()
+        tail = conn.execute(
+            "SELECT question_id, is_correct, response_time_ms, ts FROM events "
+            "WHERE student_id = ? AND seq >= ? ORDER BY seq",
+            (student_id, snapshot[0] if snapshot is not None else 0)
+        ).fetchall()
+        progress = conn.execute(
+            "SELECT current_concept_index, completed_concepts, completed_ids FROM progress WHERE student_id = ?",
+            (student_id,)
+        ).fetchone()
+        if progress is not None:
+            current_concept_index, completed_concepts, completed_ids = progress
+            if completed_ids is not None:
+                completed_concepts = json.loads(completed_ids)
+            progress = (current_concept_index, completed_concepts)
+        return restore_student(tutor, snapshot, tail, progress)
+
+    def iter_histories(self, batch_size=256, after=None):
+        """
+        Yields (student_id, InteractionLog) for every stored student in
+        student_id order: snapshot history plus the events after it.
+        Students are read batch_size at a time, so memory stays bounded
+        however large the store is. Pass the last student_id seen as
+        `after` to resume.
+        """
+        for student_ids in self.iter_student_ids(batch_size, after):
+            histories = self.load_histories(student_ids)
+            for student_id in student_ids:
+                yield student_id, histories[student_id]
+
+    def iter_student_ids(self, batch_size=256, after=None):
+        """
+        Yields the ids of every stored student, in order, as lists of up
+        to batch_size (keyset pagination, no OFFSET).
+        """
+        conn = self._connection()
+        while True:
+            student_ids = [row[0] for row in conn.execute(
+                "SELECT student_id FROM snapshots WHERE student_id > ? "
+                "UNION SELECT student_id FROM events WHERE student_id > ? "
+                "ORDER BY student_id LIMIT ?",
+                (after or "", after or "", batch_size)
+            )]
+            if not student_ids:
+                return
+            yield student_ids
+            after = student_ids[-1]
+
+    def tracer_kinds(self):
+        """The tracer kinds the stored snapshots were written by (None: before kinds were recorded)."""
+        return {row[0] for row in self._connection().execute("SELECT DISTINCT tracer_kind FROM snapshots")}
+
+    def count_students(self):
+        """Number of students with any stored history."""
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM (SELECT student_id FROM snapshots UNION SELECT student_id FROM events)"
+        ).fetchone()
+        return row[0]
+
+    def load_histories(self, student_ids):
+        """
+        Reads the histories of many students with two queries.
+        Returns {student_id: InteractionLog} (empty logs for unknown ids).
+        """
+        conn = self._connection()
+        placeholders = ",".join("?" * len(student_ids))
+        histories = {}
+        snapshot_sizes = {}
+        for student_id, num_events, history_blob in conn.execute(
+            f"SELECT student_id, num_events, history FROM snapshots WHERE student_id IN ({placeholders})",
+            student_ids
+        ):
+            histories[student_id] = InteractionLog.from_columns(pickle.loads(history_blob))
+            snapshot_sizes[student_id] = num_events
+        for student_id, seq, question_id, is_correct, response_time_ms, ts in conn.execute(
+            "SELECT student_id, seq, question_id, is_correct, response_time_ms, ts FROM events "
+            f"WHERE student_id IN ({placeholders}) ORDER BY student_id, seq",
+            student_ids
+        ):
+            if seq < snapshot_sizes.get(student_id, 0):
+                continue # Covered by the snapshot (its events are deleted in the same transaction)
+            history = histories.get(student_id)
+            if history is None:
+                history = histories[student_id] = InteractionLog()
+            history.append(question_id, bool(is_correct), response_time_ms, ts)
+        for student_id in student_ids:
+            if student_id not in histories:
+                histories[student_id] = InteractionLog()
+        return histories
+
+    def close(self):
+        """Closes this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _migrate(conn):
+        """Adds columns introduced after a database was created."""
+        columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(events)")}
+        if columns.get("question_id"):
+            # Older databases declared question_id TEXT, which turned integer IDs into strings
+            conn.executescript(
+                "BEGIN IMMEDIATE;"
+                "ALTER TABLE events RENAME TO events_text_ids;"
+                + EVENTS_SCHEMA +
+                "INSERT INTO events SELECT * FROM events_text_ids;"
+                "DROP TABLE events_text_ids;"
+                "COMMIT;"
+            )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(progress)")}
+        if "completed_concepts" not in columns:
+            conn.execute("ALTER TABLE progress ADD COLUMN completed_concepts BLOB")
+        if "completed_ids" not in columns:
+            conn.execute("ALTER TABLE progress ADD COLUMN completed_ids TEXT")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(snapshots)")}
+        if "tracer_kind" not in columns:
+            conn.execute("ALTER TABLE snapshots ADD COLUMN tracer_kind TEXT")
+
+    @staticmethod
+    def _upsert_progress(conn, student_id, current_concept_index, completed_concepts=None):
+        # Completed concepts are stored as JSON concept IDs; the bitset column only holds old rows
+        completed_ids = json.dumps(list(completed_concepts)) if completed_concepts is not None else None
+        conn.execute(
+            "INSERT INTO progress (student_id, current_concept_index, updated_at, completed_concepts, completed_ids) "
+            "VALUES (?, ?, ?, NULL, ?) "
+            "ON CONFLICT(student_id) DO UPDATE SET "
+            "current_concept_index = excluded.current_concept_index, "
+            "updated_at = excluded.updated_at, "
+            "completed_concepts = NULL, "
+            "completed_ids = excluded.completed_ids",
+            (student_id, current_concept_index, time.time(), completed_ids)
+        )
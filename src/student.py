@@ -1,3 +1,10 @@
+import logging
+from array import array
+
+from src.history import InteractionLog
+
+logger = logging.getLogger(__name__)
+
 class Student:
     """
     Represents the student's state, including their
@@ -9,36 +16,66 @@ class Student:
         """
         self.student_id = student_id
         self.latent_dim_d = latent_dim_d # Keep track of expected state dimension
-        self.history = []
-        self.state = {} # The knowledge state vector (e.g., mastery scores)
-        print(f"  [Student] Initialized for student {student_id}.")
+        self.history = InteractionLog() # Columnar; iterates like a list of dicts
+        # The knowledge state vector: float32 mastery per concept position
+        self.state = array('f')
+        self.tracer_state = None # Tracer memory (hidden state / cache), owned by the tracer
+        # Kept in step with history so the policy never rescans it
+        self.seen_question_ids = set()
+        # concept_id -> position in that concept's hardest-first question list;
+        # every question before the cursor has already been seen.
+        self.question_cursors = {}
+        logger.debug("Initialized for student %s.", student_id)
 
     def update_history(self, question_id, is_correct, response_time_ms):
         """
         Adds a new interaction to the student's history.
+        Returns the new interaction.
         """
-        interaction = {
-            "question_id": question_id,
-            "is_correct": is_correct,
-            "response_time_ms": response_time_ms,
-            "timestamp": "..." # In a real app, use datetime.now()
-        }
-        self.history.append(interaction)
-        print(f"  [Student] History updated with Q{question_id}: {is_correct} (Time: {response_time_ms}ms)")
+        position = self.history.append(question_id, is_correct, response_time_ms)
+        self.seen_question_ids.add(question_id)
+        logger.debug("History updated with Q%s: %s (Time: %sms)", question_id, is_correct, response_time_ms)
+        return self.history.row(position)
 
     def get_history(self):
         """
-        Returns the full interaction history.
+        Returns the full interaction history (an InteractionLog).
         """
         return self.history
 
+    def next_unseen_question(self, concept_id, sorted_questions):
+        """
+        Returns the first question in sorted_questions not seen yet, or None.
+        The per-concept cursor only moves forward (seen ids never go away),
+        so a whole session costs amortized O(1) per call.
+        """
+        cursor = self.question_cursors.get(concept_id, 0)
+        num_questions = len(sorted_questions)
+        while cursor < num_questions and sorted_questions[cursor].get('id') in self.seen_question_ids:
+            cursor += 1
+        self.question_cursors[concept_id] = cursor
+        if cursor < num_questions:
+            return sorted_questions[cursor]
+        return None
+
+    def with_answer(self, question_id):
+        """
+        A read-only view of this student as if question_id had also been
+        answered, for planning the next action ahead of time.
+        """
+        return PendingAnswerView(self, (question_id,))
+
+    def with_answers(self, question_ids):
+        """Like with_answer, for several questions (e.g. a lookahead batch)."""
+        return PendingAnswerView(self, question_ids)
+
     def set_state(self, new_state):
         """
         Updates the student's latent knowledge state.
         Called by the Tutor after the Tracer runs.
         """
         self.state = new_state
-        print("[Student] State updated.")
+        logger.debug("State updated for student %s.", self.student_id)
 
     def get_state(self):
         """
@@ -46,3 +83,42 @@ class Student:
         Used by the Policy.
         """
         return self.state
+
+
+class _SeenWith:
+    """A seen-id set plus a few extra ids, without copying the set."""
+    __slots__ = ("seen", "extra")
+
+    def __init__(self, seen, extra):
+        self.seen = seen
+        self.extra = extra
+
+    def __contains__(self, question_id):
+        return question_id in self.extra or question_id in self.seen
+
+
+class PendingAnswerView:
+    """
+    Stands in for a Student who has also answered a few more questions.
+    Policies can select against it; it never writes to the real
+    student's seen set or question cursors.
+    """
+    __slots__ = ("student", "question_ids", "seen_question_ids")
+
+    def __init__(self, student, question_ids):
+        self.student = student
+        self.question_ids = frozenset(question_ids)
+        self.seen_question_ids = _SeenWith(student.seen_question_ids, self.question_ids)
+
+    def __getattr__(self, name):
+        return getattr(self.student, name)
+
+    def next_unseen_question(self, concept_id, sorted_questions):
+        """Like Student.next_unseen_question, but leaves the cursor where it is."""
+        cursor = self.student.question_cursors.get(concept_id, 0)
+        num_questions = len(sorted_questions)
+        while cursor < num_questions and sorted_questions[cursor].get('id') in self.seen_question_ids:
+            cursor += 1
+        if cursor < num_questions:
+            return sorted_questions[cursor]
+        return None
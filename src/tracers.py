@@ -1,51 +1,477 @@
+import logging
 import os
-# We will need torch later, but not for the placeholder
+from array import array
+
+from src.kt_model import KnowledgeModel, load_numpy # Cheap: NumPy is imported on first use
+
+# We will need torch later, but not for the placeholder.
+# It is imported in load(), not here, so importing this module stays cheap:
 # import torch
 # import torch.nn as nn
 
-class TransformerKnowledgeTracer: # Keep the name for consistency
+logger = logging.getLogger(__name__)
+
+class TracerState:
+    """
+    Per-student tracer memory carried between answers.
+    The placeholder only needs running counts; a real model would keep
+    its recurrent hidden state or attention KV cache in `hidden`.
+    """
+    __slots__ = ("num_correct", "num_attempted", "hidden")
+
+    def __init__(self, num_correct=0, num_attempted=0, hidden=None):
+        self.num_correct = num_correct
+        self.num_attempted = num_attempted
+        self.hidden = hidden
+
+    def __eq__(self, other):
+        if not isinstance(other, TracerState):
+            return NotImplemented
+        return (self.num_correct == other.num_correct
+                and self.num_attempted == other.num_attempted
+                and self.hidden == other.hidden)
+
+    def __repr__(self):
+        return f"TracerState(num_correct={self.num_correct}, num_attempted={self.num_attempted})"
+
+
+class KnowledgeTracer:
+    """
+    What every tracer shares: the concept order it reports mastery in
+    (following the content index) and the batch, consistency and JSON
+    helpers built on a subclass's step() and trace().
+
+    Incremental API (O(1) per answer in history length):
+        state = tracer.init_state()
+        state = tracer.step(state, interaction)
+        mastery = tracer.get_mastery(state)
+    update_state(history) still recomputes from the full history and is
+    kept as the reference for check_consistency().
+    """
+    # step() only reads the question and is_correct, so a state computed
+    # ahead of time for an outcome (Tutor prefetch) can be reused as is
+    outcome_only = True
+    # How this tracer's states are encoded. Stored with every snapshot, so a
+    # state is never loaded by a tracer that reads states differently.
+    state_kind = None
+
+    def __init__(self, model_path, content_manager, num_concepts=24):
+        """
+        Mastery is indexed by the concept order of the content index
+        (the order the Tutor teaches in). Without concepts, num_concepts
+        placeholder ids "c1".."cN" are used.
+        """
+        self.content_manager = content_manager
+        self.default_num_concepts = num_concepts
+        self._index = False # Forces the first _sync_concepts
+        self._sync_concepts()
+        self.model_path = model_path
+        self.model = None # Loaded by load(), not here
+
+    def _sync_concepts(self):
+        """Follows the content index (including hot reloads) for the concept order."""
+        index = getattr(self.content_manager, 'index', None)
+        if index is self._index:
+            return
+        if index is not None and index.concept_ids:
+            concept_ids = list(index.concept_ids)
+        else:
+            concept_ids = [f"c{i+1}" for i in range(self.default_num_concepts)]
+        self.concept_ids = concept_ids
+        self.num_concepts = len(concept_ids)
+        self._index = index
+
+    def step_batch(self, states, interactions):
+        """
+        Advances many students by one interaction each, in one call.
+        Returns the new states in the same order. A model-backed tracer
+        runs a single batched forward pass instead of this loop.
+        """
+        return [self.step(state, interaction) for state, interaction in zip(states, interactions)]
+
+    def trace_many(self, histories):
+        """trace() for many histories (bulk replay). Returns the states in order."""
+        return [self.trace(history) for history in histories]
+
+    def check_consistency(self, state, student_history):
+        """
+        Returns True if an incrementally maintained state matches a full
+        recompute over the history. Meant for tests and debug checks.
+        """
+        expected = self.trace(student_history)
+        if state != expected:
+            logger.warning("Incremental state %r != recomputed %r.", state, expected)
+            return False
+        return True
+
+    def mastery_as_dict(self, mastery):
+        """
+        Dict view of a mastery vector, e.g. {"c1_mastery": 0.5, ...}.
+        Only meant for the JSON boundary; keep the array everywhere else.
+        """
+        self._sync_concepts()
+        return {
+            f"{concept_id}_mastery": float(value)
+            for concept_id, value in zip(self.concept_ids, mastery)
+        }
+
+
+class TransformerKnowledgeTracer(KnowledgeTracer): # Keep the name for consistency
     """
     A placeholder for the real knowledge tracing model.
-    It fulfills the interface but returns dummy data.
+    It fulfills the interface but returns dummy data: the overall
+    accuracy as the mastery of every concept.
     """
+    state_kind = "placeholder" # Running counts only
     def __init__(self, model_path, content_manager, num_concepts=24, dim=64):
+        """Initializes the placeholder tracer."""
+        super().__init__(model_path, content_manager, num_concepts=num_concepts)
+        self.hidden_dim = dim
+        logger.info("Initialized PLACEHOLDER model.")
+
+    def load(self):
         """
-        Initializes the placeholder tracer.
-        It needs the content_manager later if it were real.
+        Loads the model weights (once). Call it in a pre-fork parent so that
+        forked workers share the weights copy-on-write; otherwise it runs on
+        first use. A real tracer imports torch and calls torch.load here.
         """
-        self.content_manager = content_manager # Store for potential future use
-        self.num_concepts = num_concepts
-        self.hidden_dim = dim
+        if self.model is not None:
+            return self.model
+        if not os.path.exists(self.model_path):
+             logger.info("Placeholder: Model path specified but not found: %s", self.model_path)
+        else:
+             logger.info("Placeholder: Model path exists: %s", self.model_path)
+        self.model = "placeholder"
+        return self.model
+
+    def init_state(self):
+        """Returns the tracer state for a student with no history."""
+        return TracerState()
 
-        print(f"  [Tracer] Initialized PLACEHOLDER model.")
-        if not os.path.exists(model_path):
-             print(f"  [Tracer] Placeholder: Model path specified but not found: {model_path}")
+    def step(self, state, interaction):
+        """
+        Advances the tracer by one interaction and returns the new state.
+        The input state is not modified, so callers may keep it.
+        """
+        if state is None:
+            state = self.init_state()
+        return TracerState(
+            num_correct=state.num_correct + (1 if interaction.get('is_correct') else 0),
+            num_attempted=state.num_attempted + 1,
+            hidden=state.hidden
+        )
+
+    def trace(self, student_history):
+        """Builds the tracer state from scratch by replaying a full history."""
+        if hasattr(student_history, 'num_correct'):
+            # Fast path: read the InteractionLog columns directly
+            return TracerState(
+                num_correct=sum(student_history.correct_flags()),
+                num_attempted=len(student_history)
+            )
+        state = self.init_state()
+        for interaction in student_history:
+            state = self.step(state, interaction)
+        return state
+
+    def mastery_sequence(self, student_history):
+        """
+        Yields, for each interaction of the history, the mastery vector from
+        before it was answered (what the tracer predicted at the time).
+        """
+        if hasattr(student_history, 'correct_flags'):
+            flags = student_history.correct_flags()
         else:
-             print(f"  [Tracer] Placeholder: Model path exists: {model_path}")
+            flags = (bool(item.get('is_correct')) for item in student_history)
+        num_correct = 0
+        for num_attempted, is_correct in enumerate(flags):
+            yield self._mastery_from_accuracy(num_correct / num_attempted if num_attempted else 0.5)
+            num_correct += 1 if is_correct else 0
 
+    def get_mastery(self, state):
+        """
+        Turns a tracer state into the mastery vector: an array('f') with
+        one float32 per concept, indexed by concept position.
+        """
+        total_attempted = state.num_attempted if state is not None else 0
+        num_correct = state.num_correct if state is not None else 0
+        overall_accuracy = (num_correct / total_attempted) if total_attempted > 0 else 0.5
+        return self._mastery_from_accuracy(overall_accuracy)
 
     def update_state(self, student_history):
         """
         Placeholder implementation. Returns a simple, static state.
         In a real tracer, this would run the neural network.
+        Recomputes from the full history; prefer step() on the hot path.
         """
-        print("  [Tracer] Updating state (placeholder)...")
+        logger.debug("Updating state (placeholder)...")
 
         # Create a simple dummy state based on overall correctness
-        num_correct = sum(1 for item in student_history if item.get('is_correct'))
+        if hasattr(student_history, 'num_correct'):
+            num_correct = student_history.num_correct() # InteractionLog fast path
+        else:
+            num_correct = sum(1 for item in student_history if item.get('is_correct'))
         total_attempted = len(student_history)
         overall_accuracy = (num_correct / total_attempted) if total_attempted > 0 else 0.5
+        final_state = self._mastery_from_accuracy(overall_accuracy)
 
-        # Return a dictionary with the same structure as the real tracer
-        final_state = {}
-        for i in range(self.num_concepts):
-            concept_name = f"c{i+1}_mastery"
-            # Just return the overall accuracy for every concept as a placeholder
-            final_state[concept_name] = overall_accuracy
-
-        print(f"  [Tracer] Placeholder state (overall accuracy): {overall_accuracy:.4f}")
+        logger.debug("Placeholder state (overall accuracy): %.4f", overall_accuracy)
         return final_state
 
+    def _mastery_from_accuracy(self, overall_accuracy):
+        # Just return the overall accuracy for every concept as a placeholder
+        self._sync_concepts()
+        return array('f', [overall_accuracy]) * self.num_concepts
+
+class WindowMemory:
+    """
+    Tracer memory of WindowedKnowledgeTracer: the last `window` interaction
+    tokens (oldest first) and, once computed, the model's per-concept
+    probabilities for them. Only the tokens are compared and pickled; the
+    probabilities are recomputed from them when needed.
+    """
+    __slots__ = ("tokens", "probs")
+
+    def __init__(self, tokens=(), probs=None):
+        self.tokens = tokens
+        self.probs = probs
+
+    def __eq__(self, other):
+        if not isinstance(other, WindowMemory):
+            return NotImplemented
+        return self.tokens == other.tokens
+
+    def __reduce__(self):
+        return (WindowMemory, (self.tokens,))
+
+    def __repr__(self):
+        return f"WindowMemory(tokens={len(self.tokens)})"
+
+
+class WindowedKnowledgeTracer(KnowledgeTracer):
+    """
+    Knowledge tracer backed by a trained windowed model (src/kt_model.py),
+    trained offline with src/kt_training.py.
+
+    Each answer becomes a get_interaction_id() token; the state keeps the
+    last `window` of them, so step() costs the same for the 1st and the
+    10,000th answer. step() also runs the forward pass (one gather and one
+    matrix-vector product over int8/float16 weights), so under the async
+    server or the BatchingTracer the model runs off the request thread,
+    a whole batch in one call.
+
+    Concepts the model was not trained on (and answers to unknown
+    questions) are left out of the window; their mastery is default_mastery.
+    """
+    outcome_only = True
+
+    def __init__(self, model_path, content_manager, default_mastery=0.5, num_concepts=24):
+        self.default_mastery = default_mastery
+        self._question_tokens = {} # question_id -> (wrong, right) token pair, or None
+        self._rows = None          # concept position -> model concept index (-1: unknown)
+        self._rows_index = False
+        super().__init__(model_path, content_manager, num_concepts=num_concepts)
+        logger.info("Initialized windowed knowledge tracer (model %s).", model_path)
+
+    def load(self):
+        """
+        Loads the weights (once), keeping them in the precision they were
+        saved in. Call it in a pre-fork parent so workers share them.
+        """
+        if self.model is None:
+            model = KnowledgeModel.load(self.model_path)
+            logger.info("Loaded %s knowledge model: %d concepts, window %d, dim %d.",
+                        model.precision, model.num_concepts, model.window, model.dim)
+            self.model = model
+        return self.model
+
+    @property
+    def state_kind(self):
+        """Windows of get_interaction_id() tokens: readable by any model with the same concepts and window."""
+        model = self.load()
+        return f"windowed:{model.num_concepts}:{model.window}"
+
+    def _sync_concepts(self):
+        index = getattr(self.content_manager, 'index', None)
+        if index is not self._index:
+            self._question_tokens = {} # Questions may have moved between concepts
+        super()._sync_concepts()
+
+    def _token_pair(self, question_id):
+        """(wrong, right) tokens for a question, or None if the model cannot place it."""
+        self._sync_concepts()
+        tokens = self._question_tokens.get(question_id, False)
+        if tokens is False:
+            tokens = None
+            index = getattr(self.content_manager, 'index', None)
+            question = index.questions_by_id.get(question_id) if index is not None else None
+            concept_id = question.get('concept_id') if question else None
+            number = concept_number(concept_id)
+            num_concepts = self.model.num_concepts
+            if number is not None and 1 <= number <= num_concepts:
+                tokens = (get_interaction_id(concept_id, False, num_concepts),
+                          get_interaction_id(concept_id, True, num_concepts))
+            self._question_tokens[question_id] = tokens
+        return tokens
+
+    def _advance(self, state, interaction):
+        """The new state without its probabilities (tokens and counters only)."""
+        if state is None:
+            state = self.init_state()
+        memory = state.hidden or WindowMemory()
+        is_correct = bool(interaction.get('is_correct'))
+        pair = self._token_pair(interaction.get('question_id'))
+        if pair is not None:
+            memory = WindowMemory((memory.tokens + (pair[is_correct],))[-self.model.window:])
+        return TracerState(
+            num_correct=state.num_correct + (1 if is_correct else 0),
+            num_attempted=state.num_attempted + 1,
+            hidden=memory
+        )
+
+    def _window_array(self, tokens):
+        """Tokens right-aligned in a full window, padded on the left."""
+        model = self.model
+        window = [model.pad_token] * (model.window - len(tokens))
+        window.extend(tokens)
+        return window
+
+    def init_state(self):
+        self.load()
+        return TracerState(hidden=WindowMemory())
+
+    def step(self, state, interaction):
+        """
+        Advances the tracer by one interaction and returns the new state
+        (with its mastery already computed). The input state is not modified.
+        """
+        self.load()
+        new_state = self._advance(state, interaction)
+        memory = new_state.hidden
+        memory.probs = self.model.mastery(load_numpy().asarray(self._window_array(memory.tokens)))
+        return new_state
+
+    def step_batch(self, states, interactions):
+        """Advances many students by one interaction each with one batched forward pass."""
+        self.load()
+        if not states:
+            return []
+        new_states = [self._advance(state, interaction) for state, interaction in zip(states, interactions)]
+        windows = load_numpy().asarray([self._window_array(state.hidden.tokens) for state in new_states])
+        probs = self.model.mastery(windows)
+        for state, row in zip(new_states, probs):
+            state.hidden.probs = row
+        return new_states
+
+    def trace(self, student_history):
+        """
+        Builds the state from a full history. Only the newest answers that
+        fit in the window are looked at (plus the correct count).
+        """
+        self.load()
+        window = self.model.window
+        if hasattr(student_history, 'num_correct'):
+            # Fast path: walk the InteractionLog backwards until the window is full
+            tokens = []
+            position = len(student_history) - 1
+            while position >= 0 and len(tokens) < window:
+                pair = self._token_pair(student_history.question_id(position))
+                if pair is not None:
+                    tokens.append(pair[student_history.is_correct(position)])
+                position -= 1
+            tokens.reverse()
+            return TracerState(
+                num_correct=student_history.num_correct(),
+                num_attempted=len(student_history),
+                hidden=WindowMemory(tuple(tokens))
+            )
+        state = self.init_state()
+        for interaction in student_history:
+            state = self._advance(state, interaction)
+        return state
+
+    def trace_many(self, histories):
+        """trace() for many histories, with one batched forward pass for all of them."""
+        states = [self.trace(history) for history in histories]
+        if states:
+            windows = load_numpy().asarray([self._window_array(state.hidden.tokens) for state in states])
+            for state, row in zip(states, self.model.mastery(windows)):
+                state.hidden.probs = row
+        return states
+
+    def mastery_sequence(self, student_history, block_size=256):
+        """
+        Yields, for each interaction, the mastery from before it was answered
+        (float32 arrays indexed by concept position). The windows of a whole
+        block of positions go through the model in one pass.
+        """
+        self.load()
+        np = load_numpy()
+        window = self.model.window
+        tokens = []
+        tokens_before = [] # Tokens the window can see before each interaction
+        for interaction in student_history:
+            tokens_before.append(len(tokens))
+            pair = self._token_pair(interaction.get('question_id'))
+            if pair is not None:
+                tokens.append(pair[bool(interaction.get('is_correct'))])
+        if not tokens_before:
+            return
+        padded = np.asarray(self._window_array([]) + tokens)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+        rows, known = self._concept_rows()
+        default = np.float32(self.default_mastery)
+        for start in range(0, len(tokens_before), block_size):
+            probs = self.model.mastery(windows[tokens_before[start:start + block_size]])
+            yield from np.where(known, probs[:, rows], default)
+
+    def get_mastery(self, state):
+        """
+        The mastery vector for a state: an array('f') with one float32 per
+        concept, indexed by concept position (default_mastery where the model
+        has no such concept).
+        """
+        self.load()
+        np = load_numpy()
+        memory = state.hidden if state is not None else None
+        if memory is None:
+            memory = WindowMemory()
+        if memory.probs is None:
+            # Restored from a snapshot (probabilities are not stored) or built by trace()
+            memory.probs = self.model.mastery(np.asarray(self._window_array(memory.tokens)))
+        rows, known = self._concept_rows()
+        mastery = np.where(known, memory.probs[rows], np.float32(self.default_mastery)).astype(np.float32)
+        result = array('f')
+        result.frombytes(mastery.tobytes())
+        return result
+
+    def update_state(self, student_history):
+        """Reference recompute from the full history (see check_consistency)."""
+        return self.get_mastery(self.trace(student_history))
+
+    def _concept_rows(self):
+        """For each concept position, the model's row for it and whether it has one."""
+        self._sync_concepts()
+        if self._rows_index is not self._index:
+            np = load_numpy()
+            num_concepts = self.model.num_concepts
+            numbers = [concept_number(concept_id) for concept_id in self.concept_ids]
+            rows = np.asarray([n - 1 if n is not None and 1 <= n <= num_concepts else -1 for n in numbers],
+                              dtype=np.intp)
+            known = rows >= 0
+            self._rows = (np.where(known, rows, 0), known)
+            self._rows_index = self._index
+        return self._rows
+
+
+def concept_number(concept_id_str):
+    """The number in a concept id ("c12" -> 12), or None if it has none."""
+    try:
+        return int(concept_id_str[1:])
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
 # --- Helper Function (Not used by placeholder but needed if switching back) ---
 def get_interaction_id(concept_id_str, is_correct, num_concepts):
     try:
@@ -55,5 +481,5 @@ def get_interaction_id(concept_id_str, is_correct, num_concepts):
         else:
             return c_index
     except (ValueError, TypeError, IndexError):
-        print(f"  [Tracer] Warning: Could not parse concept_id {concept_id_str}. Defaulting to 0.")
+        logger.warning("Could not parse concept_id %r. Defaulting to 0.", concept_id_str)
         return 0
@@ -1,47 +1,130 @@
+import logging
+
+from src.metrics import ACTIONS, CONCEPT_TRANSITIONS, PREFETCH, STAGE_LATENCY, timed
+from src.scheduler import ConceptScheduler
+
+logger = logging.getLogger(__name__)
+
+# Histogram children are looked up once; timing a stage is then one perf_counter pair
+_GET_QUESTION_TIMER = STAGE_LATENCY.labels("get_question")
+_GRADE_TIMER = STAGE_LATENCY.labels("grade")
+_HISTORY_TIMER = STAGE_LATENCY.labels("update_history")
+_TRACER_TIMER = STAGE_LATENCY.labels("tracer_update")
+_POLICY_TIMER = STAGE_LATENCY.labels("policy_select")
+_PERSIST_TIMER = STAGE_LATENCY.labels("persist")
+_PREFETCH_HIT = PREFETCH.labels("hit")
+_PREFETCH_MISS = PREFETCH.labels("miss")
+_PREFETCH_DROPPED = PREFETCH.labels("dropped")
+
+
+class _Prefetched:
+    """The precomputed outcome of one possible answer."""
+    __slots__ = ("tracer_state", "mastery", "position", "action")
+
+    def __init__(self, tracer_state, mastery, position, action):
+        self.tracer_state = tracer_state
+        self.mastery = mastery
+        self.position = position
+        self.action = action
+
+
 class Tutor:
     """
     The main orchestrator. Connects all components (Policy, Tracer, etc.).
     Runs the main interaction loop.
     """
-    def __init__(self, student, policy, tracer, content_manager):
+    def __init__(self, student, policy, tracer, content_manager, store=None, mastery_threshold=None,
+                 prefetch_executor=None):
         """
         Initializes the Tutor with its required components.
-        Loads and sorts the concepts to be taught.
+        Loads the concepts to be taught in prerequisite order.
+        If a StudentStore is given, progress is written to it as it happens.
+        If mastery_threshold is set, concepts the tracer already rates at or
+        above it are skipped.
+        If a prefetch_executor (concurrent.futures) is given, the next action
+        for both outcomes of each question is computed on it while the
+        student is answering (see schedule_prefetch).
         """
         self.student = student
         self.policy = policy
         self.tracer = tracer
         self.content_manager = content_manager
+        self.store = store
+        self.prefetch_executor = prefetch_executor
+        self._prefetch = None # (question_id, Future of {is_correct: _Prefetched or None})
+        self._ready = None    # (question_id, outcomes) once settled, until the answer arrives
 
-        # --- Load and Sort Concepts ---
-        concepts_data = self.content_manager.concepts # Assumes this holds the dict from knowledge.json
-        concepts_list_from_json = concepts_data.get('concepts', [])
-        
-        if not concepts_list_from_json:
-             print("  [Tutor] WARNING: No 'concepts' found in knowledge.json")
+        # --- Load Concepts in Prerequisite Order ---
+        # The ContentIndex compiles the prerequisite graph once at load time,
+        # so every Tutor (one per session) shares the same ordered list.
+        self._index = self.content_manager.index
+        self.concept_graph = self._index.concept_graph
+        self.concepts_to_teach = self.concept_graph.ordered_concepts
+        # Per-student progress through the graph (replaces a plain index walk)
+        self.scheduler = ConceptScheduler(self.concept_graph, mastery_threshold)
 
-        # Sort concepts by their ID (e.g., "c1", "c2", ..., "c10")
-        # We need a sort key that handles numbers correctly within the string
-        def sort_key(concept):
-            try:
-                # Extract number part (e.g., "c1" -> 1)
-                return int(concept.get('id', 'c0')[1:]) 
-            except ValueError:
-                return 0 # Default if ID format is unexpected
-                
-        self.concepts_to_teach = sorted(
-            concepts_list_from_json, 
-            key=sort_key
-        )
-        
-        self.current_concept_index = 0
-        print(f"  [Tutor] Initialized. Ready to teach {len(self.concepts_to_teach)} concepts.")
+        if not self.concepts_to_teach:
+             logger.warning("No 'concepts' found in knowledge.json")
+
+        # The tracer works incrementally from the student's cached state
+        if self.student.tracer_state is None:
+            self.student.tracer_state = self.tracer.init_state()
+
+        logger.debug("Initialized. Ready to teach %d concepts.", len(self.concepts_to_teach))
+
+    def current_concept_index(self):
+        """
+        Position (in concepts_to_teach) of the current concept, or
+        len(concepts_to_teach) once everything is done.
+        Like _get_current_concept, this completes concepts the tracer
+        already rates as mastered (see ConceptScheduler.current).
+        """
+        self._sync_content()
+        position = self.scheduler.current(self.student.get_state())
+        return len(self.concepts_to_teach) if position is None else position
+
+    def get_progress(self):
+        """
+        (current_concept_index, completed concept IDs) for persistence.
+        The IDs are what restore uses, so stored progress stays valid when
+        the content (and with it the topological order) changes.
+        """
+        return self.current_concept_index(), self.scheduler.completed_ids()
 
     def _get_current_concept(self):
         """Gets the concept dict the student is currently working on."""
-        if 0 <= self.current_concept_index < len(self.concepts_to_teach):
-            return self.concepts_to_teach[self.current_concept_index]
-        return None
+        self._sync_content()
+        position = self.scheduler.current(self.student.get_state())
+        if position is None:
+            return None
+        return self.concepts_to_teach[position]
+
+    def _sync_content(self):
+        """
+        Follows a content hot reload (ContentManager.reload swaps the index):
+        completed concepts are carried over by ID onto the new graph, and
+        per-concept state keyed by position is rebuilt. Live sessions keep going.
+        Stored progress is kept by concept ID, so it needs no rewrite.
+        """
+        index = self.content_manager.index
+        if index is self._index:
+            return
+        self._drop_prefetch()
+        old_scheduler = self.scheduler
+
+        self._index = index
+        self.concept_graph = index.concept_graph
+        self.concepts_to_teach = self.concept_graph.ordered_concepts
+        self.scheduler = ConceptScheduler(self.concept_graph, old_scheduler.mastery_threshold)
+        self.scheduler.restore_ids(old_scheduler.completed_ids())
+
+        # Question lists were rebuilt, so cursors restart (the seen set still holds)
+        self.student.question_cursors.clear()
+        # Mastery is indexed by concept position: recompute it in the new order
+        if len(self.student.get_state()):
+            self.student.set_state(self.tracer.get_mastery(self.student.tracer_state))
+        logger.info("Student %s moved to reloaded content (%d of %d concepts completed).",
+                    self.student.student_id, self.scheduler.num_completed, self.concept_graph.num_concepts)
 
     def _get_next_action(self):
         """
@@ -49,78 +132,326 @@ class Tutor:
         Handles moving to the next concept if the policy signals completion.
         Returns: (action_type, content, current_concept_id) or (None, None, None) if finished.
         """
-        current_concept = self._get_current_concept()
-        if not current_concept:
-            print("[Tutor] All concepts completed!")
-            return ("mastery", {"message": "You have mastered all concepts!"}, None)
-
-        current_concept_id = current_concept.get('id', None)
-        if not current_concept_id:
-             print("[Tutor] Error: Current concept has no ID.")
-             # Failsafe: move to next concept if possible
-             self.current_concept_index += 1
-             return self._get_next_action()
-             
-        student_state = self.student.get_state()
-        student_history = self.student.get_history()
-        
-        # Ask the policy for the next action for this concept
-        action_type, content = self.policy.select_action(
-            student_state, 
-            student_history, 
-            current_concept_id
-        )
-        
-        # Check if the policy decided to end the concept
-        if action_type == "end_concept":
-            print(f"  [Tutor] Policy signaled end of concept {current_concept_id}. Moving to next.")
-            self.current_concept_index += 1
-            # Recursively call to get the first action of the *new* concept
-            return self._get_next_action()
+        # Loop rather than recurse: a long run of empty concepts must not
+        # hit the recursion limit on large graphs.
+        while True:
+            current_concept = self._get_current_concept()
+            if not current_concept:
+                logger.debug("All concepts completed!")
+                ACTIONS.labels("mastery").inc()
+                return ("mastery", {"message": "You have mastered all concepts!"}, None)
+
+            current_concept_id = current_concept.get('id')
+            student_state = self.student.get_state()
+            student_history = self.student.get_history()
+
+            # Ask the policy for the next action for this concept
+            with timed(_POLICY_TIMER):
+                action_type, content = self.policy.select_action(
+                    student_state,
+                    student_history,
+                    current_concept_id,
+                    student=self.student # Enables the incremental seen-question path
+                )
+            ACTIONS.labels(action_type).inc()
 
-        # Return the chosen action and the ID of the concept it belongs to
-        return (action_type, content, current_concept_id)
+            # Check if the policy decided to end the concept
+            if action_type == "end_concept":
+                logger.debug("Policy signaled end of concept %s. Moving to next.", current_concept_id)
+                self.scheduler.complete(self.concept_graph.positions[current_concept_id])
+                CONCEPT_TRANSITIONS.labels("completed").inc()
+                continue # Get the first action of the *new* concept
 
-    def start_session(self):
+            # Return the chosen action and the ID of the concept it belongs to
+            return (action_type, content, current_concept_id)
+
+    def start_session(self, persist=True):
         """
         Called by app.py to start the tutoring session.
         Resets progress and gets the first action.
+        With persist=False the caller is responsible for save_progress()
+        and schedule_prefetch().
         """
-        print("[Tutor] Session started.")
-        self.current_concept_index = 0 # Start from the first concept
-        return self._get_next_action()
+        logger.debug("Session started.")
+        self._sync_content()
+        self._drop_prefetch()
+        self.scheduler.reset() # Start from the first concept
+        action = self._get_next_action()
+        if persist:
+            self.save_progress()
+            self.schedule_prefetch(action)
+        return action
+
+    def advance_concept(self, persist=True):
+        """
+        Called by app.py when the student asks to move on.
+        Skips to the next concept and returns its first action.
+        With persist=False the caller is responsible for save_progress()
+        and schedule_prefetch().
+        """
+        self._sync_content()
+        self._drop_prefetch()
+        position = self.scheduler.current(self.student.get_state())
+        if position is not None:
+            self.scheduler.complete(position)
+            CONCEPT_TRANSITIONS.labels("skipped").inc()
+        logger.debug("Moving to concept index %d.", self.current_concept_index())
+        action = self._get_next_action()
+        if persist:
+            self.save_progress()
+            self.schedule_prefetch(action)
+        return action
+
+    def save_progress(self):
+        """Writes the current concept progress to the store (if any)."""
+        if self.store is not None:
+            current_concept_index, completed = self.get_progress()
+            self.store.save_progress(self.student.student_id, current_concept_index, completed)
 
     def submit_answer(self, question_id, user_answer, response_time_ms):
         """
         Called by app.py when the user submits an answer.
-        1. Grade the answer.
-        2. Update student history.
-        3. Update student knowledge state (via tracer).
-        4. Get the next action (via policy).
+        1. Grade the answer and update student history (record_answer).
+        2. Update student knowledge state (via tracer).
+        3. Get the next action (via policy).
+        4. Persist the answer (persist_answer).
+        With prefetch on, steps 2 and 3 were usually done while the student
+        was reading the question.
         Returns: (action_type, content, current_concept_id)
+
+        The async server runs the same phases itself so that steps 2 and 4
+        can happen off the event loop.
+        """
+        interaction = self.record_answer(question_id, user_answer, response_time_ms)
+        if interaction is None:
+            # Failsafe: Try to get the next action anyway
+            return self.next_action()
+
+        # 2. + 3. Served from the prefetch if it covered this outcome
+        action = self.apply_prefetched(interaction)
+        if action is None:
+            # 2. Update knowledge state (call the tracer with just the new interaction)
+            with timed(_TRACER_TIMER):
+                tracer_state = self.tracer.step(self.student.tracer_state, interaction)
+            # 3. Get next action from the policy
+            action = self.apply_tracer_state(tracer_state)
+        # 4. Persist the answer and the resulting progress (one small append)
+        self.persist_answer()
+        self.schedule_prefetch(action)
+        return action
+
+    def record_answer(self, question_id, user_answer, response_time_ms):
         """
-        print(f"[Tutor] Received answer for Q{question_id}: '{user_answer}' (Time: {response_time_ms}ms)")
+        Grades the answer and appends it to the student's history.
+        Returns the new interaction (for tracer.step), or None if the
+        question is unknown.
+        """
+        logger.debug("Received answer for Q%s: %r (Time: %sms)", question_id, user_answer, response_time_ms)
+        self._settle_prefetch() # A background prefetch must not see the history change
+        self._sync_content()
         
-        # 1. Get the correct question/answer for grading
-        question = self.content_manager.get_question(question_id)
+        # Get the question to grade; lookup and grading use the same content version
+        index = self.content_manager.index
+        with timed(_GET_QUESTION_TIMER):
+            try:
+                question = index.questions_by_id.get(question_id)
+            except TypeError: # Unhashable (e.g. a list from a JSON body): cannot be an id
+                question = None
         if not question:
-            print(f"  [Tutor] ERROR: Could not find question {question_id} to grade.")
-            # Failsafe: Try to get the next action anyway
-            return self._get_next_action()
+            logger.error("Could not find question %s to grade.", question_id)
+            return None
             
-        correct_answer = str(question.get('answer', '')) # Default to empty string if missing
-        
-        # 2. Grade the user's answer (case-insensitive string comparison)
-        is_correct = (str(user_answer).lower() == correct_answer.lower())
-        print(f"  [Tutor] User answer: '{user_answer}', Correct answer: '{correct_answer}', Graded: {is_correct}")
-        
-        # 3. Update student history
-        self.student.update_history(question_id, is_correct, response_time_ms)
+        with timed(_GRADE_TIMER):
+            # Matchers are precompiled per question at content load (src/grading.py)
+            is_correct = index.grader.grade(question_id, user_answer)
+        logger.debug("User answer: %r, Correct answer: %r, Graded: %s", user_answer, question.get('answer'), is_correct)
         
-        # 4. Update knowledge state (call the tracer)
-        history = self.student.get_history()
-        new_state = self.tracer.update_state(history)
-        self.student.set_state(new_state) # Save the new state
-        
-        # 5. Get next action from the policy
+        # Update student history
+        with timed(_HISTORY_TIMER):
+            return self.student.update_history(question_id, is_correct, response_time_ms)
+
+    def apply_tracer_state(self, tracer_state):
+        """
+        Stores the tracer state returned by tracer.step() for the latest
+        interaction and returns the next action.
+        """
+        self.student.tracer_state = tracer_state
+        self.student.set_state(self.tracer.get_mastery(tracer_state)) # Save the new state
         return self._get_next_action()
+
+    def lookahead(self, count):
+        """
+        The next `count` questions of the current concept, in the order the
+        policy would ask them if mastery stayed where it is now. Nothing is
+        recorded; the student's seen set and cursors are left alone.
+        Returns (questions, current_concept_id); stops early at anything
+        that is not a question.
+        """
+        current_concept = self._get_current_concept()
+        if not current_concept:
+            return [], None
+        concept_id = current_concept.get('id')
+        student_state = self.student.get_state()
+        student_history = self.student.get_history()
+        questions = []
+        planned = []
+        for _ in range(count):
+            view = self.student.with_answers(planned)
+            action_type, content = self.policy.select_action(student_state, student_history, concept_id, student=view)
+            if action_type != "question":
+                break
+            questions.append(content)
+            planned.append(content.get('id'))
+        return questions, concept_id
+
+    def next_action(self):
+        """The next action without recording anything (e.g. after a failed grade)."""
+        self._drop_prefetch()
+        return self._get_next_action()
+
+    def persist_answer(self):
+        """Writes the latest interaction and the current progress to the store (if any)."""
+        if self.store is None:
+            return
+        with timed(_PERSIST_TIMER):
+            current_concept_index, completed = self.get_progress()
+            self.store.record_answer(
+                self.student,
+                len(self.student.get_history()) - 1,
+                current_concept_index,
+                completed
+            )
+
+    # --- Prefetch ---
+
+    def schedule_prefetch(self, action):
+        """
+        If prefetch is on and action is a question, starts computing the
+        next action for both possible outcomes in the background.
+        Call after the turn's state changes (including persistence) are done.
+        """
+        if self.prefetch_executor is None:
+            return
+        self._drop_prefetch()
+        action_type, content, concept_id = action
+        if action_type != "question" or concept_id is None:
+            return
+        question_id = content.get('id')
+        position = self.concept_graph.positions.get(concept_id)
+        if question_id is None or position is None:
+            return
+        future = self.prefetch_executor.submit(
+            self._speculate, question_id, concept_id, position, self.student.tracer_state
+        )
+        self._prefetch = (question_id, future)
+
+    def pending_prefetch(self):
+        """The Future of the outstanding prefetch, or None (lets async callers wait without blocking)."""
+        return self._prefetch[1] if self._prefetch is not None else None
+
+    def apply_prefetched(self, interaction):
+        """
+        Uses the prefetched result for this interaction's outcome, if any:
+        stores the tracer state and returns the next action. Returns None
+        (a miss) when nothing usable was prefetched.
+        """
+        if self.prefetch_executor is None:
+            return None
+        outcomes = self._ready
+        self._ready = None
+        entry = None
+        if outcomes is not None and outcomes[0] == interaction['question_id']:
+            entry = outcomes[1].get(bool(interaction['is_correct']))
+        if entry is None:
+            _PREFETCH_MISS.inc()
+            return None
+
+        if getattr(self.tracer, 'outcome_only', False):
+            tracer_state, mastery = entry.tracer_state, entry.mastery
+        else:
+            # The tracer may use response time etc.: step for real and keep
+            # the prefetched action only if the mastery came out the same
+            with timed(_TRACER_TIMER):
+                tracer_state = self.tracer.step(self.student.tracer_state, interaction)
+                mastery = self.tracer.get_mastery(tracer_state)
+            if list(mastery) != list(entry.mastery):
+                _PREFETCH_MISS.inc()
+                self.student.tracer_state = tracer_state
+                self.student.set_state(mastery)
+                return self._get_next_action()
+
+        self.student.tracer_state = tracer_state
+        self.student.set_state(mastery)
+        if self.scheduler.current(mastery) != entry.position:
+            # Progress moved on since the prefetch started
+            _PREFETCH_MISS.inc()
+            return self._get_next_action()
+        _PREFETCH_HIT.inc()
+        ACTIONS.labels(entry.action[0]).inc()
+        return entry.action
+
+    def _speculate(self, question_id, concept_id, position, tracer_state):
+        """
+        Runs on the prefetch executor. Computes the next action for a correct
+        and for an incorrect answer to question_id without changing any
+        state. An outcome that would finish the concept is left as None;
+        a concept transition is not worth guessing.
+        """
+        view = self.student.with_answer(question_id)
+        history = self.student.get_history()
+        outcomes = {}
+        for is_correct in (True, False):
+            interaction = {"question_id": question_id, "is_correct": is_correct,
+                           "response_time_ms": None, "timestamp": None}
+            next_tracer_state = self.tracer.step(tracer_state, interaction)
+            mastery = self.tracer.get_mastery(next_tracer_state)
+            if self.scheduler.is_mastered(position, mastery):
+                outcomes[is_correct] = None
+                continue
+            action_type, content = self.policy.select_action(mastery, history, concept_id, student=view)
+            if action_type == "end_concept":
+                outcomes[is_correct] = None
+                continue
+            outcomes[is_correct] = _Prefetched(
+                next_tracer_state, mastery, position, (action_type, content, concept_id)
+            )
+        return outcomes
+
+    def _settle_prefetch(self):
+        """
+        Stops the outstanding prefetch (waiting for it if it is already
+        running) and keeps its result in self._ready for apply_prefetched.
+        """
+        self._ready = None
+        if self._prefetch is None:
+            return
+        question_id, future = self._prefetch
+        self._prefetch = None
+        if future.cancel():
+            return
+        try:
+            self._ready = (question_id, future.result())
+        except Exception as e:
+            logger.warning("Prefetch for Q%s failed: %s", question_id, e)
+
+    def _drop_prefetch(self):
+        """Discards any prefetched result (the next answer will not be for it)."""
+        if self._prefetch is None and self._ready is None:
+            return
+        self._settle_prefetch()
+        self._ready = None
+        _PREFETCH_DROPPED.inc()
+
+    def get_mastery_dict(self):
+        """Dict view of the student's mastery, for JSON responses."""
+        return self.tracer.mastery_as_dict(self.student.get_state())
+
+    def check_tracer_consistency(self):
+        """
+        Debug check: compares the incrementally traced state with a
+        full recompute over the student's history.
+        """
+        return self.tracer.check_consistency(
+            self.student.tracer_state,
+            self.student.get_history()
+        )
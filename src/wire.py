@@ -0,0 +1,195 @@
+"""
+JSON wire format of the tutor API, shared by app.py and asgi.py.
+
+Protocol 1 (default) keeps the original shapes:
+    {"action": {"type", "content"}, "current_concept_id"}
+Protocol 2 (?v=2) sends ids and deltas only:
+    {"action": {"type": "question", "id": "q7", "question": {"type", "text", "options"}},
+     "concept": "c2"}                     # only when the concept changed
+    {"action": {"type": "example", "id": "l3"}}   # body from the cached content bundle
+The concept list and lessons come once from /content (cached by the
+client under the content version that /start reports). After a content
+reload the next response carries the new "content_version", so the
+client fetches /content again before resolving ids against it.
+
+In both protocols questions never carry their answer.
+"""
+import json
+import threading
+
+PROTOCOL_DEFAULT = 1
+PROTOCOL_COMPACT = 2
+
+# Fields only the grader needs; never sent to a client
+PRIVATE_QUESTION_FIELDS = frozenset({"answer", "answers", "tolerance"})
+# Fields protocol 2 leaves out of a question body (the id and concept are sent on their own)
+_COMPACT_OMIT = PRIVATE_QUESTION_FIELDS | {"id", "concept_id", "difficulty"}
+
+MAX_LOOKAHEAD = 20
+MAX_BATCH_ANSWERS = 50
+
+
+def parse_protocol(value):
+    """Protocol number from a query parameter; anything unknown means protocol 1."""
+    try:
+        return PROTOCOL_COMPACT if int(value) >= PROTOCOL_COMPACT else PROTOCOL_DEFAULT
+    except (TypeError, ValueError):
+        return PROTOCOL_DEFAULT
+
+
+def public_question(question):
+    """The question as a client may see it (no answer)."""
+    return {key: value for key, value in question.items() if key not in PRIVATE_QUESTION_FIELDS}
+
+
+def compact_question(question):
+    return {key: value for key, value in question.items() if key not in _COMPACT_OMIT}
+
+
+def action_payload(action, index, protocol=PROTOCOL_DEFAULT, session=None):
+    """
+    The JSON body for a (action_type, content, current_concept_id) action.
+    For protocol 2, pass the session: the concept and the content version
+    are only sent when they differ from the last ones this session was sent.
+    """
+    action_type, content, current_concept_id = action
+    if protocol < PROTOCOL_COMPACT:
+        if action_type == "question":
+            content = public_question(content)
+        return {"action": {"type": action_type, "content": content}, "current_concept_id": current_concept_id}
+
+    if action_type == "question":
+        body = {"type": "question", "id": content.get('id'), "question": compact_question(content)}
+    elif action_type == "example":
+        lesson_id = index.lesson_id(content)
+        body = {"type": "example", "id": lesson_id}
+        if lesson_id is None:
+            body["content"] = content # Not addressable by id: send it inline
+    else:
+        body = {"type": action_type, "content": content}
+    payload = {"action": body}
+    if session is None or current_concept_id != session.sent_concept_id:
+        payload["concept"] = current_concept_id
+        if session is not None:
+            session.sent_concept_id = current_concept_id
+    if session is None or index.version != session.sent_content_version:
+        payload["content_version"] = index.version
+        if session is not None:
+            session.sent_content_version = index.version
+    return payload
+
+
+def start_payload(action, tutor, index, protocol=PROTOCOL_DEFAULT, session=None):
+    """Body of /start: the first action plus the content version (and, for protocol 1, the concepts)."""
+    if session is not None:
+        # A new session view: always send the concept and the content version
+        session.sent_concept_id = None
+        session.sent_content_version = None
+    payload = action_payload(action, index, protocol, session)
+    payload["content_version"] = index.version
+    if protocol < PROTOCOL_COMPACT:
+        payload["concepts"] = tutor.concepts_to_teach # Send sorted list
+    return payload
+
+
+def lookahead_payload(questions, concept_id, protocol=PROTOCOL_DEFAULT):
+    """Body of /lookahead: the next questions of the current concept, without answers."""
+    if protocol < PROTOCOL_COMPACT:
+        return {"questions": [public_question(q) for q in questions], "current_concept_id": concept_id}
+    return {"questions": [{"id": q.get('id'), "question": compact_question(q)} for q in questions],
+            "concept": concept_id}
+
+
+def valid_question_id(question_id):
+    """Question ids are strings (or integers); anything else in a request is a client error."""
+    return isinstance(question_id, (str, int)) and not isinstance(question_id, bool)
+
+
+def parse_answer(data):
+    """
+    Validates one answer {question_id, user_answer, response_time_ms}
+    (the /answer body, or an item of an /answers batch). Returns
+    (question_id, user_answer, response_time_ms), or raises ValueError
+    with a message for the client.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("An answer must be an object")
+    question_id = data.get('question_id')
+    user_answer = data.get('user_answer')
+    response_time_ms = data.get('response_time_ms')
+    if question_id is None or user_answer is None or response_time_ms is None:
+        raise ValueError("Missing 'question_id', 'user_answer', or 'response_time_ms'")
+    if not valid_question_id(question_id):
+        raise ValueError("'question_id' must be a string or an integer")
+    return question_id, user_answer, response_time_ms
+
+
+def parse_answers(data):
+    """
+    Validates a /answers body {"answers": [{question_id, user_answer, response_time_ms}, ...]}.
+    Returns the list of (question_id, user_answer, response_time_ms), or
+    raises ValueError with a message for the client.
+    """
+    answers = data.get('answers') if isinstance(data, dict) else None
+    if not isinstance(answers, list) or not answers:
+        raise ValueError("'answers' must be a non-empty list")
+    if len(answers) > MAX_BATCH_ANSWERS:
+        raise ValueError(f"At most {MAX_BATCH_ANSWERS} answers per batch")
+    return [parse_answer(item) for item in answers]
+
+
+def parse_count(value, default=5):
+    """Lookahead size from a query parameter, clamped to 1..MAX_LOOKAHEAD."""
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        count = default
+    return max(1, min(MAX_LOOKAHEAD, count))
+
+
+class ContentBundle:
+    """
+    The cacheable part of the content: ordered concepts and all lessons,
+    serialized once per content version.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cached = (None, None) # (index, encoded body)
+
+    def body(self, index):
+        cached_index, encoded = self._cached
+        if cached_index is index:
+            return encoded
+        with self._lock:
+            cached_index, encoded = self._cached
+            if cached_index is not index:
+                encoded = json.dumps({
+                    "version": index.version,
+                    "concepts": index.ordered_concepts,
+                    "lessons": dict(index.lessons_by_id.items()),
+                }, ensure_ascii=False).encode('utf-8')
+                self._cached = (index, encoded)
+        return encoded
+
+    @staticmethod
+    def headers(index, requested_version=None):
+        """
+        ETag and Cache-Control for the bundle. A request that names the
+        current version (/content?version=...) may be cached for good.
+        """
+        if requested_version and requested_version == index.version:
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            cache_control = "no-cache"
+        return [("ETag", f'"{index.version}"'), ("Cache-Control", cache_control)]
+
+    @staticmethod
+    def not_modified(index, if_none_match):
+        """True if the client's If-None-Match already names this version."""
+        if not if_none_match or index.version is None:
+            return False
+        tags = [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]
+        return index.version in tags or "*" in tags
+
+
+CONTENT_BUNDLE = ContentBundle()
@@ -0,0 +1,71 @@
+import json
+import os
+import random
+
+import pytest
+
+from src.content import ContentManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, 'data')
+
+
+def load_content(data_dir):
+    """A ContentManager over knowledge.json, question.json and lesson.json in data_dir."""
+    return ContentManager(
+        concepts_file=os.path.join(data_dir, 'knowledge.json'),
+        questions_file=os.path.join(data_dir, 'question.json'),
+        lessons_file=os.path.join(data_dir, 'lesson.json')
+    )
+
+
+def write_tied_content(data_dir, num_concepts=4, questions_per_concept=12, seed=0):
+    """
+    A small bank in shuffled file order where many questions share a
+    difficulty, so tie-breaking decides the picks. c3 has no lessons.
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    concepts = [{"id": f"c{i}", "name": f"Concept {i}"} for i in range(1, num_concepts + 1)]
+    prerequisites = [{"from": f"c{i}", "to": f"c{i + 1}"} for i in range(1, num_concepts)]
+    questions = []
+    for i in range(1, num_concepts + 1):
+        for _ in range(questions_per_concept):
+            number = len(questions) + 1
+            questions.append({
+                "id": f"q{number}",
+                "concept_id": f"c{i}",
+                "difficulty": rng.choice([0.2, 0.5, 0.5, 0.8]),
+                "type": "text",
+                "text": f"Question {number}",
+                "answer": f"answer {number}",
+            })
+    rng.shuffle(questions)
+    lessons = {
+        f"l{i}": {"concept_id": f"c{i}", "title": f"Lesson {i}", "content": "..."}
+        for i in range(1, num_concepts + 1) if i != 3
+    }
+    for name, payload in (("knowledge.json", {"concepts": concepts, "prerequisites": prerequisites}),
+                          ("question.json", questions), ("lesson.json", lessons)):
+        with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+    return data_dir
+
+
+@pytest.fixture
+def content_manager():
+    """The content shipped in data/."""
+    return load_content(DATA_DIR)
+
+
+@pytest.fixture
+def tied_content(tmp_path):
+    return load_content(write_tied_content(str(tmp_path)))
+
+
+@pytest.fixture(params=["data", "tied"])
+def any_content(request, tmp_path):
+    """Each test runs on data/ and on the tied bank."""
+    if request.param == "data":
+        return load_content(DATA_DIR)
+    return load_content(write_tied_content(str(tmp_path)))
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from src.batching import BatchingTracer
+
+
+class CountingTracer:
+    """Adds the interaction's value to the state; records every step_batch call."""
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.name = "counting"
+
+    def step(self, state, interaction):
+        return state + interaction
+
+    def step_batch(self, states, interactions):
+        self.batches.append(len(states))
+        if self.fail_on is not None and self.fail_on in interactions:
+            raise ValueError("bad interaction")
+        return [state + interaction for state, interaction in zip(states, interactions)]
+
+
+def run_concurrently(batcher, count):
+    """count threads step at once; returns their results by thread number."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(number):
+        barrier.wait()
+        results[number] = batcher.step(number * 10, number)
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_steps_are_batched():
+    tracer = CountingTracer()
+    batcher = BatchingTracer(tracer, max_batch_size=8, max_wait_ms=200)
+    try:
+        results = run_concurrently(batcher, 8)
+    finally:
+        batcher.close()
+    assert results == [number * 11 for number in range(8)]
+    assert sum(tracer.batches) == 8
+    assert len(tracer.batches) < 8 # At least some steps shared a batch
+    assert max(tracer.batches) <= 8
+    stats = batcher.stats()
+    assert stats["items"] == 8 and stats["batches"] == len(tracer.batches)
+
+
+def test_batch_size_is_capped():
+    tracer = CountingTracer()
+    batcher = BatchingTracer(tracer, max_batch_size=3, max_wait_ms=200)
+    try:
+        futures = [batcher.submit(0, number) for number in range(7)]
+        assert [future.result(timeout=5) for future in futures] == list(range(7))
+    finally:
+        batcher.close()
+    assert max(tracer.batches) <= 3
+
+
+def test_errors_reach_every_caller_of_the_batch():
+    tracer = CountingTracer(fail_on=2)
+    batcher = BatchingTracer(tracer, max_batch_size=4, max_wait_ms=200)
+    try:
+        futures = [batcher.submit(0, number) for number in range(4)]
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=5)
+        # The worker keeps going after a failed batch
+        assert batcher.step(1, 1) == 2
+    finally:
+        batcher.close()
+
+
+def test_close_runs_leftovers_and_then_steps_directly():
+    tracer = CountingTracer()
+    batcher = BatchingTracer(tracer, max_batch_size=4, max_wait_ms=1)
+    future = batcher.submit(1, 1)
+    batcher.close()
+    assert future.result(timeout=5) == 2
+    assert batcher.step(2, 3) == 5 # Unbatched after close
+    with pytest.raises(RuntimeError):
+        batcher.submit(0, 0).result(timeout=5)
+
+
+def test_other_attributes_come_from_the_tracer():
+    batcher = BatchingTracer(CountingTracer())
+    try:
+        assert batcher.name == "counting"
+    finally:
+        batcher.close()
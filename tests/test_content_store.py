@@ -0,0 +1,144 @@
+import json
+import os
+
+import pytest
+
+from src.content import BinaryContentIndex, ContentManager
+from src.content_store import ContentFile, compile_content
+from tests.conftest import DATA_DIR, load_content, write_tied_content
+
+
+def compile_from(content_manager, out_path):
+    return compile_content(content_manager.concepts, content_manager.questions, content_manager.lessons, out_path)
+
+
+@pytest.fixture(params=["data", "tied"])
+def json_and_compiled(request, tmp_path):
+    """(ContentManager over the JSON files, ContentManager over their compiled file)."""
+    data_dir = DATA_DIR if request.param == "data" else write_tied_content(str(tmp_path))
+    json_content = load_content(data_dir)
+    out_path = str(tmp_path / "content.bin")
+    compile_from(json_content, out_path)
+    return json_content, ContentManager(compiled_file=out_path)
+
+
+def test_compiled_index_matches_json_index(json_and_compiled):
+    json_content, compiled = json_and_compiled
+    expected, actual = json_content.index, compiled.index
+    assert isinstance(actual, BinaryContentIndex)
+    assert actual.concept_ids == expected.concept_ids
+    assert actual.num_questions == expected.num_questions
+    assert actual.num_lessons == expected.num_lessons
+    for concept_id in expected.concept_ids:
+        assert list(actual.get_questions_for_concept(concept_id)) == expected.get_questions_for_concept(concept_id)
+        assert list(actual.get_lessons_for_concept(concept_id)) == expected.get_lessons_for_concept(concept_id)
+    for concept_id, concept_questions in actual.questions_by_concept.items():
+        assert list(concept_questions.difficulties) == pytest.approx(
+            [q.get('difficulty', 0) for q in expected.get_questions_for_concept(concept_id)])
+    for question in json_content.questions:
+        assert actual.questions_by_id[question['id']] == expected.questions_by_id[question['id']]
+    for lesson_id, lesson in json_content.lessons.items():
+        assert actual.lessons_by_id[lesson_id] == lesson
+    assert sorted(actual.lessons_by_id) == sorted(json_content.lessons)
+
+
+def test_compiled_lookup_misses(json_and_compiled):
+    _, compiled = json_and_compiled
+    questions = compiled.index.questions_by_id
+    assert questions.get("no-such-id") is None
+    assert questions.get(["unhashable"]) is None
+    assert "no-such-id" not in questions
+    with pytest.raises(KeyError):
+        questions["no-such-id"]
+
+
+def test_ids_keep_their_json_type(tmp_path):
+    questions = [
+        {"id": 5, "concept_id": "c1", "difficulty": 0.1, "answer": "int"},
+        {"id": "5", "concept_id": "c1", "difficulty": 0.2, "answer": "str"},
+        {"id": 5, "concept_id": "c1", "difficulty": 0.3, "answer": "duplicate"},
+    ]
+    out_path = str(tmp_path / "content.bin")
+    compile_content({"concepts": [{"id": "c1"}]}, questions, {}, out_path)
+    index = BinaryContentIndex(ContentFile(out_path))
+    assert index.questions_by_id.get(5)['answer'] == "int" # First definition wins
+    assert index.questions_by_id.get("5")['answer'] == "str"
+    assert len(index.questions_by_id) == 2
+
+
+def test_lookup_cache_keeps_equal_keys_apart(tmp_path):
+    questions = [
+        {"id": 1, "concept_id": "c1", "answer": "int"},
+        {"id": True, "concept_id": "c1", "answer": "bool"},
+    ]
+    out_path = str(tmp_path / "content.bin")
+    compile_content({"concepts": [{"id": "c1"}]}, questions, {}, out_path)
+    records = BinaryContentIndex(ContentFile(out_path)).questions_by_id
+    assert records.get(1)['answer'] == "int" # Cached first; 1 == 1.0 == True as dict keys
+    assert records.get(True)['answer'] == "bool"
+    assert records.get(1.0) is None
+
+
+def test_version_follows_the_content(tmp_path):
+    content = load_content(DATA_DIR)
+    first = compile_from(content, str(tmp_path / "a.bin"))
+    assert compile_from(content, str(tmp_path / "b.bin")) == first
+    content.questions[0]['difficulty'] = 0.99
+    assert compile_from(content, str(tmp_path / "c.bin")) != first
+
+
+def test_not_a_content_file(tmp_path):
+    path = tmp_path / "bogus.bin"
+    path.write_bytes(b"x" * 256)
+    with pytest.raises(ValueError):
+        ContentFile(str(path))
+
+
+def rewrite_question_file(data_dir, change):
+    path = os.path.join(data_dir, 'question.json')
+    with open(path, encoding='utf-8') as f:
+        questions = json.load(f)
+    change(questions)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(questions, f)
+    os.replace(path + '.tmp', path) # New inode, as an editor or deploy would
+
+
+def test_json_reload_swaps_the_index(tmp_path):
+    data_dir = write_tied_content(str(tmp_path))
+    content = load_content(data_dir)
+    old_index = content.index
+    assert not content.reload_if_changed()
+
+    rewrite_question_file(data_dir, lambda questions: questions.append(
+        {"id": "new", "concept_id": "c1", "difficulty": 1.0, "answer": "x"}))
+    assert content.reload_if_changed()
+    assert content.index is not old_index
+    assert content.index.version != old_index.version
+    assert content.index.get_questions_for_concept("c1")[0]['id'] == "new"
+    assert "new" not in old_index.questions_by_id # Requests already running keep their version
+
+
+def test_compiled_reload_swaps_the_index(tmp_path):
+    data_dir = write_tied_content(str(tmp_path / "data"))
+    out_path = str(tmp_path / "content.bin")
+    compile_from(load_content(data_dir), out_path)
+    content = ContentManager(compiled_file=out_path)
+    old_index = content.index
+
+    rewrite_question_file(data_dir, lambda questions: questions.pop())
+    compile_from(load_content(data_dir), out_path)
+    assert content.reload_if_changed()
+    assert content.index.num_questions == old_index.num_questions - 1
+    assert old_index.questions_by_id.get(old_index.question_records[0]['id']) is not None
+
+
+def test_failed_reload_keeps_the_current_version(tmp_path):
+    out_path = str(tmp_path / "content.bin")
+    compile_from(load_content(DATA_DIR), out_path)
+    content = ContentManager(compiled_file=out_path)
+    old_index = content.index
+    with open(out_path, 'wb') as f:
+        f.write(b"not a content file")
+    assert not content.reload()
+    assert content.index is old_index
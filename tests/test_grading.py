@@ -0,0 +1,82 @@
+import pytest
+
+from src.grading import Grader, normalize, parse_number, register_matcher, MATCHERS
+
+
+def test_normalize_nfc_and_invisible_characters():
+    # "e" + combining acute, and the precomposed "\u00e9"
+    assert normalize("Cafe\u0301") == normalize("Caf\u00e9") == "caf\u00e9"
+    # ZWSP, ZWNJ, ZWJ and BOM between Khmer words
+    assert normalize("\u200b\u179f\u17bd\u179f\u17d2\u178f\u17b8\u200c  \u1796\u17b7\u200d\ufeff") == \
+        "\u179f\u17bd\u179f\u17d2\u178f\u17b8 \u1796\u17b7"
+    assert normalize("  A \t B\n") == "a b"
+    assert normalize(42) == "42"
+    long_text = "x\u200b" * 100
+    assert normalize(long_text) == "x" * 100 # Past the cached length
+
+
+def test_normalize_khmer_inherent_vowels():
+    # KHMER VOWEL INHERENT AQ/AA are invisible and are dropped like zero-width characters
+    assert normalize("\u1794\u17b4\u17b6\u1791") == normalize("\u1794\u17b6\u1791\u17b5") == "\u1794\u17b6\u1791"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("3.5", 3.5), ("-2", -2.0), ("1,000", 1000.0), ("1 000", 1000.0), ("៣.៥", 3.5), ("១២", 12.0),
+    ("-1,234,567.5", -1234567.5), ("១,០០០", 1000.0),
+    ("1,5", None), ("1,50", None), ("12,34,567", None), ("1,000,", None), (",5", None),
+    ("abc", None), ("", None), ("nan", None), ("inf", None),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
+
+
+def grader(*questions):
+    return Grader({question['id']: question for question in questions}).compile_all()
+
+
+def test_text_answers():
+    graded = grader({"id": "q1", "type": "text", "answer": "Phnom Penh", "answers": ["ភ្នំពេញ"]})
+    assert graded.grade("q1", "  phnom   PENH. ")
+    assert graded.grade("q1", "ភ្នំ\u200bពេញ។")
+    assert not graded.grade("q1", "Siem Reap")
+    assert not graded.grade("q1", None)
+    assert graded.grade("missing", "x") is None
+
+
+def test_numeric_answers():
+    graded = grader({"id": "q1", "answer": 3.5, "tolerance": 0.1},
+                    {"id": "q2", "answer": "12"},
+                    {"id": "q3", "answer": 2, "tolerance": "bogus"})
+    assert graded.grade_many([("q1", "3.45"), ("q1", "៣.៥"), ("q1", "3.7"),
+                              ("q2", "១២"), ("q2", "12.0"), ("q3", "2")]) == [True, True, False, True, True, True]
+
+
+@pytest.mark.parametrize("answer, typed, expected", [
+    ("yes", "Yes", True), ("yes", "បាទ", True), ("yes", "ចាស", True),
+    ("yes", "បាទ ចាស", True), ("yes", "បាទ\u200bចាស", True),
+    ("no", "ទេ", True), ("no", "អត់", True), ("no", "មិន\u200bមែន", True),
+    (True, "y", True), (False, "true", False), ("ទេ", "no", True), ("ទេ", "មែន", False),
+])
+def test_yes_no_answers(answer, typed, expected):
+    assert grader({"id": "q", "type": "yes_no", "answer": answer}).grade("q", typed) is expected
+
+
+def test_mcq_answers():
+    graded = grader({"id": "q1", "type": "mcq", "options": ["Red", "Blue"], "answer": 1},
+                    {"id": "q2", "type": "mcq", "options": ["Red", "Blue"], "answer": "Red"},
+                    {"id": "q3", "type": "mcq", "options": ["Red", "Blue"]})
+    assert graded.grade("q1", "blue") and not graded.grade("q1", "Red")
+    assert graded.grade("q2", "RED")
+    assert graded.grade("q3", "Red") is False
+
+
+def test_register_matcher(monkeypatch):
+    monkeypatch.setitem(MATCHERS, "length", None)
+    register_matcher("length", lambda question: lambda normalized: len(normalized) == question['answer'])
+    assert grader({"id": "q", "type": "length", "answer": 3}).grade("q", "abc")
+
+
+def test_lazy_matchers():
+    graded = Grader({"q1": {"id": "q1", "answer": "x"}})
+    assert graded.matcher("q2") is None
+    assert graded.matcher("q1") is graded.matcher("q1")
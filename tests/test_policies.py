@@ -0,0 +1,143 @@
+import random
+from array import array
+
+import pytest
+
+from src import policies
+from src.policies import MasteryTargetPolicy, SimpleDifficultyPolicy
+from src.student import Student
+
+
+def baseline_select_question(question_bank, student_history, concept_id):
+    """SimpleDifficultyPolicy._select_question as first written: the reference for its picks."""
+    questions_for_concept = [q for q in question_bank if q.get('concept_id') == concept_id]
+    seen_question_ids = set(interaction['question_id'] for interaction in student_history)
+    available_questions = [q for q in questions_for_concept if q.get('id') not in seen_question_ids]
+    if not available_questions:
+        return None
+    return max(available_questions, key=lambda q: q.get('difficulty', 0))
+
+
+def baseline_action_type(content_manager, question, concept_id):
+    if question is not None:
+        return "question"
+    if content_manager.index.get_lessons_for_concept(concept_id):
+        return "example"
+    return "end_concept"
+
+
+def make_policy(content_manager, policy_class=SimpleDifficultyPolicy, **kwargs):
+    return policy_class(
+        question_bank=content_manager.questions or [],
+        example_bank=content_manager.lessons or {},
+        content_manager=content_manager,
+        **kwargs
+    )
+
+
+@pytest.mark.parametrize("interleaved", [False, True])
+@pytest.mark.parametrize("incremental", [True, False])
+def test_simple_policy_matches_baseline(any_content, incremental, interleaved):
+    """
+    A whole session: each concept in teaching order until it runs dry, or
+    (interleaved) a random concept each turn, so several cursors are in use.
+    """
+    policy = make_policy(any_content)
+    student = Student("s1")
+    rng = random.Random(1)
+    remaining = [c.get('id') for c in any_content.index.ordered_concepts]
+    asked = []
+    while remaining:
+        concept_id = rng.choice(remaining) if interleaved else remaining[0]
+        history = student.get_history()
+        action_type, content = policy.select_action(
+            student.get_state(), history, concept_id, student=student if incremental else None)
+        expected = baseline_select_question(any_content.questions, history, concept_id)
+        assert action_type == baseline_action_type(any_content, expected, concept_id)
+        if action_type == "question":
+            assert content is expected
+            student.update_history(content['id'], rng.random() < 0.6, 1000)
+            asked.append(content['id'])
+        else:
+            remaining.remove(concept_id)
+
+    # Every question was asked exactly once
+    assert sorted(asked) == sorted(q['id'] for q in any_content.questions)
+
+
+def test_lookahead_view_leaves_student_alone(tied_content):
+    policy = make_policy(tied_content)
+    student = Student("s1")
+    student.update_history("q1", True, 1000)
+    seen_before, cursors_before = set(student.seen_question_ids), dict(student.question_cursors)
+    planned = []
+    for _ in range(3):
+        _, content = policy.select_action(student.get_state(), student.get_history(), "c1",
+                                          student=student.with_answers(planned))
+        planned.append(content['id'])
+    assert len(set(planned)) == 3
+    assert student.seen_question_ids == seen_before
+    assert student.question_cursors == cursors_before
+
+
+def brute_force_best(policy, student_state, seen, concept_id):
+    """The best unseen question by the policy's own scores, by scanning all of them."""
+    _, concept_rows, concept_slices, difficulty = policy._arrays
+    start, end = concept_slices.get(concept_id, (0, 0))
+    if start == end:
+        return None
+    position = policy.index.concept_positions.get(concept_id)
+    scores = policy._score([policy._mastery_of(student_state, position)], difficulty[start:end])[0]
+    unseen = [offset for offset, q in enumerate(concept_rows[concept_id]) if q.get('id') not in seen]
+    if not unseen:
+        return None
+    return concept_rows[concept_id][min(unseen, key=lambda offset: (-scores[offset], offset))]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def numpy_mode(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(policies, "np", None)
+        monkeypatch.setattr(policies, "_numpy_checked", True)
+    return request.param
+
+
+@pytest.mark.parametrize("objective", ["target", "information"])
+@pytest.mark.parametrize("top_k", [1, 3, 8])
+def test_mastery_policy_picks_best_unseen(tied_content, numpy_mode, objective, top_k):
+    policy = make_policy(tied_content, MasteryTargetPolicy, objective=objective, top_k=top_k)
+    rng = random.Random(2)
+    concept_ids = list(tied_content.index.concept_ids)
+    for _ in range(5):
+        student = Student("s1")
+        student.set_state(array('f', [rng.random() for _ in concept_ids]))
+        for concept_id in concept_ids:
+            while True:
+                expected = brute_force_best(policy, student.get_state(), student.seen_question_ids, concept_id)
+                action_type, content = policy.select_action(
+                    student.get_state(), student.get_history(), concept_id, student=student)
+                if expected is None:
+                    assert action_type != "question"
+                    break
+                assert content is expected
+                student.update_history(content['id'], rng.random() < 0.5, 1000)
+
+
+def test_mastery_policy_batch_matches_single(tied_content):
+    policy = make_policy(tied_content, MasteryTargetPolicy)
+    rng = random.Random(3)
+    concept_ids = list(tied_content.index.concept_ids)
+    students = []
+    for number in range(12):
+        student = Student(f"s{number}")
+        student.set_state(array('f', [rng.random() for _ in concept_ids]))
+        for question in rng.sample(tied_content.questions, 10):
+            student.update_history(question['id'], True, 1000)
+        students.append(student)
+    batch_concepts = [rng.choice(concept_ids) for _ in students]
+
+    batch = policy.select_actions([s.get_state() for s in students], [s.get_history() for s in students],
+                                  batch_concepts, students)
+    single = [policy.select_action(s.get_state(), s.get_history(), concept_id, student=s)
+              for s, concept_id in zip(students, batch_concepts)]
+    assert [(t, c.get('id')) for t, c in batch] == [(t, c.get('id')) for t, c in single]
@@ -0,0 +1,322 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from src.routing import HashRing, Router, Upstream
+from src.sessions import EPOCH_HEADER, SessionManager
+
+COOKIE = "tutor_session"
+
+
+def keys(count):
+    return [f"student-{number}" for number in range(count)]
+
+
+def test_ring_spreads_keys_over_nodes():
+    ring = HashRing(["a", "b", "c"])
+    owners = Counter(ring.node_for(key) for key in keys(3000))
+    assert set(owners) == {"a", "b", "c"}
+    assert min(owners.values()) > 700
+    assert HashRing().node_for("x") is None
+
+
+def test_ring_moves_only_the_keys_of_a_removed_node():
+    ring = HashRing(["a", "b", "c"])
+    before = {key: ring.node_for(key) for key in keys(1000)}
+    assert ring.remove("b") and not ring.remove("b")
+    after = {key: ring.node_for(key) for key in keys(1000)}
+    for key, owner in before.items():
+        if owner != "b":
+            assert after[key] == owner
+        else:
+            assert after[key] in ("a", "c")
+    ring.add("b")
+    assert {key: ring.node_for(key) for key in keys(1000)} == before
+
+
+def test_epoch_counts_membership_changes():
+    ring = HashRing(["a", "b"])
+    assert ring.epoch == 2
+    assert not ring.add("a")
+    assert ring.epoch == 2
+    ring.remove("b")
+    assert ring.epoch == 3 and ring.nodes == ["a"] and "b" not in ring
+
+
+def test_owner_epoch_only_changes_when_the_key_moves():
+    ring = HashRing(["a", "b"])
+    assert ring.epoch == 2
+    initial = {key: ring.owner_epoch(key) for key in keys(200)}
+    assert set(initial.values()) <= {1, 2}
+    ring.add("c")
+    for key in keys(200):
+        if ring.node_for(key) == "c":
+            assert ring.owner_epoch(key) == 3
+        else:
+            assert ring.owner_epoch(key) == initial[key]
+
+
+# --- Proxy ---
+
+class FakeWorker:
+    """
+    An HTTP/1.1 upstream on localhost. respond(head, body) returns the raw
+    response bytes for a request, or None to close the connection without
+    answering.
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.connections = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                headers = dict(line.split(": ", 1) for line in head.decode('latin-1').split("\r\n")[1:] if line)
+                body = await reader.readexactly(int(headers.get("Content-Length", 0)))
+                self.requests.append((head.decode('latin-1'), headers, body))
+                response = self.respond(head, body)
+                if response is None:
+                    return
+                writer.write(response)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def close(self):
+        self.server.close()
+
+
+def ok(body=b'{"ok": true}'):
+    return (f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body
+
+
+async def start_router(upstreams, **kwargs):
+    router = Router(upstreams, cookie_name=COOKIE, **kwargs)
+    for upstream in upstreams:
+        router.mark_up(upstream.name)
+    server = await asyncio.start_server(router.handle_client, "127.0.0.1", 0)
+    return router, server, server.sockets[0].getsockname()[1]
+
+
+async def request(reader, writer, method="GET", target="/api/next", headers=(), body=b""):
+    lines = [f"{method} {target} HTTP/1.1", "Host: test"] + list(headers)
+    if body:
+        lines.append(f"Content-Length: {len(body)}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1')
+    status_line, *header_lines = head.split("\r\n")
+    response_headers = dict(line.split(": ", 1) for line in header_lines if line)
+    response_body = await reader.readexactly(int(response_headers.get("Content-Length", 0)))
+    return int(status_line.split(" ")[1]), response_headers, response_body
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+
+def test_keep_alive_on_both_sides():
+    async def scenario():
+        worker = FakeWorker(lambda head, body: ok(body or b"{}"))
+        router, server, port = await start_router([Upstream("w", await worker.start())])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        session_id = SessionManager.new_session_id()
+        cookie = f"Cookie: {COOKIE}={session_id}"
+        for number in range(3):
+            status, headers, body = await request(reader, writer, "POST", "/api/answer", [cookie],
+                                                  f'{{"n": {number}}}'.encode())
+            assert status == 200 and body == f'{{"n": {number}}}'.encode()
+            assert headers["Connection"] == "keep-alive"
+        writer.close()
+        server.close()
+        worker.close()
+        return worker, router
+    worker, router = run(scenario())
+    assert worker.connections == 1 # One pooled upstream connection for all three
+    for _, headers, _ in worker.requests:
+        assert headers[EPOCH_HEADER] == "1"
+        assert headers["X-Forwarded-For"] == "127.0.0.1"
+    assert router.counters["requests"] == 3
+
+
+def test_new_session_id_is_assigned_before_forwarding():
+    async def scenario():
+        worker = FakeWorker(lambda head, body: ok())
+        router, server, port = await start_router([Upstream("w", await worker.start())])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await request(reader, writer, headers=["Cookie: theme=dark"])
+        writer.close()
+        server.close()
+        worker.close()
+        return worker
+    worker = run(scenario())
+    cookies = dict(part.split("=", 1) for part in worker.requests[0][1]["Cookie"].split("; "))
+    assert cookies["theme"] == "dark"
+    assert SessionManager.is_valid_session_id(cookies[COOKIE])
+
+
+def test_chunked_response_is_sent_with_a_length():
+    def respond(head, body):
+        return (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nX-Kept: yes\r\n\r\n"
+                b"5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\nX-Trailer: t\r\n\r\n")
+
+    async def scenario():
+        worker = FakeWorker(respond)
+        _, server, port = await start_router([Upstream("w", await worker.start())])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        first = await request(reader, writer)
+        second = await request(reader, writer) # The upstream connection is still usable
+        writer.close()
+        server.close()
+        worker.close()
+        return worker, first, second
+    worker, (status, headers, body), second = run(scenario())
+    assert status == 200 and body == b"hello, world"
+    assert headers["Content-Length"] == "12" and headers["X-Kept"] == "yes"
+    assert "Transfer-Encoding" not in headers
+    assert second[2] == b"hello, world"
+    assert worker.connections == 1
+
+
+def test_chunked_request_is_refused():
+    async def scenario():
+        worker = FakeWorker(lambda head, body: ok())
+        _, server, port = await start_router([Upstream("w", await worker.start())])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        status, headers, _ = await request(reader, writer, "POST", headers=["Transfer-Encoding: chunked"])
+        closed = await reader.read() == b""
+        writer.close()
+        server.close()
+        worker.close()
+        return worker, status, headers, closed
+    worker, status, headers, closed = run(scenario())
+    assert status == 411 and headers["Connection"] == "close" and closed
+    assert not worker.requests
+
+
+def test_refused_worker_leaves_the_ring_and_requests_move():
+    async def scenario():
+        worker = FakeWorker(lambda head, body: ok(b'"alive"'))
+        dead = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+        dead_address = f"127.0.0.1:{dead.sockets[0].getsockname()[1]}"
+        dead.close()
+        await dead.wait_closed()
+        router, server, port = await start_router([Upstream("alive", await worker.start()),
+                                                   Upstream("dead", dead_address)])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        statuses = []
+        for key in keys(20):
+            session_id = SessionManager.new_session_id()
+            status, _, body = await request(reader, writer, headers=[f"Cookie: {COOKIE}={session_id}"])
+            statuses.append((status, body))
+        writer.close()
+        server.close()
+        worker.close()
+        return router, statuses
+    router, statuses = run(scenario())
+    assert statuses == [(200, b'"alive"')] * 20
+    assert router.ring.nodes == ["alive"]
+    assert router.status()["workers_down"] == ["dead"]
+
+
+def test_no_worker_is_unavailable():
+    async def scenario():
+        router, server, port = await start_router([], retry_after_seconds=3)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        response = await request(reader, writer)
+        writer.close()
+        server.close()
+        return router, response
+    router, (status, headers, _) = run(scenario())
+    assert status == 503 and headers["Retry-After"] == "3"
+    assert router.counters["unavailable"] == 1
+
+
+def test_worker_failing_mid_request_is_a_bad_gateway():
+    def respond(head, body):
+        if b"/crash" in head:
+            return None # Closes without answering
+        if b"/partial" in head:
+            return b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\nshort"
+        return ok()
+
+    async def scenario():
+        worker = FakeWorker(respond)
+        router, server, port = await start_router([Upstream("w", await worker.start())], response_timeout=1)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        crash = await request(reader, writer, "POST", "/crash", body=b"{}")
+        partial = await request(reader, writer, "POST", "/partial", body=b"{}")
+        after = await request(reader, writer)
+        writer.close()
+        server.close()
+        worker.close()
+        return router, worker, crash, partial, after
+    router, worker, crash, partial, after = run(scenario())
+    assert crash[0] == 502 and partial[0] == 502
+    assert after[0] == 200
+    assert router.counters["bad_gateway"] == 2
+    assert [head.split(" ")[1] for head, _, _ in worker.requests] == ["/crash", "/partial", "/api/next"]
+    assert router.ring.nodes == ["w"] # A failed request does not take the worker off the ring
+
+
+def test_stale_pooled_connection_is_retried():
+    def respond(head, body):
+        # The second request arrives on the pooled connection, which the
+        # worker then drops without answering (as an idle timeout would)
+        return None if len(worker.requests) == 2 else ok()
+    worker = FakeWorker(respond)
+
+    async def scenario():
+        router, server, port = await start_router([Upstream("w", await worker.start())])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        first = await request(reader, writer)
+        second = await request(reader, writer)
+        writer.close()
+        server.close()
+        worker.close()
+        return router, first, second
+    router, first, second = run(scenario())
+    assert first[0] == second[0] == 200
+    assert worker.connections == 2
+    assert router.counters["retries"] == 1 and router.counters["bad_gateway"] == 0
+
+
+def test_router_status_is_answered_locally():
+    async def scenario():
+        worker = FakeWorker(lambda head, body: ok())
+        _, server, port = await start_router([Upstream("w", await worker.start())])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        response = await request(reader, writer, target="/router/status")
+        writer.close()
+        server.close()
+        worker.close()
+        return worker, response
+    worker, (status, _, body) = run(scenario())
+    assert status == 200 and b'"workers_up": ["w"]' in body
+    assert not worker.requests
+
+
+@pytest.mark.parametrize("head", [b"GARBAGE\r\n\r\n", b"GET / HTTP/1.1\r\nno colon\r\n\r\n"])
+def test_malformed_request(head):
+    async def scenario():
+        _, server, port = await start_router([])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(head)
+        response = await reader.read()
+        writer.close()
+        server.close()
+        return response
+    assert run(scenario()).startswith(b"HTTP/1.1 400 ")
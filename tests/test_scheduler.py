@@ -0,0 +1,92 @@
+import pytest
+
+from src.scheduler import ConceptGraph, ConceptScheduler
+
+
+def concepts(*ids):
+    return [{"id": concept_id} for concept_id in ids]
+
+
+def edges(*pairs):
+    return [{"from": source, "to": target} for source, target in pairs]
+
+
+def test_topological_order_breaks_ties_by_id_number():
+    graph = ConceptGraph(concepts("c10", "c2", "c1", "c3"), edges(("c3", "c1")))
+    assert graph.concept_ids == ["c2", "c3", "c1", "c10"]
+    assert list(graph.prerequisites_of(graph.positions["c1"])) == [graph.positions["c3"]]
+    assert list(graph.dependents_of(graph.positions["c3"])) == [graph.positions["c1"]]
+    assert list(graph.roots) == [graph.positions[c] for c in ("c2", "c3", "c10")]
+
+
+def test_duplicate_and_unknown_entries_are_skipped():
+    graph = ConceptGraph(concepts("c1", "c2", "c1", None),
+                         edges(("c1", "c2"), ("c1", "c2"), ("c1", "c9")))
+    assert graph.concept_ids == ["c1", "c2"]
+    assert graph.num_edges == 1
+
+
+@pytest.mark.parametrize("cycle_edges, expected", [
+    ([("c1", "c2"), ("c2", "c1")], "c1 -> c2 -> c1"),
+    ([("c1", "c2"), ("c2", "c3"), ("c3", "c1")], "c1 -> c2 -> c3 -> c1"),
+    ([("c2", "c2")], "c2 -> c2"),
+])
+def test_cycle_is_reported(cycle_edges, expected):
+    with pytest.raises(ValueError) as error:
+        ConceptGraph(concepts("c1", "c2", "c3", "c4"), edges(("c4", "c1"), *cycle_edges))
+    assert expected in str(error.value)
+
+
+def test_cycle_behind_an_acyclic_prefix():
+    with pytest.raises(ValueError, match="c3 -> c4 -> c3"):
+        ConceptGraph(concepts("c1", "c2", "c3", "c4", "c5"),
+                     edges(("c1", "c2"), ("c2", "c3"), ("c3", "c4"), ("c4", "c3"), ("c4", "c5")))
+
+
+def diamond():
+    # c1 -> c2, c1 -> c3, (c2, c3) -> c4; c5 is independent
+    return ConceptGraph(concepts("c1", "c2", "c3", "c4", "c5"),
+                        edges(("c1", "c2"), ("c1", "c3"), ("c2", "c4"), ("c3", "c4")))
+
+
+def test_scheduler_unlocks_after_all_prerequisites():
+    graph = diamond()
+    scheduler = ConceptScheduler(graph)
+    order = []
+    while True:
+        position = scheduler.current()
+        if position is None:
+            break
+        order.append(graph.concept_ids[position])
+        scheduler.complete(position)
+    assert order == ["c1", "c2", "c3", "c4", "c5"]
+
+
+def test_dependent_waits_for_its_last_prerequisite():
+    graph = diamond()
+    scheduler = ConceptScheduler(graph)
+    scheduler.complete(graph.positions["c1"])
+    scheduler.complete(graph.positions["c2"])
+    scheduler.complete(graph.positions["c5"])
+    assert graph.concept_ids[scheduler.current()] == "c3"
+
+
+def test_completed_bytes_round_trip():
+    graph = diamond()
+    scheduler = ConceptScheduler(graph)
+    for concept_id in ("c1", "c3", "c5"):
+        scheduler.complete(graph.positions[concept_id])
+    restored = ConceptScheduler(graph)
+    restored.restore(scheduler.completed_bytes())
+    assert restored.completed_bytes() == scheduler.completed_bytes()
+    assert restored.num_completed == 3
+    assert graph.concept_ids[restored.current()] == "c2"
+
+
+def test_mastered_concepts_are_skipped():
+    graph = diamond()
+    scheduler = ConceptScheduler(graph, mastery_threshold=0.8)
+    mastery = [0.9, 0.1, 0.95, 0.1, 0.1] # By position: c1, c2, c3, c4, c5
+    assert graph.concept_ids[scheduler.current(mastery)] == "c2"
+    assert scheduler.is_completed(graph.positions["c1"])
+    assert not scheduler.is_completed(graph.positions["c3"])
@@ -0,0 +1,32 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+
+import serve
+
+
+def terminate_self():
+    serve._detach_from_supervisor([])
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def test_worker_sigterm_does_not_reach_the_supervisor():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stopped.set)
+        try:
+            # Forked from inside the running loop, as Supervisor.start_worker does
+            process = multiprocessing.get_context('fork').Process(target=terminate_self)
+            process.start()
+            exited = asyncio.Event()
+            loop.add_reader(process.sentinel, exited.set)
+            await asyncio.wait_for(exited.wait(), 10)
+            loop.remove_reader(process.sentinel)
+            process.join()
+            await asyncio.sleep(0.1) # Long enough for a wakeup byte to be read
+            return process.exitcode, stopped.is_set()
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+    assert asyncio.run(scenario()) == (0, False)
@@ -0,0 +1,165 @@
+import threading
+
+from src.sessions import SessionManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_manager(max_sessions=3, ttl_seconds=60, **kwargs):
+    """A SessionManager whose factory builds (student, tutor) placeholders and counts its calls."""
+    built = []
+    evicted = []
+
+    def factory(session_id):
+        built.append(session_id)
+        return object(), object()
+    manager = SessionManager(factory, max_sessions=max_sessions, ttl_seconds=ttl_seconds,
+                             on_evict=evicted.append, clock=FakeClock(), **kwargs)
+    return manager, built, evicted
+
+
+def test_get_creates_once_and_reuses():
+    manager, built, _ = make_manager()
+    first = manager.get("a")
+    assert manager.get("a") is first
+    assert built == ["a"]
+    assert manager.get("b", create=False) is None
+    assert "b" not in manager
+
+
+def test_lru_overflow_evicts_least_recently_used():
+    manager, _, evicted = make_manager(max_sessions=2)
+    manager.get("a")
+    manager.get("b")
+    manager.get("a") # b is now the least recently used
+    manager.get("c")
+    assert [s.session_id for s in evicted] == ["b"]
+    assert "a" in manager and "c" in manager and len(manager) == 2
+    assert manager.stats()["evicted"] == 1
+
+
+def test_ttl_expiry():
+    manager, built, evicted = make_manager(ttl_seconds=10)
+    first = manager.get("a")
+    manager.clock.now = 11
+    assert manager.get("a") is not first
+    assert evicted == [first] # Notified once
+    assert built == ["a", "a"]
+
+    manager.get("b")
+    manager.clock.now = 30
+    assert manager.evict_expired() == 2
+    assert len(manager) == 0
+
+
+def test_pinned_session_is_not_evicted_by_overflow():
+    manager, _, evicted = make_manager(max_sessions=1)
+    pinned = manager.get("a", pin=True)
+    manager.get("b")
+    assert "a" in manager and not evicted
+    manager.get("c")
+    assert "a" in manager
+
+    manager.release(pinned)
+    assert "a" not in manager
+    assert len(manager) == 1
+
+
+def test_pinned_session_is_not_expired():
+    manager, _, evicted = make_manager(ttl_seconds=10)
+    pinned = manager.get("a", pin=True)
+    manager.clock.now = 100
+    assert manager.evict_expired() == 0
+    assert manager.get("a") is pinned
+    manager.release(pinned)
+    manager.clock.now = 200
+    assert manager.evict_expired() == 1
+    assert evicted == [pinned]
+
+
+def test_new_session_is_kept_when_every_other_one_is_pinned():
+    manager, _, _ = make_manager(max_sessions=1)
+    pinned = manager.get("a", pin=True)
+    created = manager.get("b", pin=True)
+    assert "a" in manager and "b" in manager
+    manager.release(pinned)
+    manager.release(created)
+    assert len(manager) == 1
+
+
+def test_remove():
+    manager, _, evicted = make_manager()
+    session = manager.get("a")
+    assert manager.remove("a")
+    assert not manager.remove("a")
+    assert "a" not in manager and evicted == [session]
+
+
+def test_remove_waits_for_the_last_pin():
+    manager, built, evicted = make_manager()
+    first = manager.get("a", pin=True)
+    second = manager.get("a", pin=True)
+    assert manager.remove("a")
+    assert manager.get("a") is first and not evicted # Still in use: no second copy
+    manager.release(second)
+    assert "a" in manager and not evicted
+    manager.release(first)
+    assert "a" not in manager and evicted == [first]
+    assert manager.get("a") is not first
+    assert built == ["a", "a"]
+
+
+def test_concurrent_get_builds_one_session():
+    manager, built, _ = make_manager(max_sessions=100)
+    barrier = threading.Barrier(8)
+    sessions = []
+
+    def worker():
+        barrier.wait()
+        sessions.append(manager.get("a"))
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(session) for session in sessions}) == 1
+    assert manager.stats()["created"] == 1
+
+
+def test_on_evict_errors_do_not_propagate():
+    def factory(session_id):
+        return object(), object()
+
+    def on_evict(session):
+        raise RuntimeError("boom")
+    manager = SessionManager(factory, max_sessions=1, on_evict=on_evict, clock=FakeClock())
+    manager.get("a")
+    manager.get("b")
+    assert manager.stats()["evicted"] == 1
+
+
+def test_refresh_reloads_in_place():
+    manager, built, evicted = make_manager()
+    session = manager.get("a", epoch="1")
+    session.sent_concept_id = "c1"
+    session.sent_content_version = "v1"
+    assert not manager.refresh(session, "1")
+    assert not manager.refresh(session, None)
+    assert manager.refresh(session, "2")
+    assert manager.get("a", epoch="2") is session # Never a second copy
+    assert session.epoch == "2" and session.sent_concept_id is None and session.sent_content_version is None
+    assert built == ["a", "a"] and not evicted
+    assert manager.stats()["reloaded"] == 1
+
+
+def test_session_ids():
+    session_id = SessionManager.new_session_id()
+    assert SessionManager.is_valid_session_id(session_id)
+    assert not SessionManager.is_valid_session_id("x" * 32)
+    assert not SessionManager.is_valid_session_id(None)
@@ -0,0 +1,162 @@
+import json
+import os
+import random
+
+import pytest
+
+from src.history import InteractionLog
+from src.policies import SimpleDifficultyPolicy
+from src.shared_store import SharedStudentStore, StateTable
+from src.store import StudentStore
+from src.student import Student
+from src.tracers import TransformerKnowledgeTracer
+from src.tutor import Tutor
+from tests.conftest import load_content, write_tied_content
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def make_store(request, tmp_path):
+    """Builds stores over one backing state (the same file for SQLite, the same table in memory)."""
+    db_path = str(tmp_path / "students.db")
+    table = StateTable()
+
+    def make(snapshot_every=3, tracer_kind="placeholder"):
+        if request.param == "sqlite":
+            return StudentStore(db_path, snapshot_every=snapshot_every, tracer_kind=tracer_kind)
+        return SharedStudentStore(table, snapshot_every=snapshot_every, tracer_kind=tracer_kind)
+    return make
+
+
+def make_tutor(content_manager, store, student_id="s1"):
+    policy = SimpleDifficultyPolicy(
+        question_bank=content_manager.questions or [],
+        example_bank=content_manager.lessons or {},
+        content_manager=content_manager
+    )
+    tracer = TransformerKnowledgeTracer("", content_manager)
+    return Tutor(Student(student_id), policy, tracer, content_manager, store=store)
+
+
+def answer(tutor, count, seed=0):
+    """Answers `count` questions as the tutor asks them (right about half the time)."""
+    rng = random.Random(seed)
+    action = tutor.start_session()
+    for _ in range(count):
+        if action[0] != "question":
+            action = tutor.advance_concept()
+            continue
+        question = action[1]
+        user_answer = question['answer'] if rng.random() < 0.5 else "wrong"
+        action = tutor.submit_answer(question['id'], user_answer, rng.randint(500, 5000))
+    return action
+
+
+def assert_same_student(restored, original):
+    assert restored.student.history.to_columns() == original.student.history.to_columns()
+    assert restored.student.tracer_state == original.student.tracer_state
+    assert list(restored.student.get_state()) == list(original.student.get_state())
+    assert restored.student.seen_question_ids == original.student.seen_question_ids
+    assert restored.get_progress() == original.get_progress()
+
+
+@pytest.mark.parametrize("num_answers", [1, 3, 7, 14])
+def test_record_answer_then_restore(make_store, tied_content, num_answers):
+    """Covers no snapshot, a snapshot with no tail and a snapshot plus tail (snapshot_every=3)."""
+    original = make_tutor(tied_content, make_store())
+    action = answer(original, num_answers)
+
+    restored = make_tutor(tied_content, make_store())
+    assert restored.store.restore(restored)
+    assert_same_student(restored, original)
+    assert restored.next_action() == action
+
+
+def test_integer_question_ids_round_trip(make_store, tmp_path):
+    data_dir = write_tied_content(str(tmp_path / "data"))
+    path = os.path.join(data_dir, 'question.json')
+    with open(path, encoding='utf-8') as f:
+        questions = json.load(f)
+    for question in questions:
+        question['id'] = int(question['id'][1:])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(questions, f)
+    content = load_content(data_dir)
+
+    original = make_tutor(content, make_store())
+    action = answer(original, 1)
+    asked = original.student.history.question_id(0)
+    assert isinstance(asked, int)
+
+    restored = make_tutor(content, make_store())
+    assert restored.store.restore(restored)
+    assert restored.student.seen_question_ids == {asked}
+    assert restored.next_action() == action
+    assert restored.next_action()[1]['id'] != asked
+
+
+def test_restore_unknown_student(make_store, tied_content):
+    tutor = make_tutor(tied_content, make_store(), student_id="nobody")
+    assert not tutor.store.restore(tutor)
+    assert len(tutor.student.history) == 0
+    assert tutor.student.tracer_state == tutor.tracer.init_state()
+
+
+def test_restore_after_snapshot_if_dirty(make_store, tied_content):
+    original = make_tutor(tied_content, make_store(snapshot_every=100))
+    answer(original, 5)
+    original.store.snapshot_if_dirty(original.student)
+
+    restored = make_tutor(tied_content, make_store(snapshot_every=100))
+    assert restored.store.restore(restored)
+    assert_same_student(restored, original)
+
+
+def test_restore_retraces_states_of_another_tracer(make_store, tied_content):
+    writer = make_tutor(tied_content, make_store(tracer_kind="windowed:4:50"))
+    answer(writer, 7)
+    writer.student.tracer_state = "not a placeholder state" # What another tracer could have stored
+    writer.store.snapshot(writer.student)
+
+    restored = make_tutor(tied_content, make_store())
+    assert restored.store.restore(restored)
+    assert restored.student.tracer_state == restored.tracer.trace(writer.student.history)
+
+
+def test_newer_snapshot_is_not_replaced(make_store, tied_content):
+    original = make_tutor(tied_content, make_store(snapshot_every=100))
+    answer(original, 6)
+    store = original.store
+    history = original.student.history
+    store.snapshot(original.student)
+
+    # An offline writer holding an older copy of the history
+    older = InteractionLog()
+    for position in range(3):
+        row = history.row(position)
+        older.append(row['question_id'], row['is_correct'], row['response_time_ms'], row['timestamp'])
+    store.write_snapshots([(original.student.student_id, older, original.tracer.trace(older))])
+
+    restored = make_tutor(tied_content, make_store(snapshot_every=100))
+    restored.store.restore(restored)
+    assert restored.student.history.to_columns() == history.to_columns()
+
+
+def test_progress_follows_concept_ids_when_the_content_changes(make_store, tmp_path):
+    data_dir = write_tied_content(str(tmp_path / "data"))
+    original = make_tutor(load_content(data_dir), make_store())
+    original.start_session()
+    original.advance_concept() # Completes c1
+    assert original.scheduler.completed_ids() == ["c1"]
+
+    # A new first concept moves every topological position by one
+    path = os.path.join(data_dir, 'knowledge.json')
+    with open(path, encoding='utf-8') as f:
+        knowledge = json.load(f)
+    knowledge['concepts'].append({"id": "c0", "name": "Concept 0"})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(knowledge, f)
+
+    restored = make_tutor(load_content(data_dir), make_store())
+    assert restored.store.restore(restored)
+    assert restored.scheduler.completed_ids() == ["c1"]
+    assert restored.concepts_to_teach[restored.current_concept_index()]['id'] == "c0"
@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+from src.history import InteractionLog
+from src.kt_model import KnowledgeModel, load_numpy
+from src.tracers import TransformerKnowledgeTracer, WindowedKnowledgeTracer
+
+
+def random_history(content_manager, length, seed=0):
+    """An InteractionLog of `length` answers to random questions of the bank."""
+    rng = random.Random(seed)
+    question_ids = [q['id'] for q in content_manager.questions]
+    history = InteractionLog()
+    for _ in range(length):
+        history.append(rng.choice(question_ids), rng.random() < 0.6, rng.randint(500, 5000))
+    return history
+
+
+@pytest.fixture(params=["placeholder", "float32", "float16", "int8"])
+def tracer(request, tied_content, tmp_path):
+    """Every tracer, the windowed one at each saved precision (window 5, so histories overflow it)."""
+    if request.param == "placeholder":
+        tracer = TransformerKnowledgeTracer(str(tmp_path / "missing.pt"), tied_content)
+    else:
+        path = str(tmp_path / "tracer.npz")
+        KnowledgeModel.create(tied_content.index.num_concepts, window=5, dim=8, seed=1).save(
+            path, precision=request.param)
+        tracer = WindowedKnowledgeTracer(path, tied_content)
+    tracer.load()
+    return tracer
+
+
+def assert_same_mastery(actual, expected):
+    np = load_numpy()
+    assert len(actual) == len(expected)
+    assert np.allclose(np.asarray(actual), np.asarray(expected), atol=1e-6)
+
+
+@pytest.mark.parametrize("length", [0, 1, 4, 23])
+def test_step_matches_full_recompute(tracer, tied_content, length):
+    history = random_history(tied_content, length)
+    state = tracer.init_state()
+    partial = InteractionLog()
+    for position in range(length):
+        row = history.row(position)
+        partial.append(row['question_id'], row['is_correct'], row['response_time_ms'], row['timestamp'])
+        state = tracer.step(state, row)
+        assert tracer.check_consistency(state, partial)
+    assert state == tracer.trace(history)
+    assert_same_mastery(tracer.get_mastery(state), tracer.update_state(history))
+
+
+def test_step_does_not_modify_its_input(tracer, tied_content):
+    history = random_history(tied_content, 8)
+    state = tracer.trace(history)
+    before = tracer.trace(history)
+    tracer.step(state, {"question_id": tied_content.questions[0]['id'], "is_correct": True})
+    assert state == before
+
+
+def test_trace_of_rows_matches_trace_of_log(tracer, tied_content):
+    history = random_history(tied_content, 12)
+    assert tracer.trace(list(history)) == tracer.trace(history)
+
+
+def test_step_batch_matches_step(tracer, tied_content):
+    histories = [random_history(tied_content, length, seed=length) for length in (0, 3, 7, 11)]
+    states = [tracer.trace(history) for history in histories]
+    rng = random.Random(4)
+    interactions = [{"question_id": rng.choice(tied_content.questions)['id'], "is_correct": rng.random() < 0.5}
+                    for _ in histories]
+    batched = tracer.step_batch(states, interactions)
+    single = [tracer.step(state, interaction) for state, interaction in zip(states, interactions)]
+    assert batched == single
+    for a, b in zip(batched, single):
+        assert_same_mastery(tracer.get_mastery(a), tracer.get_mastery(b))
+
+
+def test_trace_many_matches_trace(tracer, tied_content):
+    histories = [random_history(tied_content, length, seed=length) for length in (0, 2, 9)]
+    for many, history in zip(tracer.trace_many(histories), histories):
+        assert many == tracer.trace(history)
+        assert_same_mastery(tracer.get_mastery(many), tracer.update_state(history))
+
+
+def test_mastery_sequence_is_mastery_before_each_answer(tracer, tied_content):
+    history = random_history(tied_content, 13)
+    state = tracer.init_state()
+    sequence = list(tracer.mastery_sequence(history))
+    assert len(sequence) == len(history)
+    for position, mastery in enumerate(sequence):
+        assert_same_mastery(mastery, tracer.get_mastery(state))
+        state = tracer.step(state, history.row(position))
+
+
+def test_mastery_follows_concept_order(tracer, tied_content):
+    mastery = tracer.get_mastery(tracer.init_state())
+    assert len(mastery) == tied_content.index.num_concepts
+    assert list(tracer.mastery_as_dict(mastery)) == [
+        f"{concept_id}_mastery" for concept_id in tied_content.index.concept_ids]
@@ -0,0 +1,137 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src import wire
+
+
+def question(**fields):
+    base = {"id": "q1", "concept_id": "c1", "difficulty": 0.4, "type": "mcq", "text": "?",
+            "options": ["a", "b"], "answer": "b", "answers": ["b", "B"], "tolerance": 0.1}
+    base.update(fields)
+    return base
+
+
+def test_questions_never_carry_their_answer(content_manager):
+    index = content_manager.index
+    for protocol in (wire.PROTOCOL_DEFAULT, wire.PROTOCOL_COMPACT):
+        payload = wire.action_payload(("question", question(), "c1"), index, protocol)
+        body = json.dumps(payload)
+        assert "answer" not in body and "tolerance" not in body
+        lookahead = json.dumps(wire.lookahead_payload([question(), question(id="q2")], "c1", protocol))
+        assert "answer" not in lookahead and "tolerance" not in lookahead
+
+
+def test_protocol_1_keeps_the_original_shape(content_manager):
+    payload = wire.action_payload(("question", question(), "c1"), content_manager.index)
+    assert payload == {
+        "action": {"type": "question", "content": {
+            "id": "q1", "concept_id": "c1", "difficulty": 0.4, "type": "mcq", "text": "?", "options": ["a", "b"]}},
+        "current_concept_id": "c1",
+    }
+
+
+def test_protocol_2_sends_ids_and_concept_deltas(content_manager):
+    index = content_manager.index
+    session = SimpleNamespace(sent_concept_id=None, sent_content_version=None)
+    first = wire.action_payload(("question", question(), "c1"), index, wire.PROTOCOL_COMPACT, session)
+    assert first == {"action": {"type": "question", "id": "q1",
+                                "question": {"type": "mcq", "text": "?", "options": ["a", "b"]}},
+                     "concept": "c1", "content_version": index.version}
+    second = wire.action_payload(("question", question(id="q2"), "c1"), index, wire.PROTOCOL_COMPACT, session)
+    assert "concept" not in second and "content_version" not in second
+    third = wire.action_payload(("question", question(id="q3"), "c2"), index, wire.PROTOCOL_COMPACT, session)
+    assert third["concept"] == "c2"
+
+
+def test_protocol_2_sends_a_new_content_version(content_manager, tied_content):
+    session = SimpleNamespace(sent_concept_id=None, sent_content_version=None)
+    wire.action_payload(("question", question(), "c1"), content_manager.index, wire.PROTOCOL_COMPACT, session)
+    reloaded = wire.action_payload(("question", question(), "c1"), tied_content.index, wire.PROTOCOL_COMPACT, session)
+    assert reloaded["content_version"] == tied_content.index.version
+    assert "content_version" not in wire.action_payload(("question", question(), "c1"), content_manager.index)
+
+
+def test_protocol_2_examples_are_sent_by_id(content_manager):
+    index = content_manager.index
+    lesson_id, lesson = next(iter(content_manager.lessons.items()))
+    payload = wire.action_payload(("example", lesson, lesson['concept_id']), index, wire.PROTOCOL_COMPACT)
+    assert payload["action"] == {"type": "example", "id": lesson_id}
+    unknown = {"concept_id": "c1", "title": "not in the bank"}
+    payload = wire.action_payload(("example", unknown, "c1"), index, wire.PROTOCOL_COMPACT)
+    assert payload["action"] == {"type": "example", "id": None, "content": unknown}
+
+
+def test_start_payload_always_sends_the_concept_and_version(content_manager):
+    index = content_manager.index
+    session = SimpleNamespace(sent_concept_id="c1", sent_content_version=index.version)
+    tutor = SimpleNamespace(concepts_to_teach=index.ordered_concepts)
+    payload = wire.start_payload(("question", question(), "c1"), tutor, index, wire.PROTOCOL_COMPACT, session)
+    assert payload["concept"] == "c1"
+    assert payload["content_version"] == index.version
+    assert "concepts" not in payload
+    payload = wire.start_payload(("question", question(), "c1"), tutor, index)
+    assert payload["concepts"] == index.ordered_concepts
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, 1), ("1", 1), ("2", 2), ("3", 2), ("x", 1), ("-1", 1),
+])
+def test_parse_protocol(value, expected):
+    assert wire.parse_protocol(value) == expected
+
+
+def test_parse_answers():
+    answers = [{"question_id": "q1", "user_answer": "a", "response_time_ms": 10},
+               {"question_id": 7, "user_answer": "b", "response_time_ms": 20}]
+    assert wire.parse_answers({"answers": answers}) == [("q1", "a", 10), (7, "b", 20)]
+    for bad in (None, {}, {"answers": []}, {"answers": "x"}, {"answers": [1]},
+                {"answers": [{"question_id": "q1"}]},
+                {"answers": [{"question_id": ["q1"], "user_answer": "a", "response_time_ms": 1}]},
+                {"answers": [{"question_id": True, "user_answer": "a", "response_time_ms": 1}]},
+                {"answers": answers * wire.MAX_BATCH_ANSWERS}):
+        with pytest.raises(ValueError):
+            wire.parse_answers(bad)
+
+
+def test_parse_answer():
+    assert wire.parse_answer({"question_id": 7, "user_answer": "b", "response_time_ms": 20}) == (7, "b", 20)
+    with pytest.raises(ValueError, match="'question_id' must be a string or an integer"):
+        wire.parse_answer({"question_id": 1.5, "user_answer": "b", "response_time_ms": 20})
+    with pytest.raises(ValueError, match="Missing"):
+        wire.parse_answer({"question_id": "q1"})
+    with pytest.raises(ValueError):
+        wire.parse_answer(None)
+
+
+def test_parse_count():
+    assert wire.parse_count(None) == 5
+    assert wire.parse_count("0") == 1
+    assert wire.parse_count("1000") == wire.MAX_LOOKAHEAD
+
+
+def test_content_bundle_is_encoded_once_per_version(content_manager, tied_content):
+    bundle = wire.ContentBundle()
+    body = bundle.body(content_manager.index)
+    assert bundle.body(content_manager.index) is body
+    decoded = json.loads(body)
+    assert decoded["version"] == content_manager.index.version
+    assert decoded["lessons"] == content_manager.lessons
+    assert [c["id"] for c in decoded["concepts"]] == content_manager.index.concept_ids
+    assert json.loads(bundle.body(tied_content.index))["version"] == tied_content.index.version
+
+
+def test_content_etag(content_manager):
+    index = content_manager.index
+    headers = dict(wire.ContentBundle.headers(index))
+    assert headers["ETag"] == f'"{index.version}"'
+    assert headers["Cache-Control"] == "no-cache"
+    assert "immutable" in dict(wire.ContentBundle.headers(index, index.version))["Cache-Control"]
+    assert dict(wire.ContentBundle.headers(index, "stale"))["Cache-Control"] == "no-cache"
+
+    assert wire.ContentBundle.not_modified(index, headers["ETag"])
+    assert wire.ContentBundle.not_modified(index, f'"other", W/"{index.version}"')
+    assert wire.ContentBundle.not_modified(index, "*")
+    assert not wire.ContentBundle.not_modified(index, '"other"')
+    assert not wire.ContentBundle.not_modified(index, None)